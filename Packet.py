@@ -18,7 +18,11 @@
     |__________________________________________________________________________________________________________________|
 
     Version:
-        For now version is 1
+        1: Every body is plain text.
+        2: Reunion and Advertise bodies are binary (see their v2 formats below); The other bodies are the same as
+           version 1. A response has the version of its request and a relayed packet keeps its version.
+        3: Only for Message packets; The body is compressed (see the Message v3 format below).
+        4: Only for Message packets; The body is compressed and has a message ID (see the Message v4 format below).
     
     Type:
         1: Register
@@ -26,6 +30,11 @@
         3: Join
         4: Message
         5: Reunion
+        6: Replicate
+        7: Fragment
+        8: Stripe
+        9: Unicast
+        10: History
                 e.g: type = '2' => Advertise packet.
     Length:
         This field shows the character numbers for Body of the packet.
@@ -61,9 +70,12 @@
                 |                  IP (15 Chars)                 |
                 |------------------------------------------------|
                 |                 Port (5 Chars)                 |
+                |------------------------------------------------|
+                |               Features (4 Chars)               |
                 |________________________________________________|
                 
                 For sending IP/Port of the current node to the root to ask if it can register to network or not.
+                Features are optional; see the Features section.
 
             Response:
         
@@ -72,10 +84,17 @@
                 |                  RES (3 Chars)                  |
                 |-------------------------------------------------|
                 |                  ACK (3 Chars)                  |
+                |-------------------------------------------------|
+                |              Reunion Phase (3 Chars)            |
+                |-------------------------------------------------|
+                |                Features (4 Chars)               |
                 |_________________________________________________|
                 
                 For now only should just send an 'ACK' from the root to inform a node that it
                 has been registered in the root if the 'Register Request' was successful.
+                The Reunion Phase is optional; It is the suggested offset of the node Reunion Hello packets in
+                thousandths of the Reunion interval (e.g. '250' means a quarter of the interval).
+                Features are optional too, so the body has 6, 9, 10 or 13 chars.
                 
         Advertise:
             Request:
@@ -96,20 +115,57 @@
                 |              Server IP (15 Chars)              |
                 |------------------------------------------------|
                 |             Server Port (5 Chars)              |
+                |------------------------------------------------|
+                |         Backup Server IP (15 Chars)            |
+                |------------------------------------------------|
+                |         Backup Server Port (5 Chars)           |
                 |________________________________________________|
                 
                 Root will response Advertise Request packet with sending IP/Port of the requester peer in this packet.
+                The backup IP/Port is optional; The requester will join it immediately when its parent fails.
+
+            Version 2:
+                The request is the same; In the response every IP/Port is 4 bytes of IPv4 and 2 bytes of port
+                (big-endian), so the body is 'RES' and 6 or 12 bytes.
                 
         Join:
 
                                 ** Body Format **
                  ________________________________________________
                 |                 JOIN (4 Chars)                 |
+                |------------------------------------------------|
+                |               Features (4 Chars)               |
+                |------------------------------------------------|
+                |               REQ or RES (3 Chars)             |
+                |------------------------------------------------|
+                |                    H (1 Char)                  |
+                |------------------------------------------------|
+                |         Origin0 IP/Port (12 Hex Chars)         |
+                |------------------------------------------------|
+                |        Last Sequence0 (16 Hex Chars)           |
+                |------------------------------------------------|
+                |                     ...                        |
                 |________________________________________________|
             
             New node after getting Advertise Response from root must send this packet to the specified peer
             to tell him that they should connect together; When receiving this packet we should update our
             Client Dictionary in the Stream object.
+            Features and REQ/RES are optional (old peers send only 'JOIN'); A peer which receives a Join Request with
+            Features answers with a Join Response with its own Features.
+            The 'H' and the entries after it are optional too; A peer with the Message History feature sends the
+            last message ID that it has seen from every origin (at most history_origins of them) in its Join Request,
+            and its new parent sends back the newer messages of its history in History packets.
+
+        Features:
+            A peer announces the features that it supports as 4 hex chars of a bitmap in its Register Request and
+            Join Request, and the other side answers with its own bitmap. Every link uses only the features that
+            both of its sides support:
+                0001: Version 2 bodies (binary Reunion and Advertise bodies).
+                0002: Fragment packets.
+                0004: Binary Message bodies (version 2 Message packets).
+                0008: Compressed Message bodies (version 3 Message packets); Only used with 0004.
+                0010: Striped trees (Stripe packets); The root only puts the peers with this feature in the trees.
+                0020: Message History (version 4 Message packets and History packets); Only used with 0004 and 0008.
 
 
             
@@ -119,7 +175,125 @@
                 |             Message (#Length Chars)            |
                 |________________________________________________|
 
-            The message that want to broadcast to whole network. Right now this type only includes a plain text.
+            The message that want to broadcast to whole network. In version 1 the body is a plain text; In version 2
+            it is any bytes and is never decoded by the peers which forward it, it is only sent on the links with the
+            Binary Message feature. A message which does not fit in one packet is sent in Fragment packets.
+
+            Version 3 (Compressed Message):
+                                ** Body Format **
+                 ________________________________________________
+                |                 Codec (1 Byte)                 |
+                |------------------------------------------------|
+                |         Payload (#Length - 1 Bytes)            |
+                |________________________________________________|
+
+            Codec 0 is the message itself and codec 1 is zlib. The origin compresses the message once (small
+            messages and the ones which do not get smaller keep codec 0) and middle peers forward the body as it is
+            on the links with the Compressed Message feature; It is only decompressed for the other links and for
+            the middle peer itself. The decompressed message is at most fragment_size bytes.
+
+            Version 4 (Message with ID):
+                                ** Body Format **
+                 ________________________________________________
+                |    Origin IP (4 Bytes)  | Origin Port (2 Bytes)|
+                |------------------------------------------------|
+                |            Sequence Number (8 Bytes)           |
+                |------------------------------------------------|
+                |    Version 3 Body (#Length - 14 Bytes)         |
+                |________________________________________________|
+
+            The origin and its sequence number are the ID of the message; The sequence numbers of an origin only
+            grow, so a peer drops a message which is not newer than the last one of its origin. Every peer keeps
+            the recent messages in its MessageHistory (large messages in Fragment packets are not kept). A message
+            which arrives from a link without the Message History feature gets its ID from the first peer with the
+            feature.
+
+        History:
+                                ** Body Format **
+                 ________________________________________________
+                |   Origin0 IP (4 Bytes)  | Origin0 Port (2 Bytes)|
+                |------------------------------------------------|
+                |           Sequence Number0 (8 Bytes)           |
+                |------------------------------------------------|
+                |              Length0 (2 Bytes)                 |
+                |------------------------------------------------|
+                |       Version 3 Body0 (#Length0 Bytes)         |
+                |------------------------------------------------|
+                |                     ...                        |
+                |________________________________________________|
+
+            The messages which a joining peer has missed, from its new parent right after the Join Response; The
+            body is binary in every version and a batch of messages is sent in as few packets as possible (every
+            packet fits in one read of the TCPServer). The joining peer handles every message like a version 4
+            Message packet, so it also forwards the new ones to its children.
+
+        Fragment:
+                                ** Body Format **
+                 ________________________________________________
+                |             Message ID (8 Bytes)               |
+                |------------------------------------------------|
+                |           Message Size (8 Bytes)               |
+                |------------------------------------------------|
+                |                Offset (8 Bytes)                |
+                |------------------------------------------------|
+                |            Data (#Length - 24 Bytes)           |
+                |________________________________________________|
+
+            A piece of a broadcast message; The numbers are big-endian and the body is binary in every version.
+            The sender gives the message a random ID and every packet (with the header) fits in one read of the
+            TCPServer. Middle peers forward every fragment as soon as it arrives, and every peer puts the data at
+            its offset until it has the whole message. Fragments are only sent on links with the Fragment feature.
+            When the root keeps striped trees (see Stripe) the fragments are only sent on the links of their trees.
+
+        Stripe:
+            Parents:
+
+                                ** Body Format **
+                 ________________________________________________
+                |                  RES (3 Bytes)                 |
+                |------------------------------------------------|
+                |          Number of Trees (1 Byte)              |
+                |------------------------------------------------|
+                |      IP0 (4 Bytes)     |    Port0 (2 Bytes)    |
+                |------------------------------------------------|
+                |                     ...                        |
+                |________________________________________________|
+
+                The root keeps a number of trees over all of the peers (every peer is interior in only one of them)
+                and sends a peer its parent in every tree when it is placed and when the parents change. The body is
+                binary in every version.
+
+            Link:
+
+                                ** Body Format **
+                 ________________________________________________
+                |                  ADD (3 Bytes)                 |
+                |------------------------------------------------|
+                |              Tree Bitmap (2 Bytes)             |
+                |________________________________________________|
+
+                A peer tells its parent which trees the link between them is in; A zero bitmap removes the link.
+
+            The i-th fragment of a large message (its offset divided by fragment_size) is sent on the tree number
+            'i mod number of trees', so the fragments are striped round-robin and every peer forwards a fragment
+            only on the links of its tree. The trees carry no other packets and the links are lazy connections like
+            the register connections.
+
+        Unicast:
+                                ** Body Format **
+                 ________________________________________________
+                |                  TTL (1 Byte)                  |
+                |------------------------------------------------|
+                |    Origin IP (4 Bytes)  | Origin Port (2 Bytes)|
+                |------------------------------------------------|
+                |  Destination IP (4 Bytes) | Dest. Port (2 Bytes)|
+                |------------------------------------------------|
+                |         Message (#Length - 13 Bytes)           |
+                |________________________________________________|
+
+            A message for one peer; The body is binary in every version. Every peer sends it to the child which the
+            destination is under it (see RoutingTable) or up to its parent, so it takes at most two times the depth
+            of the tree hops. Every hop decreases the TTL and the packet is dropped when it is zero.
         
         Reunion:
             Hello:
@@ -170,33 +344,119 @@
                 |                 IP0 (15 Chars)                 |
                 |------------------------------------------------|
                 |                Port0 (5 Chars)                 |
+                |------------------------------------------------|
+                |         Backup Server IP (15 Chars)            |
+                |------------------------------------------------|
+                |         Backup Server Port (5 Chars)           |
                 |________________________________________________|
 
                 Root in an answer to the Reunion Hello message will send this packet to the target node.
                 In this packet, all the nodes (IP, port) exist in order by path traversal to target.
+                The backup IP/Port is optional and it is the refreshed backup parent for the target node; The middle
+                nodes should keep it when they are passing the packet.
+
+            Version 2:
+
+                                ** Body Format **
+                 ________________________________________________
+                |               REQ or RES (3 Bytes)             |
+                |------------------------------------------------|
+                |          Number of Entries (2 Bytes)           |
+                |------------------------------------------------|
+                |      IP0 (4 Bytes)     |    Port0 (2 Bytes)    |
+                |------------------------------------------------|
+                |                     ...                        |
+                |------------------------------------------------|
+                |  Backup IP (4 Bytes)   | Backup Port (2 Bytes) |
+                |________________________________________________|
+
+                Same as version 1 with 6 bytes for every IP/Port and a big-endian unsigned number of entries.
+
+            Summary:
+                The same body as Hello with 'SUM' instead of 'REQ'; The entries are the peers of the sender's sub-tree
+                which are alive. A peer does not send Hellos while data passes the link to its parent (a data packet
+                or the ACK of our data packet has arrived in the last idle_threshold seconds); Its parent vouches for
+                it instead. Every cycle a peer sends one Summary to its parent with its active children and the
+                entries of the Summaries of its children, so the root receives a Summary from each of its children
+                instead of a Hello from every peer. Summaries are not answered and a Hello is still sent on an idle
+                link.
+
+            Probe:
+                The same body as Hello with 'PRB' instead of 'REQ' and no entries. Stream sends it on a link that has
+                been idle for probe_interval seconds; Only its ACK matters, the packet itself is ignored. A dead or
+                hung peer does not answer it, so the link down is noticed in a few seconds.
+
+        Replicate:
+            Request:
+
+                                ** Body Format **
+                 ________________________________________________
+                |                  REQ (3 Chars)                 |
+                |________________________________________________|
+
+                A standby root sends this packet to the primary root to receive the whole state of the network.
+
+            Response:
+
+                                ** Body Format **
+                 ________________________________________________
+                |                  RES (3 Chars)                 |
+                |------------------------------------------------|
+                |               Operation0 (1 Char)              |
+                |------------------------------------------------|
+                |                 IP0 (15 Chars)                 |
+                |------------------------------------------------|
+                |                Port0 (5 Chars)                 |
+                |------------------------------------------------|
+                |       Argument0 (0, 1 or 20 Chars)             |
+                |------------------------------------------------|
+                |                     ...                        |
+                |________________________________________________|
+
+                The primary root sends the changes of its state to the standby root in every interval; A packet with
+                no operations is a heartbeat.
+                Operations:
+                    S: Reset the state (no IP/Port).
+                    A: Add node, the argument is the father IP/Port.
+                    M: Move node, the argument is the new father IP/Port.
+                    R: Remove node.
+                    N: Turn on node, the argument is '1' for the whole sub-tree and '0' for the node only.
+                    F: Turn off node, the argument is like N.
+                    G: Register node.
+                    H: Reunion Hello arrived from node.
             
     
 """
 import unittest
 import warnings
+import zlib
 from struct import *
 
-from tools.Node import Node
+from tools.PeerAddress import PeerAddress
 
 import logging
 
 logging.basicConfig(format='%(asctime)s %(message)s')
 
+# version, type, length; The source IP/Port bytes follow it
+header_struct = Struct('>HHI')
+
 
 class Packet:
-    def __init__(self, buf):
+    __slots__ = ('buf', 'address')
+
+    def __init__(self, buf, address=None):
         """
         The decoded buffer should convert to a new packet.
 
         :param buf: Input buffer was just decoded.
+        :param address: The source server address if it is already a PeerAddress.
+
         :type buf: list
+        :type address: PeerAddress
         """
         self.buf = buf
+        self.address = address if address is not None else PeerAddress.from_text(buf[3], buf[4])
 
     def get_header(self):
         """
@@ -238,18 +498,31 @@ class Packet:
         """
         return self.buf[5]
 
+    def get_request_type(self):
+        """
+
+        :return: 'REQ' or 'RES' for request/response packets (the first 3 characters of the body) in every version.
+        :rtype: str
+        """
+        request_type = self.buf[5][0:3]
+        if isinstance(request_type, bytes):
+            return request_type.decode()
+        return request_type
+
     def get_buf(self):
         """
         In this function, we will make our final buffer that represents the Packet with the Struct class methods.
+        The length of the header is the number of the body bytes, so the receiver can find the end of the packet
+        (a text body may have more bytes than characters).
 
         :return The parsed packet to the network format.
         :rtype: bytearray
         """
-        ip_splits = self.get_source_server_ip().split(".")
+        body = self.buf[5]
+        if isinstance(body, str):
+            body = body.encode()
 
-        return pack('>HHIHHHHI', self.get_version(), self.get_type(), self.get_length(),
-                    int(ip_splits[0]), int(ip_splits[1]), int(ip_splits[2]), int(ip_splits[3]),
-                    int(self.get_source_server_port())) + str.encode(self.get_body())
+        return header_struct.pack(self.buf[0], self.buf[1], len(body)) + self.address.header + body
 
     def get_source_server_ip(self):
         """
@@ -271,10 +544,9 @@ class Packet:
         """
 
         :return: Server address; The format is like ('192.168.001.001', '05335').
-        :rtype: tuple
+        :rtype: PeerAddress
         """
-        ret = (self.get_source_server_ip(), self.get_source_server_port())
-        return ret
+        return self.address
 
 
 class PacketFactory:
@@ -282,83 +554,412 @@ class PacketFactory:
     This class is only for making Packet objects.
     """
 
+    # Replicate operation codes
+    replicate_codes = {'reset': 'S', 'add': 'A', 'move': 'M', 'remove': 'R', 'on': 'N', 'off': 'F',
+                       'register': 'G', 'hello': 'H'}
+    replicate_operations = {code: operation for operation, code in replicate_codes.items()}
+
+    # version 2 bodies: IPv4/Port entries and the number of entries
+    address_struct = PeerAddress.PACKED
+    entry_struct = Struct('6s')
+    count_struct = Struct('>H')
+    # types which have binary bodies in version 2
+    binary_types = (2, 4, 5)
+    # Fragment bodies are binary in every version
+    fragment_type = 7
+    # message ID, message size, offset
+    fragment_struct = Struct('>QQQ')
+    # data bytes in a Fragment packet, so the packet is 2048 bytes (one read of the TCPServer)
+    fragment_size = 2048 - 20 - fragment_struct.size
+    # the header and the source address of every packet
+    header_size = header_struct.size + 12
+    # our TCPServer does not wait for the rest of a longer packet
+    max_packet_size = 16 * 1024 * 1024
+    # Stripe bodies are binary in every version too
+    stripe_type = 8
+    stripe_count_struct = Struct('B')
+    stripe_bitmap_struct = Struct('>H')
+    max_stripes = 16
+    # Unicast bodies are binary in every version too; TTL, origin and destination
+    unicast_type = 9
+    unicast_struct = Struct('B6s6s')
+    unicast_ttl = 64
+    # message bytes in a Unicast packet, so the packet is 2048 bytes (one read of the TCPServer)
+    unicast_size = 2048 - 20 - unicast_struct.size
+    # History bodies are binary in every version too; origin, sequence number and length of every message
+    history_type = 10
+    history_struct = Struct('>6sQH')
+    history_size = 2048 - 20
+    # origin and sequence number of a version 4 Message body
+    message_id_struct = Struct('>6sQ')
+    # entries of the last seen messages in a Join, so the Join is at most 2048 bytes
+    history_origins = 64
+    # Register, Advertise, Join, Reunion, Replicate and Stripe packets keep the network running, Stream sends them
+    # before the data packets (Message, Fragment, Unicast and History)
+    control_types = (1, 2, 3, 5, 6, 8)
+
+    # feature bits of the Register and Join handshakes
+    feature_binary_bodies = 0x0001
+    feature_fragments = 0x0002
+    feature_binary_messages = 0x0004
+    feature_compressed_messages = 0x0008
+    feature_striped_trees = 0x0010
+    feature_message_history = 0x0020
+    # features of this implementation
+    supported_features = feature_binary_bodies | feature_fragments | feature_binary_messages | \
+        feature_compressed_messages | feature_striped_trees | feature_message_history
+
+    # codecs of version 3 Message bodies, {codec: (compress(data, level), decompress(data, max_length))};
+    # decompress raises ValueError for a wrong body or when the message is longer than max_length
+    message_codecs = {}
+    message_codec_zlib = 1
+    # smaller messages are not compressed
+    compression_threshold = 128
+
+    @staticmethod
+    def get_version(features):
+        """
+        The fastest body format for a link.
+
+        :param features: Agreed features of the link.
+        :type features: int
+
+        :return: Packet version.
+        :rtype: int
+        """
+        if features & PacketFactory.feature_binary_bodies:
+            return 2
+        return 1
+
+    @staticmethod
+    def parse_features(features):
+        """
+        :param features: 4 hex chars of a feature bitmap.
+        :type features: str
+
+        :return: The feature bitmap or None if it is not correct.
+        :rtype: int
+        """
+        try:
+            return int(features, 16) if len(features) == 4 else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def is_control_buffer(buf):
+        """
+        :param buf: The buffer of a packet.
+        :type buf: bytes
+
+        :return: Whether the packet is a control packet.
+        :rtype: bool
+        """
+        return len(buf) >= header_struct.size and header_struct.unpack_from(buf)[1] in PacketFactory.control_types
+
+    @staticmethod
+    def frame_length(buf):
+        """
+        The frame_length of our TCPServer, so it hands up whole packets.
+
+        :param buf: The received start of a packet.
+        :type buf: bytes
+
+        :return: Number of bytes of the packet, or None if its header has not arrived yet; A length which is more
+                 than max_packet_size is not believed, the packet is what has arrived.
+        :rtype: int
+        """
+        if len(buf) < PacketFactory.header_size:
+            return None
+        length = PacketFactory.header_size + header_struct.unpack_from(buf)[2]
+        return length if length <= PacketFactory.max_packet_size else len(buf)
+
     @staticmethod
     def parse_buffer(buf):
         """
         In this function we will make a new Packet from input buffer with struct class methods.
 
-        :param buf: The buffer that should be parse to a validate packet format
+        :param buf: The buffer that should be parse to a validate packet format; bytes or a memoryview of the
+                    TCPServer receive buffer. The body of a Fragment is a view of it, so the fragments are not
+                    copied until they reach their message (the buffer is reused when the packet is gone); The
+                    other packets do not refer to it.
 
         :return new packet
         :rtype: Packet
 
         """
         try:
-            version = buf[0:2]
-            typ = buf[2:4]
-            length = buf[4:8]
-            ip = buf[8:16]
-            port = buf[16:20]
-            body = buf[20:]
-            version = unpack_from('>H', version)[0]
-            type = unpack_from('>H', typ)[0]
-            length = unpack_from('>I', length)[0]
-            ip_tuple = unpack_from('>HHHH', ip)
-            ip = ""
-            for t in ip_tuple:
-                ip += '.' + str(t)
-            ip = ip[1:]
-            port = str(unpack_from('>I', port)[0])
-            ip = Node.parse_ip(ip)
-            port = Node.parse_port(port)
-            body = body.decode("utf-8")
-
-            pck = [version, type, length, ip, port, body]
-
-            return Packet(pck)
-        except:
+            version, type, length = header_struct.unpack_from(buf)
+            address = PeerAddress.from_header(bytes(buf[8:20]))
+            if type == PacketFactory.fragment_type:
+                body = buf[20:]
+            elif type in (PacketFactory.stripe_type, PacketFactory.unicast_type, PacketFactory.history_type) or \
+                    (version == 2 and type in PacketFactory.binary_types) or \
+                    (version in (3, 4) and type == 4):
+                body = bytes(buf[20:])
+            else:
+                body = str(buf[20:], "utf-8")
+        except (error, ValueError):
             # any error means the packet's format was wrong
             logging.warning('received packet format was wrong')
             return None
 
+        return Packet([version, type, length, address.ip, address.port, body], address)
+
+    @staticmethod
+    def parse_many(buffers):
+        """
+        Parse a batch of buffers, like the TCPServer input buffer of one main loop cycle.
+
+        :param buffers: Received buffers.
+        :type buffers: list
+
+        :return: A Packet for every buffer; None for the buffers with a wrong format.
+        :rtype: list
+        """
+        return [PacketFactory.parse_buffer(buf) for buf in buffers]
+
     @staticmethod
-    def new_reunion_packet(type, source_address, nodes_array):
+    def encode_many(packets):
+        """
+        Make the network buffers of a batch of packets.
+
+        :param packets: Packets to send.
+        :type packets: list
+
+        :return: The buffer of every packet.
+        :rtype: list
+        """
+        return [packet.get_buf() for packet in packets]
+
+    @staticmethod
+    def pack_address(address):
+        """
+        :param address: The format is like ('192.168.001.001', '05335').
+        :type address: tuple
+
+        :return: The 6 bytes of the address in version 2 bodies.
+        :rtype: bytes
+        """
+        return PeerAddress.get(address).packed
+
+    @staticmethod
+    def unpack_address(entry):
+        """
+        :param entry: The 6 bytes of an address in version 2 bodies.
+        :type entry: bytes
+
+        :return: The address; The format is like ('192.168.001.001', '05335').
+        :rtype: PeerAddress
+        """
+        return PeerAddress.from_packed(entry)
+
+    @staticmethod
+    def new_reunion_packet(type, source_address, nodes_array, backup=None, version=1):
         """
         :param type: Reunion Hello (REQ) or Reunion Hello Back (RES)
         :param source_address: IP/Port address of the packet sender.
         :param nodes_array: [(ip0, port0), (ip1, port1), ...] It is the path to the 'destination'.
+        :param backup: Backup parent for the destination of Reunion Hello Back; The format is like
+                       ('192.168.001.001', '05335').
+        :param version: Version of the body format.
 
         :type type: str
         :type source_address: tuple
         :type nodes_array: list
+        :type backup: tuple
+        :type version: int
 
         :return New reunion packet.
         :rtype Packet
         """
 
         # Don't add the source address to the nodes_array here!
-        entries_number = str(len(nodes_array))
-        if len(entries_number) == 1:
-            entries_number = '0' + entries_number
         # We assume the order of nodes_array is handled in Peer
-        body = type + entries_number
-        for node in nodes_array:
-            body += node[0] + str(node[1])
+        if version == 2:
+            get = PeerAddress.get
+            parts = [type.encode(), PacketFactory.count_struct.pack(len(nodes_array))]
+            parts += [get(node).packed for node in nodes_array]
+            if backup is not None:
+                parts.append(get(backup).packed)
+            body = b''.join(parts)
+        else:
+            parts = [type, str(len(nodes_array)).zfill(2)]
+            for node in nodes_array:
+                parts += [node[0], str(node[1])]
+            if backup is not None:
+                parts += [backup[0], backup[1]]
+            body = ''.join(parts)
 
         length = len(body)
-        # version is 1, type is 5 (reunion),
-        return Packet([1, 5, length, source_address[0], source_address[1], body])
+        # type is 5 (reunion)
+        return Packet([version, 5, length, source_address[0], source_address[1], body])
+
+    @staticmethod
+    def new_summary_packets(source_address, addresses, version=1):
+        """
+        Reunion Summary packets for the alive peers of our sub-tree; As many as the entries need.
+
+        :param source_address: IP/Port address of the packet sender.
+        :param addresses: The alive peers.
+        :param version: Version of the body format.
+
+        :type source_address: tuple
+        :type addresses: list
+        :type version: int
+
+        :return: New reunion packets.
+        :rtype: list
+        """
+        # the packets fit in one read of the TCPServer, a version 1 body has at most 99 entries
+        size = (2048 - 25) // PacketFactory.address_struct.size if version == 2 else 99
+        return [PacketFactory.new_reunion_packet('SUM', source_address, addresses[i:(i + size)], version=version)
+                for i in range(0, len(addresses), size)]
 
     @staticmethod
-    def new_advertise_packet(type, source_server_address, neighbour=None):
+    def new_relayed_reunion_packet(packet, source_address, version=None):
+        """
+        The Reunion Hello that a middle node sends to its parent: the arrived Hello plus the middle node address.
+        The entries are not parsed, so relaying does not depend on the path length.
+
+        :param packet: The arrived Reunion Hello.
+        :param source_address: IP/Port address of the middle node.
+        :param version: Version for the link to the parent; If it is not the version of the arrived packet, the
+                        packet will be parsed and made again.
+
+        :type packet: Packet
+        :type source_address: tuple
+        :type version: int
+
+        :return: New reunion packet or None if the version 1 body can not have more entries.
+        :rtype: Packet
+
+        :raise ValueError: If the body is not correct and it should be parsed.
+        """
+        if version is not None and version != packet.get_version():
+            nodes_array, backup = PacketFactory.parse_reunion_body(packet)
+            if version == 1 and len(nodes_array) >= 99:
+                logging.warning('reunion hello has too many entries for version 1')
+                return None
+            return PacketFactory.new_reunion_packet('REQ', source_address, nodes_array + [source_address],
+                                                    version=version)
+        body = packet.get_body()
+        if packet.get_version() == 2:
+            count = PacketFactory.count_struct.unpack_from(body, 3)[0] + 1
+            body = b''.join((body[:3], PacketFactory.count_struct.pack(count), body[5:],
+                             PacketFactory.pack_address(source_address)))
+        else:
+            count = int(body[3:5]) + 1
+            if count > 99:
+                logging.warning('reunion hello has too many entries for version 1')
+                return None
+            body = ''.join((body[:3], str(count).zfill(2), body[5:], source_address[0], source_address[1]))
+        return Packet([packet.get_version(), 5, len(body), source_address[0], source_address[1], body])
+
+    @staticmethod
+    def new_forwarded_reunion_packet(packet, source_address, version=None):
+        """
+        The Reunion Hello Back that a middle node sends to the next node: the arrived Hello Back without its first
+        entry (the middle node address); The backup address is kept.
+
+        :param packet: The arrived Reunion Hello Back.
+        :param source_address: IP/Port address of the middle node.
+        :param version: Version for the link to the next node, like new_relayed_reunion_packet.
+
+        :type packet: Packet
+        :type source_address: tuple
+        :type version: int
+
+        :return: New reunion packet.
+        :rtype: Packet
+        """
+        if version is not None and version != packet.get_version():
+            nodes_array, backup = PacketFactory.parse_reunion_body(packet)
+            return PacketFactory.new_reunion_packet('RES', source_address, nodes_array[1:], backup=backup,
+                                                    version=version)
+        body = packet.get_body()
+        if packet.get_version() == 2:
+            count = PacketFactory.count_struct.unpack_from(body, 3)[0] - 1
+            body = b''.join((body[:3], PacketFactory.count_struct.pack(count),
+                             body[(5 + PacketFactory.address_struct.size):]))
+        else:
+            count = int(body[3:5]) - 1
+            body = ''.join((body[:3], str(count).zfill(2), body[25:]))
+        return Packet([packet.get_version(), 5, len(body), source_address[0], source_address[1], body])
+
+    @staticmethod
+    def parse_reunion_body(packet):
+        """
+        :param packet: A Reunion packet.
+        :type packet: Packet
+
+        :return: The nodes array and the backup address (or None).
+        :rtype: tuple
+
+        :raise ValueError: If the body is not correct.
+        """
+        body = packet.get_body()
+        if packet.get_version() == 2:
+            if len(body) < 5:
+                raise ValueError('reunion body is too short')
+            count = PacketFactory.count_struct.unpack_from(body, 3)[0]
+            end = 5 + count * PacketFactory.address_struct.size
+            if len(body) not in (end, end + PacketFactory.address_struct.size):
+                raise ValueError('reunion body has a wrong length')
+            from_packed = PeerAddress.from_packed
+            view = memoryview(body)
+            nodes_array = [from_packed(entry) for (entry,) in PacketFactory.entry_struct.iter_unpack(view[5:end])]
+            backup = None
+            if len(body) > end:
+                backup = from_packed(body[end:])
+            view.release()
+            return nodes_array, backup
+
+        end = 5 + int(body[3:5]) * 20
+        if len(body) not in (end, end + 20):
+            raise ValueError('reunion body has a wrong length')
+        from_text = PeerAddress.from_text
+        nodes_array = [from_text(body[i:(i + 15)], body[(i + 15):(i + 20)]) for i in range(5, end, 20)]
+        backup = None
+        if len(body) > end:
+            backup = from_text(body[end:(end + 15)], body[(end + 15):(end + 20)])
+        return nodes_array, backup
+
+    @staticmethod
+    def get_reunion_origin(packet):
+        """
+        Only parse the first entry of a Reunion Hello; Middle peers learn their routes from it.
+
+        :param packet: A Reunion packet.
+        :type packet: Packet
+
+        :return: The peer which has sent the Hello.
+        :rtype: PeerAddress
+
+        :raise ValueError: If the body has no entry.
+        """
+        body = packet.get_body()
+        if packet.get_version() == 2:
+            if len(body) < 5 + PacketFactory.address_struct.size:
+                raise ValueError('reunion body is too short')
+            return PeerAddress.from_packed(body[5:(5 + PacketFactory.address_struct.size)])
+        if len(body) < 25:
+            raise ValueError('reunion body is too short')
+        return PeerAddress.from_text(body[5:20], body[20:25])
+
+    @staticmethod
+    def new_advertise_packet(type, source_server_address, neighbour=None, backup=None, version=1):
         """
         :param type: Type of Advertise packet
         :param source_server_address Server address of the packet sender.
         :param neighbour: The neighbour for advertise response packet; The format is like ('192.168.001.001', '05335').
+        :param backup: The backup parent for advertise response packet; Same format as neighbour.
+        :param version: Version of the body format.
 
         :type type: str
         :type source_server_address: tuple
         :type neighbour: tuple
+        :type backup: tuple
+        :type version: int
 
         :return New advertise packet.
         :rtype Packet
@@ -370,39 +971,120 @@ class PacketFactory:
             if neighbour is None:
                 logging.warning('in advertise response, neighbour is None')
                 return
-            body = type + neighbour[0] + neighbour[1]
+            addresses = [neighbour] if backup is None else [neighbour, backup]
+            if version == 2:
+                body = b''.join([type.encode()] + [PacketFactory.pack_address(address) for address in addresses])
+            else:
+                body = type + ''.join(address[0] + address[1] for address in addresses)
         else:
             logging.warning('Type was not correct')
             return
+        if version == 2 and isinstance(body, str):
+            body = body.encode()
+
+        # type is 2 (advertise)
+        return Packet([version, 2, len(body), source_server_address[0], source_server_address[1], body])
+
+    @staticmethod
+    def parse_advertise_body(packet):
+        """
+        :param packet: An Advertise Response packet.
+        :type packet: Packet
 
-        # version is 1, type is 2 (advertise)
-        return Packet([1, 2, len(body), source_server_address[0], source_server_address[1], body])
+        :return: The neighbour and the backup address (or None).
+        :rtype: tuple
+
+        :raise ValueError: If the body is not correct.
+        """
+        body = packet.get_body()
+        if packet.get_version() == 2:
+            size = PacketFactory.address_struct.size
+            if len(body) not in (3 + size, 3 + 2 * size):
+                raise ValueError('advertise body has a wrong length')
+            addresses = [PeerAddress.from_packed(entry)
+                         for (entry,) in PacketFactory.entry_struct.iter_unpack(memoryview(body)[3:])]
+        else:
+            if len(body) not in (23, 43):
+                raise ValueError('advertise body has a wrong length')
+            addresses = [PeerAddress.from_text(body[i:(i + 15)], body[(i + 15):(i + 20)])
+                         for i in range(3, len(body), 20)]
+        return addresses[0], (addresses[1] if len(addresses) > 1 else None)
 
     @staticmethod
-    def new_join_packet(source_server_address):
+    def new_join_packet(source_server_address, features=None, type='REQ', last_seen=None):
         """
         :param source_server_address: Server address of the packet sender.
+        :param features: Our feature bitmap; Without it the packet is an old Join.
+        :param type: Join Request (REQ) or the answer to it (RES).
+        :param last_seen: {origin: sequence number} of the last messages that we have seen, for a Join Request with
+                          the Message History feature; At most history_origins entries are sent.
 
         :type source_server_address: tuple
+        :type features: int
+        :type type: str
+        :type last_seen: dict
 
         :return New join packet.
         :rtype Packet
 
         """
+        body = 'JOIN'
+        if features is not None:
+            body += '%04x' % features + type
+            if last_seen is not None:
+                body += 'H' + ''.join(PacketFactory.pack_address(origin).hex() + '%016x' % sequence
+                                      for origin, sequence in list(last_seen.items())[:PacketFactory.history_origins])
+
+        # type is 3 (join)
+        return Packet([1, 3, len(body), source_server_address[0], source_server_address[1], body])
+
+    @staticmethod
+    def parse_join_body(packet):
+        """
+        :param packet: A Join packet.
+        :type packet: Packet
 
-        # type is 3 (join), len(body) is 4, body is 'JOIN'
-        return Packet([1, 3, 4, source_server_address[0], source_server_address[1], 'JOIN'])
+        :return: The feature bitmap and REQ/RES; Both of them are None for an old Join.
+        :rtype: tuple
+        """
+        body = packet.get_body()
+        if len(body) < 11:
+            return None, None
+        return PacketFactory.parse_features(body[4:8]), body[8:11]
+
+    @staticmethod
+    def parse_join_history(packet):
+        """
+        :param packet: A Join packet.
+        :type packet: Packet
+
+        :return: {origin: sequence number} of the last messages that the sender has seen, or None if the Join has
+                 no history.
+        :rtype: dict
+        """
+        body = packet.get_body()
+        if body[11:12] != 'H' or (len(body) - 12) % 28 != 0:
+            return None
+        try:
+            return {PeerAddress.from_packed(bytes.fromhex(body[i:(i + 12)])): int(body[(i + 12):(i + 28)], 16)
+                    for i in range(12, len(body), 28)}
+        except ValueError:
+            return None
 
     @staticmethod
-    def new_register_packet(type, source_server_address, address=(None, None)):
+    def new_register_packet(type, source_server_address, address=(None, None), phase=None, features=None):
         """
         :param type: Type of Register packet
         :param source_server_address: Server address of the packet sender.
         :param address: If 'type' is 'request' we need an address; The format is like ('192.168.001.001', '05335').
+        :param phase: Suggested Reunion phase for response packet; A fraction of the Reunion interval in [0, 1).
+        :param features: Our feature bitmap.
 
         :type type: str
         :type source_server_address: tuple
         :type address: tuple
+        :type phase: float
+        :type features: int
 
         :return New Register packet.
         :rtype Packet
@@ -410,34 +1092,505 @@ class PacketFactory:
         """
         if type == 'RES':
             body = type + 'ACK'
+            if phase is not None:
+                body += str(int(phase * 1000) % 1000).zfill(3)
         elif type == 'REQ':
-            if address is (None, None):
+            if address == (None, None):
                 logging.warning('in register request, address is None')
                 return
             body = type + address[0] + address[1]
         else:
             logging.warning('Type was not correct')
             return
+        if features is not None:
+            body += '%04x' % features
 
         # version is 1, type is 1 (register)
         return Packet([1, 1, len(body), source_server_address[0], source_server_address[1], body])
 
     @staticmethod
-    def new_message_packet(message, source_server_address):
+    def new_replicate_packet(type, source_server_address, operations=()):
+        """
+        Packet for replicating the state of the primary root in the standby root.
+
+        :param type: Replicate Request (REQ) or Replicate Response (RES)
+        :param source_server_address: Server address of the packet sender.
+        :param operations: For Replicate Response; list of (operation, address, argument), operations are the same as
+                           NetworkGraph listener operations plus 'reset', 'register' and 'hello'.
+
+        :type type: str
+        :type source_server_address: tuple
+        :type operations: list
+
+        :return: New Replicate packet.
+        :rtype: Packet
+        """
+        if type not in ('REQ', 'RES'):
+            logging.warning('Type was not correct')
+            return
+        body = type
+        for operation, address, argument in operations:
+            body += PacketFactory.replicate_codes[operation]
+            if operation == 'reset':
+                continue
+            body += address[0] + address[1]
+            if operation in ('add', 'move'):
+                body += argument[0] + argument[1]
+            elif operation in ('on', 'off'):
+                body += '1' if argument else '0'
+
+        # version is 1, type is 6 (replicate)
+        return Packet([1, 6, len(body), source_server_address[0], source_server_address[1], body])
+
+    @staticmethod
+    def parse_replicate_body(body):
+        """
+        :param body: Body of a Replicate Response packet.
+        :type body: str
+
+        :return: List of (operation, address, argument).
+        :rtype: list
+        """
+        operations = []
+        i = 3
+        while i < len(body):
+            operation = PacketFactory.replicate_operations[body[i]]
+            i += 1
+            if operation == 'reset':
+                operations.append((operation, None, None))
+                continue
+            address = PeerAddress.from_text(body[i:(i + 15)], body[(i + 15):(i + 20)])
+            i += 20
+            argument = None
+            if operation in ('add', 'move'):
+                argument = (body[i:(i + 15)], body[(i + 15):(i + 20)])
+                i += 20
+            elif operation in ('on', 'off'):
+                argument = body[i] == '1'
+                i += 1
+            operations.append((operation, address, argument))
+        return operations
+
+    @staticmethod
+    def get_message_version(features):
+        """
+        :param features: Agreed features of the link.
+        :type features: int
+
+        :return: Version of the Message packets on the link.
+        :rtype: int
+        """
+        if features & PacketFactory.feature_binary_messages:
+            if features & PacketFactory.feature_compressed_messages:
+                if features & PacketFactory.feature_message_history:
+                    return 4
+                return 3
+            return 2
+        return 1
+
+    @staticmethod
+    def new_message_packet(message, source_server_address, version=1, codec=message_codec_zlib, level=6,
+                           message_id=None):
         """
         Packet for sending a broadcast message to the whole network.
 
         :param message: Our message
         :param source_server_address: Server address of the packet sender.
+        :param version: 1 for a text body, 2 for a binary body, 3 for a compressed body, 4 for a compressed body
+                        with an ID.
+        :param codec: The compression codec of a version 3 or 4 body; 0 is no compression.
+        :param level: The compression level.
+        :param message_id: (origin, sequence number) of a version 4 body.
 
-        :type message: str
+        :type message: str or bytes
         :type source_server_address: tuple
+        :type version: int
+        :type codec: int
+        :type level: int
+        :type message_id: tuple
 
         :return: New Message packet.
         :rtype: Packet
+
+        :raise UnicodeDecodeError: If a binary message is not a text for a version 1 packet.
+        """
+        if version == 4:
+            body = PacketFactory.new_message_packet(message, source_server_address, version=3, codec=codec,
+                                                    level=level).get_body()
+            return PacketFactory.new_identified_message_packet(source_server_address, message_id[0], message_id[1],
+                                                               body)
+        if version == 3:
+            if isinstance(message, str):
+                message = message.encode()
+            message = bytes(message)
+            if codec != 0 and len(message) >= PacketFactory.compression_threshold:
+                compressed = PacketFactory.message_codecs[codec][0](message, level)
+                if len(compressed) < len(message):
+                    message = bytes((codec,)) + compressed
+                else:
+                    message = b'\x00' + message
+            else:
+                message = b'\x00' + message
+        elif version == 2:
+            if isinstance(message, str):
+                message = message.encode()
+            message = bytes(message)
+        elif not isinstance(message, str):
+            message = bytes(message).decode()
+        # type is 4 (message)
+        return Packet([version, 4, len(message), source_server_address[0], source_server_address[1], message])
+
+    @staticmethod
+    def new_forwarded_message_packet(packet, source_server_address, version=None, message_id=None):
+        """
+        The Message that a middle peer sends to its other neighbours; The body is only converted when the version
+        of the next link is not the version of the arrived packet.
+
+        :param packet: The arrived Message packet.
+        :param source_server_address: Server address of the middle peer.
+        :param version: Version for the next link.
+        :param message_id: (origin, sequence number) for a version 4 link when the arrived packet has no ID.
+
+        :type packet: Packet
+        :type source_server_address: tuple
+        :type version: int
+        :type message_id: tuple
+
+        :return: New Message packet.
+        :rtype: Packet
+
+        :raise UnicodeDecodeError: If a binary message is not a text for a version 1 link.
+        :raise ValueError: If a compressed body is not correct.
+        """
+        if version is not None and version != packet.get_version():
+            if version == 3 and packet.get_version() == 4:
+                body = packet.get_body()[PacketFactory.message_id_struct.size:]
+                return Packet([3, 4, len(body), source_server_address[0], source_server_address[1], body])
+            if version == 4 and packet.get_version() == 3:
+                return PacketFactory.new_identified_message_packet(source_server_address, message_id[0],
+                                                                   message_id[1], packet.get_body())
+            # middle peers do not compress, the origin has compressed the message if it could
+            return PacketFactory.new_message_packet(PacketFactory.get_message_payload(packet), source_server_address,
+                                                    version=version, codec=0, message_id=message_id)
+        return Packet([packet.get_version(), 4, packet.get_length(), source_server_address[0],
+                       source_server_address[1], packet.get_body()])
+
+    @staticmethod
+    def get_message_payload(packet):
+        """
+        :param packet: A Message packet.
+        :type packet: Packet
+
+        :return: The message; It is decompressed for a version 3 or 4 packet.
+        :rtype: str or bytes
+
+        :raise ValueError: If a compressed body is not correct.
+        """
+        body = packet.get_body()
+        if packet.get_version() == 4:
+            body = body[PacketFactory.message_id_struct.size:]
+        elif packet.get_version() != 3:
+            return body
+        if len(body) == 0:
+            raise ValueError('compressed message has no codec')
+        if body[0] == 0:
+            return body[1:]
+        if body[0] not in PacketFactory.message_codecs:
+            raise ValueError('unknown message codec %d' % body[0])
+        return PacketFactory.message_codecs[body[0]][1](body[1:], PacketFactory.fragment_size)
+
+    @staticmethod
+    def new_identified_message_packet(source_server_address, origin, sequence, body):
+        """
+        :param source_server_address: Server address of the packet sender.
+        :param origin: The origin of the message.
+        :param sequence: Sequence number of the message.
+        :param body: A version 3 Message body.
+
+        :type source_server_address: tuple
+        :type origin: tuple
+        :type sequence: int
+        :type body: bytes
+
+        :return: New version 4 Message packet.
+        :rtype: Packet
+        """
+        body = PacketFactory.message_id_struct.pack(PacketFactory.pack_address(origin), sequence) + bytes(body)
+        # type is 4 (message)
+        return Packet([4, 4, len(body), source_server_address[0], source_server_address[1], body])
+
+    @staticmethod
+    def get_message_id(packet):
+        """
+        :param packet: A Message packet.
+        :type packet: Packet
+
+        :return: (origin, sequence number) of a version 4 packet, None for the other versions.
+        :rtype: tuple
+
+        :raise ValueError: If the body is not correct.
+        """
+        if packet.get_version() != 4:
+            return None
+        body = packet.get_body()
+        if len(body) < PacketFactory.message_id_struct.size:
+            raise ValueError('message body has no ID')
+        origin, sequence = PacketFactory.message_id_struct.unpack_from(body)
+        return PeerAddress.from_packed(origin), sequence
+
+    @staticmethod
+    def new_history_packets(source_server_address, messages):
+        """
+        Pack a batch of messages in as few History packets as possible.
+
+        :param source_server_address: Server address of the packet sender.
+        :param messages: (origin, sequence number, version 3 body) of every message, from the oldest one.
+
+        :type source_server_address: tuple
+        :type messages: list
+
+        :return: New History packets.
+        :rtype: list
+        """
+        batches = []
+        records = []
+        size = 0
+        for origin, sequence, body in messages:
+            record = PacketFactory.history_struct.pack(PacketFactory.pack_address(origin), sequence, len(body)) + body
+            if len(record) > PacketFactory.history_size:
+                continue
+            if size + len(record) > PacketFactory.history_size:
+                batches.append(b''.join(records))
+                records = []
+                size = 0
+            records.append(record)
+            size += len(record)
+        if len(records) > 0:
+            batches.append(b''.join(records))
+        # type is 10 (history)
+        return [Packet([1, PacketFactory.history_type, len(body), source_server_address[0], source_server_address[1],
+                        body]) for body in batches]
+
+    @staticmethod
+    def parse_history_body(packet):
+        """
+        :param packet: A History packet.
+        :type packet: Packet
+
+        :return: (origin, sequence number, version 3 body) of every message.
+        :rtype: list
+
+        :raise ValueError: If the body is not correct.
+        """
+        body = packet.get_body()
+        messages = []
+        i = 0
+        while i < len(body):
+            if len(body) - i < PacketFactory.history_struct.size:
+                raise ValueError('history body is not correct')
+            origin, sequence, length = PacketFactory.history_struct.unpack_from(body, i)
+            i += PacketFactory.history_struct.size
+            if len(body) - i < length:
+                raise ValueError('history body is not correct')
+            messages.append((PeerAddress.from_packed(origin), sequence, body[i:(i + length)]))
+            i += length
+        return messages
+
+    @staticmethod
+    def new_fragment_packet(source_server_address, message_id, message_size, offset, data):
+        """
+        Packet for sending a piece of a large broadcast message.
+
+        :param source_server_address: Server address of the packet sender.
+        :param message_id: Random 64 bits ID of the message.
+        :param message_size: Number of bytes in the whole message.
+        :param offset: Offset of the data in the message.
+        :param data: At most fragment_size bytes of the message.
+
+        :type source_server_address: tuple
+        :type message_id: int
+        :type message_size: int
+        :type offset: int
+        :type data: bytes
+
+        :return: New Fragment packet.
+        :rtype: Packet
+        """
+        body = PacketFactory.fragment_struct.pack(message_id, message_size, offset) + data
+        return Packet([1, PacketFactory.fragment_type, len(body), source_server_address[0], source_server_address[1],
+                       body])
+
+    @staticmethod
+    def new_forwarded_fragment_packet(packet, source_server_address):
+        """
+        The Fragment that a middle peer sends to its other neighbours; The body is not copied or parsed.
+
+        :param packet: The arrived Fragment packet.
+        :param source_server_address: Server address of the middle peer.
+
+        :type packet: Packet
+        :type source_server_address: tuple
+
+        :return: New Fragment packet.
+        :rtype: Packet
+        """
+        return Packet([packet.get_version(), PacketFactory.fragment_type, packet.get_length(),
+                       source_server_address[0], source_server_address[1], packet.get_body()])
+
+    @staticmethod
+    def parse_fragment_body(packet):
+        """
+        :param packet: A Fragment packet.
+        :type packet: Packet
+
+        :return: Message ID, message size, offset and the data.
+        :rtype: tuple
+
+        :raise ValueError: If the body is not correct.
+        """
+        body = packet.get_body()
+        if len(body) < PacketFactory.fragment_struct.size:
+            raise ValueError('fragment body is too short')
+        message_id, message_size, offset = PacketFactory.fragment_struct.unpack_from(body)
+        data = body[PacketFactory.fragment_struct.size:]
+        if offset + len(data) > message_size:
+            raise ValueError('fragment is out of its message')
+        return message_id, message_size, offset, data
+
+    @staticmethod
+    def get_stripe(offset, stripes):
+        """
+        :param offset: Offset of a fragment in its message.
+        :param stripes: Number of the striped trees.
+
+        :type offset: int
+        :type stripes: int
+
+        :return: The tree of the fragment.
+        :rtype: int
+        """
+        return offset // PacketFactory.fragment_size % stripes
+
+    @staticmethod
+    def new_unicast_packet(source_server_address, origin, destination, message, ttl=unicast_ttl):
+        """
+        :param source_server_address: Server address of the packet sender.
+        :param origin: The peer which has sent the message.
+        :param destination: The peer which the message is for.
+        :param message: At most unicast_size bytes.
+        :param ttl: Maximum number of hops.
+
+        :type source_server_address: tuple
+        :type origin: tuple
+        :type destination: tuple
+        :type message: bytes
+        :type ttl: int
+
+        :return: New Unicast packet.
+        :rtype: Packet
+        """
+        body = PacketFactory.unicast_struct.pack(ttl, PacketFactory.pack_address(origin),
+                                                 PacketFactory.pack_address(destination)) + bytes(message)
+        # type is 9 (unicast)
+        return Packet([1, PacketFactory.unicast_type, len(body), source_server_address[0], source_server_address[1],
+                       body])
+
+    @staticmethod
+    def new_forwarded_unicast_packet(packet, source_server_address):
+        """
+        The Unicast packet that a middle peer sends to the next hop with one less TTL.
+
+        :param packet: The arrived Unicast packet.
+        :param source_server_address: Server address of the middle peer.
+
+        :type packet: Packet
+        :type source_server_address: tuple
+
+        :return: New Unicast packet or None if the TTL is over.
+        :rtype: Packet
+        """
+        body = packet.get_body()
+        if body[0] <= 1:
+            return None
+        body = bytes((body[0] - 1,)) + body[1:]
+        return Packet([packet.get_version(), PacketFactory.unicast_type, len(body), source_server_address[0],
+                       source_server_address[1], body])
+
+    @staticmethod
+    def parse_unicast_body(packet):
+        """
+        :param packet: A Unicast packet.
+        :type packet: Packet
+
+        :return: TTL, origin, destination and the message.
+        :rtype: tuple
+
+        :raise ValueError: If the body is not correct.
+        """
+        body = packet.get_body()
+        if len(body) < PacketFactory.unicast_struct.size:
+            raise ValueError('unicast body is too short')
+        ttl, origin, destination = PacketFactory.unicast_struct.unpack_from(body)
+        return ttl, PeerAddress.from_packed(origin), PeerAddress.from_packed(destination), \
+            body[PacketFactory.unicast_struct.size:]
+
+    @staticmethod
+    def new_stripe_packet(source_server_address, parents=None, bitmap=None):
+        """
+        :param source_server_address: Server address of the packet sender.
+        :param parents: The parent in every tree for the packet of the root.
+        :param bitmap: The trees of a link for the packet of a child.
+
+        :type source_server_address: tuple
+        :type parents: list
+        :type bitmap: int
+
+        :return: New Stripe packet.
+        :rtype: Packet
+        """
+        if parents is not None:
+            body = b''.join([b'RES', PacketFactory.stripe_count_struct.pack(len(parents))] +
+                            [PacketFactory.pack_address(address) for address in parents])
+        else:
+            body = b'ADD' + PacketFactory.stripe_bitmap_struct.pack(bitmap)
+        # type is 8 (stripe)
+        return Packet([1, PacketFactory.stripe_type, len(body), source_server_address[0], source_server_address[1],
+                       body])
+
+    @staticmethod
+    def parse_stripe_body(packet):
+        """
+        :param packet: A Stripe packet.
+        :type packet: Packet
+
+        :return: ('RES', parents) or ('ADD', bitmap).
+        :rtype: tuple
+
+        :raise ValueError: If the body is not correct.
         """
-        # version is 1, type is 4 (message)
-        return Packet([1, 4, len(message), source_server_address[0], source_server_address[1], message])
+        body = packet.get_body()
+        if body[:3] == b'ADD' and len(body) == 3 + PacketFactory.stripe_bitmap_struct.size:
+            return 'ADD', PacketFactory.stripe_bitmap_struct.unpack_from(body, 3)[0]
+        if body[:3] == b'RES' and len(body) > 3:
+            count = body[3]
+            if 0 < count <= PacketFactory.max_stripes and len(body) == 4 + count * PacketFactory.address_struct.size:
+                return 'RES', [PeerAddress.from_packed(entry)
+                               for (entry,) in PacketFactory.entry_struct.iter_unpack(memoryview(body)[4:])]
+        raise ValueError('stripe body is not correct')
+
+
+def _zlib_decompress(data, max_length):
+    decompressor = zlib.decompressobj()
+    try:
+        message = decompressor.decompress(data, max_length)
+    except zlib.error as e:
+        raise ValueError(str(e))
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError('compressed message is too long or is not complete')
+    return message
+
+
+PacketFactory.message_codecs[PacketFactory.message_codec_zlib] = (zlib.compress, _zlib_decompress)
 
 
 class TestPacketFactory(unittest.TestCase):
@@ -446,6 +1599,132 @@ class TestPacketFactory(unittest.TestCase):
         buf = b'\x00\x01\x00\x04\x00\x00\x00\x0c\x00\xc0\x00\xa8\x00\x01\x00\x01\x00\x00\xfd\xe8Hello World!'
         pck = PacketFactory.parse_buffer(buf)
         self.assertEqual(pck.get_buf(), buf)
+        # a view of the TCPServer receive buffer, which is reused after parsing
+        chunk = bytearray(100)
+        chunk[10:(10 + len(buf))] = buf
+        pck = PacketFactory.parse_buffer(memoryview(chunk).toreadonly()[10:(10 + len(buf))])
+        chunk[:] = bytes(100)
+        self.assertEqual(pck.get_buf(), buf)
+
+    def test_is_control_buffer(self):
+        src = ('192.168.001.001', '05335')
+        self.assertTrue(PacketFactory.is_control_buffer(
+            PacketFactory.new_reunion_packet('REQ', src, [src]).get_buf()))
+        self.assertTrue(PacketFactory.is_control_buffer(PacketFactory.new_join_packet(src).get_buf()))
+        self.assertFalse(PacketFactory.is_control_buffer(PacketFactory.new_message_packet('Hello', src).get_buf()))
+        self.assertFalse(PacketFactory.is_control_buffer(
+            PacketFactory.new_fragment_packet(src, 1, 10, 0, b'0123456789').get_buf()))
+
+    def test_frame_length(self):
+        buf = PacketFactory.new_message_packet('\u00e9t\u00e9', ('192.168.001.001', '05335')).get_buf()
+        self.assertEqual(PacketFactory.frame_length(buf), len(buf))
+        self.assertEqual(PacketFactory.frame_length(buf[:10]), None)
+        self.assertEqual(PacketFactory.frame_length(buf[:25]), len(buf))
+
+    def test_parse_many(self):
+        packets = [PacketFactory.new_message_packet('Hello', ('192.168.001.001', '05335')),
+                   PacketFactory.new_reunion_packet('REQ', ('010.000.000.001', '65535'),
+                                                    [('010.000.000.001', '65535')], version=2)]
+        buffers = PacketFactory.encode_many(packets) + [b'\x00\x01']
+        parsed = PacketFactory.parse_many(buffers)
+        self.assertEqual([pck.buf for pck in parsed[:2]], [pck.buf for pck in packets])
+        self.assertIsNone(parsed[2])
+
+    def test_binary_message_packet(self):
+        message = bytes(range(256))
+        pck = PacketFactory.new_message_packet(message, ('192.168.001.001', '05335'), version=2)
+        pck = PacketFactory.parse_buffer(pck.get_buf())
+        self.assertEqual((pck.get_body(), pck.get_length()), (message, 256))
+        forwarded = PacketFactory.new_forwarded_message_packet(pck, ('010.000.000.001', '05000'), version=2)
+        self.assertIs(forwarded.get_body(), pck.get_body())
+        with self.assertRaises(UnicodeDecodeError):
+            PacketFactory.new_forwarded_message_packet(pck, ('010.000.000.001', '05000'), version=1)
+        pck = PacketFactory.new_message_packet('سلام', ('192.168.001.001', '05335'), version=2)
+        pck = PacketFactory.new_forwarded_message_packet(pck, ('010.000.000.001', '05000'), version=1)
+        self.assertEqual(PacketFactory.parse_buffer(pck.get_buf()).get_body(), 'سلام')
+
+    def test_compressed_message_packet(self):
+        message = b'compressed message ' * 50
+        pck = PacketFactory.new_message_packet(message, ('192.168.001.001', '05335'), version=3)
+        pck = PacketFactory.parse_buffer(pck.get_buf())
+        self.assertLess(pck.get_length(), len(message) // 4)
+        self.assertEqual(PacketFactory.get_message_payload(pck), message)
+        forwarded = PacketFactory.new_forwarded_message_packet(pck, ('010.000.000.001', '05000'), version=3)
+        self.assertIs(forwarded.get_body(), pck.get_body())
+        forwarded = PacketFactory.new_forwarded_message_packet(pck, ('010.000.000.001', '05000'), version=1)
+        self.assertEqual(forwarded.get_body(), message.decode())
+        # small messages are not compressed
+        pck = PacketFactory.new_message_packet('Hello', ('192.168.001.001', '05335'), version=3)
+        self.assertEqual(pck.get_body(), b'\x00Hello')
+        pck = PacketFactory.new_message_packet(zlib.compress(b'\x00' * 10000), ('192.168.001.001', '05335'),
+                                               version=2)
+        pck = PacketFactory.new_forwarded_message_packet(pck, ('010.000.000.001', '05000'), version=3)
+        pck = PacketFactory.parse_buffer(pck.get_buf()[:20] + b'\x01' + pck.get_buf()[21:])
+        with self.assertRaises(ValueError):
+            PacketFactory.get_message_payload(pck)
+
+    def test_unicast_packet(self):
+        origin, destination = ('010.000.000.001', '05000'), ('192.168.001.001', '05335')
+        pck = PacketFactory.new_unicast_packet(origin, origin, destination, b'Hello', ttl=2)
+        pck = PacketFactory.parse_buffer(pck.get_buf())
+        self.assertEqual(PacketFactory.parse_unicast_body(pck), (2, origin, destination, b'Hello'))
+        pck = PacketFactory.new_forwarded_unicast_packet(pck, ('127.000.000.001', '05000'))
+        self.assertEqual(PacketFactory.parse_unicast_body(pck)[0], 1)
+        self.assertEqual(pck.get_source_server_address(), ('127.000.000.001', '05000'))
+        self.assertIsNone(PacketFactory.new_forwarded_unicast_packet(pck, ('127.000.000.001', '05000')))
+        for version in (1, 2):
+            pck = PacketFactory.new_reunion_packet('REQ', destination, [origin, destination], version=version)
+            self.assertEqual(PacketFactory.get_reunion_origin(pck), origin)
+
+    def test_history_packets(self):
+        origin, src = PeerAddress.get(('010.000.000.001', '05000')), ('192.168.001.001', '05335')
+        message = b'message with ID ' * 20
+        pck = PacketFactory.new_message_packet(message, src, version=4, message_id=(origin, 7))
+        pck = PacketFactory.parse_buffer(pck.get_buf())
+        self.assertEqual(PacketFactory.get_message_id(pck), (origin, 7))
+        self.assertEqual(PacketFactory.get_message_payload(pck), message)
+        v3 = PacketFactory.new_forwarded_message_packet(pck, src, version=3)
+        self.assertEqual(v3.get_body(), pck.get_body()[14:])
+        v4 = PacketFactory.new_forwarded_message_packet(v3, src, version=4, message_id=(origin, 7))
+        self.assertEqual(v4.get_body(), pck.get_body())
+        self.assertEqual(PacketFactory.get_message_payload(
+            PacketFactory.new_forwarded_message_packet(pck, src, version=1)), message.decode())
+
+        messages = [(origin, sequence, bytes(900)) for sequence in range(5)]
+        packets = PacketFactory.new_history_packets(src, messages)
+        self.assertEqual(len(packets), 3)
+        self.assertTrue(all(len(p.get_buf()) <= 2048 for p in packets))
+        self.assertEqual([m for p in packets for m in PacketFactory.parse_history_body(
+            PacketFactory.parse_buffer(p.get_buf()))], messages)
+
+        pck = PacketFactory.new_join_packet(src, features=0x003f, last_seen={origin: 2 ** 60})
+        self.assertEqual(PacketFactory.parse_join_body(pck), (0x3f, 'REQ'))
+        self.assertEqual(PacketFactory.parse_join_history(pck), {origin: 2 ** 60})
+        self.assertEqual(PacketFactory.parse_join_history(PacketFactory.new_join_packet(src, 0x3f, last_seen={})), {})
+        self.assertIsNone(PacketFactory.parse_join_history(PacketFactory.new_join_packet(src, 0x3f)))
+
+    def test_stripe_packet(self):
+        parents = [('010.000.000.001', '05000'), ('192.168.001.001', '05335')]
+        pck = PacketFactory.new_stripe_packet(('127.000.000.001', '05000'), parents=parents)
+        pck = PacketFactory.parse_buffer(pck.get_buf())
+        self.assertEqual(PacketFactory.parse_stripe_body(pck), ('RES', parents))
+        pck = PacketFactory.new_stripe_packet(('010.000.000.001', '05000'), bitmap=0x8001)
+        self.assertEqual(PacketFactory.parse_stripe_body(PacketFactory.parse_buffer(pck.get_buf())), ('ADD', 0x8001))
+        self.assertEqual([PacketFactory.get_stripe(i * PacketFactory.fragment_size, 3) for i in range(4)],
+                         [0, 1, 2, 0])
+        with self.assertRaises(ValueError):
+            PacketFactory.parse_stripe_body(PacketFactory.parse_buffer(pck.get_buf()[:-1]))
+
+    def test_fragment_packet(self):
+        pck = PacketFactory.new_fragment_packet(('192.168.001.001', '05335'), 2 ** 63, 5000, 4000, b'\xff' * 1000)
+        self.assertEqual(len(pck.get_buf()), 20 + 24 + 1000)
+        pck = PacketFactory.parse_buffer(pck.get_buf())
+        self.assertEqual(PacketFactory.parse_fragment_body(pck), (2 ** 63, 5000, 4000, b'\xff' * 1000))
+        pck = PacketFactory.new_forwarded_fragment_packet(pck, ('010.000.000.001', '05000'))
+        self.assertEqual(pck.get_source_server_address(), ('010.000.000.001', '05000'))
+        self.assertEqual(PacketFactory.parse_fragment_body(pck)[2:], (4000, b'\xff' * 1000))
+        with self.assertRaises(ValueError):
+            PacketFactory.parse_fragment_body(PacketFactory.new_fragment_packet(('10.0.0.1', '1'), 1, 10, 5, b'123456'))
 
     def test_new_reunion_packet(self):
         pck = PacketFactory.new_reunion_packet(type='REQ', source_address=('127.000.000.001', '31315'),
@@ -459,6 +1738,58 @@ class TestPacketFactory(unittest.TestCase):
         self.assertEqual(pck.get_buf(),
                          b'\x00\x01\x00\x05\x00\x00\x00\x19\x00\x7f\x00\x00\x00\x00\x00\x01\x00\x00\x14\xecRES01127.000.000.00131315')
 
+    def test_reunion_packet_v2(self):
+        nodes_array = [("127.000.000.001", '31315'), ("010.000.000.002", '05356')]
+        backup = ("127.000.000.001", '05000')
+        for version in (1, 2):
+            pck = PacketFactory.new_reunion_packet(type='RES', source_address=('127.000.000.001', '05356'),
+                                                   nodes_array=nodes_array, backup=backup, version=version)
+            pck = PacketFactory.parse_buffer(pck.get_buf())
+            self.assertEqual(pck.get_request_type(), 'RES')
+            self.assertEqual(PacketFactory.parse_reunion_body(pck), (nodes_array, backup))
+        self.assertEqual(pck.get_body(), b'RES\x00\x02\x7f\x00\x00\x01zS\x0a\x00\x00\x02\x14\xec\x7f\x00\x00\x01\x13\x88')
+        pck = PacketFactory.new_reunion_packet(type='REQ', source_address=('127.000.000.001', '05356'),
+                                               nodes_array=nodes_array * 100, version=2)
+        self.assertEqual(PacketFactory.parse_reunion_body(pck), (nodes_array * 100, None))
+
+    def test_summary_packets(self):
+        addresses = [PeerAddress.get(('010.000.%03d.%03d' % (i // 256, i % 256), '05000')) for i in range(500)]
+        for version, count in ((1, 6), (2, 2)):
+            packets = PacketFactory.new_summary_packets(('192.168.001.001', '05335'), addresses, version=version)
+            self.assertEqual(len(packets), count)
+            self.assertTrue(all(len(pck.get_buf()) <= 2048 for pck in packets))
+            packets = [PacketFactory.parse_buffer(pck.get_buf()) for pck in packets]
+            self.assertEqual(packets[0].get_request_type(), 'SUM')
+            self.assertEqual([address for pck in packets for address in PacketFactory.parse_reunion_body(pck)[0]],
+                             addresses)
+
+    def test_relayed_reunion_packet(self):
+        nodes_array = [("127.000.000.001", '31315'), ("010.000.000.002", '05356')]
+        backup = ("127.000.000.001", '05000')
+        for version in (1, 2):
+            pck = PacketFactory.new_reunion_packet(type='REQ', source_address=nodes_array[0],
+                                                   nodes_array=nodes_array[:1], version=version)
+            pck = PacketFactory.new_relayed_reunion_packet(pck, nodes_array[1])
+            self.assertEqual(pck.get_buf(), PacketFactory.new_reunion_packet(
+                type='REQ', source_address=nodes_array[1], nodes_array=nodes_array, version=version).get_buf())
+
+            pck = PacketFactory.new_reunion_packet(type='RES', source_address=('127.000.000.001', '05000'),
+                                                   nodes_array=nodes_array[::-1], backup=backup, version=version)
+            forwarded = PacketFactory.new_forwarded_reunion_packet(pck, nodes_array[1])
+            self.assertEqual(PacketFactory.parse_reunion_body(forwarded), (nodes_array[:1], backup))
+            # a link without version 2 bodies
+            forwarded = PacketFactory.new_forwarded_reunion_packet(pck, nodes_array[1], version=1)
+            self.assertEqual(forwarded.get_version(), 1)
+            self.assertEqual(PacketFactory.parse_reunion_body(forwarded), (nodes_array[:1], backup))
+
+    def test_advertise_packet_v2(self):
+        neighbour = ("127.000.000.001", "05356")
+        pck = PacketFactory.new_advertise_packet(type='RES', source_server_address=neighbour, neighbour=neighbour,
+                                                 version=2)
+        self.assertEqual(pck.get_length(), 9)
+        pck = PacketFactory.parse_buffer(pck.get_buf())
+        self.assertEqual(PacketFactory.parse_advertise_body(pck), (neighbour, None))
+
     def test_new_advertise_packet(self):
         pck = PacketFactory.new_advertise_packet(type='REQ', source_server_address=("127.000.000.001", "31315"))
         self.assertEqual(pck.get_buf(),
@@ -469,15 +1800,37 @@ class TestPacketFactory(unittest.TestCase):
         self.assertEqual(pck.get_buf(),
                          b'\x00\x01\x00\x02\x00\x00\x00\x17\x00\x7f\x00\x00\x00\x00\x00\x01\x00\x00\x14\xecRES127.000.000.00105356')
 
+        pck = PacketFactory.new_advertise_packet(type='RES', source_server_address=("127.000.000.001", "05356"),
+                                                 neighbour=("127.000.000.001", "05356"),
+                                                 backup=("127.000.000.001", "31315"))
+        self.assertEqual(pck.get_body(), 'RES127.000.000.00105356127.000.000.00131315')
+        self.assertEqual(pck.get_length(), 43)
+
     def test_new_join_packet(self):
         pck = PacketFactory.new_join_packet(source_server_address=("127.000.000.001", "31315"))
         self.assertEqual(pck.get_buf(),
                          b'\x00\x01\x00\x03\x00\x00\x00\x04\x00\x7f\x00\x00\x00\x00\x00\x01\x00\x00zSJOIN')
+        self.assertEqual(PacketFactory.parse_join_body(pck), (None, None))
+
+        pck = PacketFactory.new_join_packet(("127.000.000.001", "31315"), features=0x0003, type='RES')
+        self.assertEqual(pck.get_body(), 'JOIN0003RES')
+        self.assertEqual(PacketFactory.parse_join_body(pck), (3, 'RES'))
+        self.assertEqual(PacketFactory.get_version(3 & PacketFactory.feature_binary_bodies), 2)
+        self.assertEqual(PacketFactory.get_version(0), 1)
 
     def test_new_message_packet(self):
         pck = PacketFactory.new_message_packet('Hi', source_server_address=("127.000.000.001", "31315"))
         self.assertEqual(pck.get_buf(), b'\x00\x01\x00\x04\x00\x00\x00\x02\x00\x7f\x00\x00\x00\x00\x00\x01\x00\x00zSHi')
 
+    def test_new_replicate_packet(self):
+        operations = [('reset', None, None),
+                      ('add', ("127.000.000.001", "31315"), ("127.000.000.001", "05356")),
+                      ('off', ("127.000.000.001", "31315"), True),
+                      ('hello', ("127.000.000.001", "31315"), None)]
+        pck = PacketFactory.new_replicate_packet('RES', ("127.000.000.001", "05356"), operations)
+        self.assertEqual(pck.get_length(), 3 + 1 + 41 + 22 + 21)
+        self.assertEqual(PacketFactory.parse_replicate_body(pck.get_body()), operations)
+
     def test_new_register_packet(self):
         pck = PacketFactory.new_register_packet('REQ', source_server_address=("127.000.000.001", "31315"),
                                                 address=("127.000.000.001", "31315"))
@@ -487,3 +1840,6 @@ class TestPacketFactory(unittest.TestCase):
         pck = PacketFactory.new_register_packet('RES', source_server_address=("127.000.000.001", "05356"))
         self.assertEqual(pck.get_buf(),
                          b'\x00\x01\x00\x01\x00\x00\x00\x06\x00\x7f\x00\x00\x00\x00\x00\x01\x00\x00\x14\xecRESACK')
+
+        pck = PacketFactory.new_register_packet('RES', source_server_address=("127.000.000.001", "05356"), phase=0.25)
+        self.assertEqual(pck.get_body(), 'RESACK250')
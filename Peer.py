@@ -1,10 +1,23 @@
+import collections
+import io
+import mmap
+import os
+import random
+import struct
 import warnings
 
 from Stream import Stream
 from Packet import Packet, PacketFactory
 from UserInterface import UserInterface
 from tools.NetworkGraph import NetworkGraph
-from tools.Node import Node
+from tools.PeerAddress import PeerAddress
+from tools.AdmissionQueue import AdmissionQueue
+from tools.MessageAssembler import MessageAssembler
+from tools.MessageHistory import MessageHistory
+from tools.ReunionTimer import ReunionTimer
+from tools.RootJournal import RootJournal
+from tools.RoutingTable import RoutingTable
+from tools.StripedTrees import StripedTrees
 import time
 import threading
 
@@ -20,7 +33,14 @@ logging.basicConfig(format='%(asctime)s %(message)s')
 
 
 class Peer:
-    def __init__(self, server_ip, server_port, is_root=False, root_address=None):
+    # seconds between two cycles of the main loop
+    cycle_interval = 2
+
+    def __init__(self, server_ip, server_port, is_root=False, root_address=None, standby_address=None,
+                 primary_address=None, journal_directory=None, message_directory=None, fragments_per_cycle=4096,
+                 message_callback=None, message_codec=1, compression_level=6, stripes=1, unicast_callback=None,
+                 history_size=1024 * 1024, link_timeout=8, unix_directory=None, clock=time.time,
+                 rng=None, stream_class=Stream, threads=True):
         """
         The Peer object constructor.
 
@@ -40,43 +60,194 @@ class Peer:
         :param server_ip: Server IP address for this Peer that should be pass to Stream.
         :param server_port: Server Port address for this Peer that should be pass to Stream.
         :param is_root: Specify that is this Peer root or not.
-        :param root_address: Root IP/Port address if we are a client.
+        :param root_address: Root IP/Port address if we are a client; It can be a list of root addresses (the primary
+                             root and its standby), the first one will be used until it fails.
+        :param standby_address: If we are the primary root, IP/Port address of our standby root.
+        :param primary_address: If we are a standby root, IP/Port address of the primary root.
+        :param journal_directory: If we are the root, the directory of our RootJournal; Our state will be loaded from
+                                  it at start and every change will be written to it.
+        :param message_directory: The directory for received large (fragmented) messages; If it is None they are
+                                  kept in memory.
+        :param fragments_per_cycle: Maximum number of Fragment packets of our own messages that we send in every
+                                    cycle; Middle peers forward the fragments as they arrive.
+        :param message_callback: Function which is called with a memoryview of every broadcast message that arrives;
+                                 The view is only valid during the call. By default the messages are logged.
+        :param message_codec: Codec of our Message packets on the links with the Compressed Message feature (a key
+                              of PacketFactory.message_codecs); 0 is no compression.
+        :param compression_level: Compression level of the codec.
+        :param stripes: If we are the root, number of the striped trees which carry the fragments of large messages
+                        (see StripedTrees); With 1 they are sent on the NetworkGraph tree.
+        :param unicast_callback: Function which is called with the origin address and a memoryview of every Unicast
+                                 message for us; The view is only valid during the call. By default they are logged.
+        :param history_size: Size of our MessageHistory ring in bytes; Our new children receive the messages of it
+                             which they have missed. With 0 we send them nothing.
+        :param link_timeout: Seconds until a dead link to a neighbour is found with TCP keepalive, TCP_USER_TIMEOUT
+                             and Reunion Probes on the idle links; The neighbour is removed and we react at once
+                             (e.g. join our backup parent). With None only the reunion timeouts find them.
+        :param unix_directory: Directory of the Unix domain sockets of the peers on this host; The links to the
+                               peers on this host skip TCP loopback. It should be private to our user (see Stream).
+                               With None (the default) every link uses TCP.
+        :param clock: Function which returns the current time in seconds; A simulation gives its virtual clock.
+        :param rng: Random generator of the message IDs and the Reunion timer, for reproducible simulations.
+        :param stream_class: Class (or factory) of our Stream; It is called like Stream.
+        :param threads: Whether we start the UserInterface and the reunion daemon threads; Without them the caller
+                        runs run_cycle and reunion_cycle (see NetworkSimulator) and puts the commands in our
+                        user_interface.buffer.
 
         :type server_ip: str
         :type server_port: int
         :type is_root: bool
         :type root_address: tuple
+        :type standby_address: tuple
+        :type primary_address: tuple
+        :type journal_directory: str
+        :type message_directory: str
+        :type fragments_per_cycle: int
+        :type message_callback: function
+        :type message_codec: int
+        :type compression_level: int
+        :type stripes: int
+        :type unicast_callback: function
+        :type history_size: int
+        :type link_timeout: float
+        :type unix_directory: str
+        :type clock: function
+        :type rng: random.Random
+        :type stream_class: type
+        :type threads: bool
+
+        :raise ValueError: If the number of stripes is not supported.
         """
-        self.stream = Stream(server_ip, server_port)
+        self.clock = clock
+        self.rng = rng if rng is not None else random.Random()
+        self.threads = threads
+        # set by a link down of our parent, so the reunion daemon wakes up at once
+        self.link_down_event = threading.Event()
+        if link_timeout is None:
+            socket_options, probe = None, None
+        else:
+            # the kernel breaks a connection which is silent or has unacknowledged data for about link_timeout
+            # seconds; the timeout of a send (and its ACK) finds a hung peer, the probes check the idle links
+            socket_options = {'keepalive': (link_timeout / 2, link_timeout / 8, 4), 'user_timeout': link_timeout,
+                              'timeout': link_timeout}
+            probe = PacketFactory.new_reunion_packet('PRB', PeerAddress.from_text(server_ip, server_port),
+                                                     []).get_buf()
+        # control packets (e.g. Reunion Hellos) do not wait behind the broadcast traffic
+        self.stream = stream_class(server_ip, server_port, is_control=PacketFactory.is_control_buffer,
+                                   socket_options=socket_options, probe=probe,
+                                   probe_interval=(link_timeout or 8) / 2,
+                                   link_down_callback=self.__handle_link_down, unix_directory=unix_directory,
+                                   clock=clock, frame_length=PacketFactory.frame_length)
 
         self.packet_factory = PacketFactory()
 
         self.user_interface = UserInterface()
-        self.start_user_interface()
+        if threads:
+            self.start_user_interface()
+        else:
+            # the buffer of the class is shared by all of the peers of this process
+            self.user_interface.buffer = []
 
         self.is_root = is_root
         self.address = self.stream.get_server_address()
         if is_root:
             self.root_address = self.address
         else:
-            self.root_address = (Node.parse_ip(root_address[0]), Node.parse_port(root_address[1]))
+            if not isinstance(root_address[0], (tuple, list, PeerAddress)):
+                root_address = [root_address]
+            self.root_addresses = [PeerAddress.get(address) for address in root_address]
+            self.root_address = self.root_addresses[0]
 
         self.parent_address = None
 
+        # puts the fragments of the large messages together
+        self.message_assembler = MessageAssembler(message_directory, clock=clock)
+        # our large messages which are being sent; [message ID, file, message size, offset]
+        self.outgoing_messages = collections.deque()
+        self.fragments_per_cycle = fragments_per_cycle
+        # payloads of send_message, they are broadcast in the next cycle
+        self.pending_messages = collections.deque()
+        self.message_callback = message_callback if message_callback is not None else self.__log_message
+        self.message_codec = message_codec
+        self.compression_level = compression_level
+        # the recent broadcast messages and the last message ID of every origin
+        self.history = MessageHistory(history_size, clock=clock)
+
+        if not 1 <= stripes <= self.packet_factory.max_stripes:
+            raise ValueError('number of stripes should be between 1 and %d' % self.packet_factory.max_stripes)
+        # number of the striped trees; A client learns it from the Stripe packets of the root
+        self.stripes = stripes if is_root else 1
+        # {address: bitmap of the trees} of our parents and children in the striped trees
+        self.stripe_parents = {}
+        self.stripe_children = {}
+
+        # next hops of the Unicast packets for the peers of our sub-tree
+        self.routing_table = RoutingTable(clock=clock)
+        # (destination, message) of send_unicast, they are sent in the next cycle
+        self.pending_unicasts = collections.deque()
+        self.unicast_callback = unicast_callback if unicast_callback is not None else self.__log_unicast
+
+        # liveness is piggybacked on the data traffic; {neighbour: time of the last data packet from it}
+        self.data_receive_times = {}
+        # a link is active if a data packet or the ACK of our data packet has passed it in this time
+        self.idle_threshold = 8
+        # peers of our sub-tree which our children have vouched for since our last Reunion Summary
+        self.summary = set()
+
         self.reunion_daemon = threading.Thread(target=self.run_reunion_daemon)
+        self.reunion_daemon_started = False
         if is_root:
             # dict, {peer_address: time}
             self.peer_last_reunion_hello_time = {}
-            self.network_graph = NetworkGraph(self.address)
-            self.reunion_daemon.start()
+            # Reunion phase for the next registered peer, as a fraction of the Reunion interval
+            self.next_reunion_phase = 0.0
+            # Register and Advertise Requests wait here, Reunion packets are handled first
+            self.admission_queue = AdmissionQueue(clock=clock)
+            self.striped_trees = StripedTrees(self.address, stripes) if stripes > 1 else None
+
+            self.standby_address = None
+            self.primary_address = None
+            # a standby root only replicates the primary root state until the primary fails
+            self.is_standby = primary_address is not None
+            # packets of the peers which have come to the standby root before its take over
+            self.standby_packets = collections.deque(maxlen=4096)
+            if self.is_standby:
+                self.primary_address = PeerAddress.get(primary_address)
+                self.network_graph = NetworkGraph(self.primary_address)
+                self.last_replication_time = self.clock()
+                self.stream.add_node(self.primary_address, set_register_connection=True)
+                pck = self.packet_factory.new_replicate_packet('REQ', self.address)
+                self.stream.add_message_to_out_buff(self.primary_address, pck.get_buf(), is_register=True)
+            else:
+                self.network_graph = NetworkGraph(self.address)
+            if standby_address is not None:
+                self.standby_address = PeerAddress.get(standby_address)
+                # operations that we should send to our standby root
+                self.replication_log = []
+            self.journal = None
+            if journal_directory is not None and not self.is_standby:
+                self.__load_journal(journal_directory)
+            if self.standby_address is not None or self.journal is not None:
+                self.network_graph.add_listener(self.__log_operation)
+            self.__start_reunion_daemon()
 
         else:
             self.last_sent_reunion_time = None
             self.reunion_mode = 'accept'
             # the maximum depth is 8
             self.time_interval = 8 * 2 * 2 + 4
+            self.reunion_timer = ReunionTimer(interval=4, rng=self.rng)
             self.reunion_failed = False
             self.first_advertise_response = True
+            # backup parent which root has chosen for us, we will join it when our parent fails
+            self.backup_address = None
+            self.reunion_retried = False
+            # an active peer still sends a Reunion Hello after this time, e.g. for a fresh backup parent
+            self.hello_refresh_interval = 60
+            self.last_hello_back_time = 0
+            # link downs of our parent since our last Reunion Hello Back; A hung parent still accepts connections, so
+            # we do not join it again after the second one
+            self.parent_link_downs = 0
 
     # Done
     def start_user_interface(self):
@@ -95,6 +266,9 @@ class Peer:
             1. Register:  With this command, the client send a Register Request packet to the root of the network.
             2. Advertise: Send an Advertise Request to the root of the network for finding first hope.
             3. SendMessage: The following string will be added to a new Message packet and broadcast through the network.
+            4. SendFile: The content of the following file will be broadcast through the network in Fragment packets.
+            5. SendTo: 'SendTo <ip> <port> <message>' sends the message only to the peer with IP/Port in a Unicast
+               packet.
 
         Warnings:
             1. Ignore irregular commands from the user.
@@ -108,25 +282,229 @@ class Peer:
         for command in self.user_interface.buffer:
             if command == 'Register':
                 if not self.is_root:
-                    pck = self.packet_factory.new_register_packet('REQ', self.address, address=self.address)
+                    pck = self.packet_factory.new_register_packet('REQ', self.address, address=self.address,
+                                                                  features=self.packet_factory.supported_features)
+                    # if the root can not be reached, the next root address is used
                     self.stream.add_node(self.root_address, set_register_connection=True)
-                    self.stream.add_message_to_out_buff(self.root_address, pck.get_buf(), is_register=True)
+                    self.__send_to_root(pck)
                 else:
                     logging.warning('root and register request??')
             elif command == 'Advertise':
                 if not self.is_root:
-                    pck = self.packet_factory.new_advertise_packet(type='REQ', source_server_address=self.address)
-                    # TODO what to do if there is no node with root address?
-                    self.stream.add_message_to_out_buff(self.root_address, pck.get_buf(), is_register=True)
-
-            elif len(command.split(' ')) == 2 and command.split(' ')[0] == 'SendMessage':
-                pck = self.packet_factory.new_message_packet(command.split(' ')[1], self.address)
-                self.send_broadcast_packet(pck)
+                    pck = self.packet_factory.new_advertise_packet(type='REQ', source_server_address=self.address,
+                                                                   version=self.__get_link_version(self.root_address, True))
+                    self.__send_to_root(pck)
+
+            elif command.startswith('SendMessage '):
+                self.send_message(command[len('SendMessage '):].encode())
+            elif command.startswith('SendTo ') and len(command.split(' ', 3)) == 4:
+                _, ip, port, message = command.split(' ', 3)
+                try:
+                    self.send_unicast(PeerAddress.from_text(ip, port), message.encode())
+                except ValueError:
+                    logging.warning('incorrect address: ' + ip + ' ' + port)
+            elif command.startswith('SendFile '):
+                path = command[len('SendFile '):]
+                try:
+                    self.__add_outgoing_message(open(path, 'rb'), os.path.getsize(path))
+                except OSError:
+                    logging.warning('can not read the file: ' + path)
             else:
                 logging.warning('Incorrect command')
 
         self.user_interface.buffer.clear()
 
+    def send_message(self, payload):
+        """
+        Broadcast a message through the network in the next cycle; It can be called from any thread.
+
+        :param payload: The message.
+        :type payload: bytes
+
+        :return:
+        """
+        self.pending_messages.append(bytes(payload))
+
+    def __send_pending_messages(self):
+        """
+        Send the payloads of send_message; Small ones in a Message packet of the version of every link (so they
+        are compressed once for all of the links which support it) and in our history, large ones in Fragment
+        packets.
+
+        :return:
+        """
+        while len(self.pending_messages) > 0:
+            payload = self.pending_messages.popleft()
+            if len(payload) > self.packet_factory.fragment_size:
+                self.__add_outgoing_message(io.BytesIO(payload), len(payload))
+                continue
+            message_id = (self.address, self.history.next_sequence())
+            packet = self.packet_factory.new_message_packet(payload, self.address, version=4, codec=self.message_codec,
+                                                            level=self.compression_level, message_id=message_id)
+            self.history.add(self.address, message_id[1],
+                             packet.get_body()[self.packet_factory.message_id_struct.size:])
+            self.__send_message_packet(lambda version: self.packet_factory.new_forwarded_message_packet(
+                packet, self.address, version=version))
+
+    def __send_message_packet(self, make_packet, except_address=None):
+        """
+        Send a Message packet to all of our neighbours (but 'except_address'); Every version of the packet is made
+        once, only for the links which need it.
+
+        :param make_packet: Function which makes the packet for a version.
+        :param except_address: The neighbour which the message came from.
+
+        :return:
+        """
+        bufs = {}
+        for node_address, node in self.stream.nodes.items():
+            if node_address == except_address:
+                continue
+            version = self.packet_factory.get_message_version(node.features)
+            if version not in bufs:
+                try:
+                    bufs[version] = make_packet(version).get_buf()
+                except UnicodeDecodeError:
+                    logging.warning('binary message can not be sent to the version 1 links')
+                    bufs[version] = None
+                except ValueError:
+                    logging.warning('wrong compressed message is not sent to the version %d links' % version)
+                    bufs[version] = None
+            if bufs[version] is not None:
+                self.stream.add_message_to_out_buff(node_address, bufs[version])
+
+    def send_unicast(self, address, payload):
+        """
+        Send a message to one peer in the next cycle; It can be called from any thread.
+
+        :param address: The destination IP/Port.
+        :param payload: At most unicast_size bytes.
+
+        :type address: tuple
+        :type payload: bytes
+
+        :return:
+
+        :raise ValueError: If the message does not fit in a Unicast packet.
+        """
+        if len(payload) > self.packet_factory.unicast_size:
+            raise ValueError('unicast message is longer than %d bytes' % self.packet_factory.unicast_size)
+        self.pending_unicasts.append((PeerAddress.get(address), bytes(payload)))
+
+    def __send_pending_unicasts(self):
+        while len(self.pending_unicasts) > 0:
+            destination, payload = self.pending_unicasts.popleft()
+            if destination == self.address:
+                self.unicast_callback(self.address, memoryview(payload))
+                continue
+            pck = self.packet_factory.new_unicast_packet(self.address, self.address, destination, payload)
+            self.__route_unicast(destination, pck.get_buf())
+
+    def __route_unicast(self, destination, buf, came_from=None):
+        """
+        Send a Unicast packet to the next hop: the destination if it is our neighbour, the child which the
+        destination is under it, or our parent.
+
+        Warnings:
+            1. A route to the child which the packet has come from is wrong (the destination has moved), so drop it
+               and send the packet up; The root has the right route.
+
+        :param destination: The destination of the packet.
+        :param buf: The packet.
+        :param came_from: The neighbour which has sent the packet to us.
+
+        :return:
+        """
+        if destination in self.stream.nodes and destination != came_from:
+            next_hop = destination
+        else:
+            next_hop = self.routing_table.lookup(destination)
+            if next_hop is not None and (next_hop == came_from or next_hop not in self.stream.nodes):
+                self.routing_table.forget(destination)
+                next_hop = None
+            if next_hop is None:
+                if self.is_root or self.parent_address is None:
+                    logging.warning('no route to ' + str(destination))
+                    return
+                next_hop = self.parent_address
+        self.stream.add_message_to_out_buff(next_hop, buf)
+
+    @staticmethod
+    def __log_unicast(origin, payload):
+        """
+        The default unicast callback.
+
+        :param origin: The peer which has sent the message.
+        :param payload: The message.
+
+        :type origin: PeerAddress
+        :type payload: memoryview
+
+        :return:
+        """
+        text = bytes(payload[:64]).decode('utf-8', 'replace')
+        logging.warning('unicast message ' + text + ('...' if len(payload) > 64 else '') + ' received from ' +
+                        str(origin))
+
+    @staticmethod
+    def __log_message(payload):
+        """
+        The default message callback.
+
+        :param payload: The message.
+        :type payload: memoryview
+
+        :return:
+        """
+        text = bytes(payload[:64]).decode('utf-8', 'replace')
+        logging.warning('message ' + text + ('...' if len(payload) > 64 else '') + ' received')
+
+    def __add_outgoing_message(self, content, size):
+        """
+        Start sending a large message in Fragment packets; They are sent in the next cycles by __send_fragments.
+
+        :param content: A file object of the message.
+        :param size: Number of bytes in the message.
+
+        :type size: int
+
+        :return:
+        """
+        message_id = self.rng.getrandbits(64)
+        logging.warning('fragmented message %016x of %d bytes sent' % (message_id, size))
+        self.outgoing_messages.append([message_id, content, size, 0])
+
+    def __send_fragments(self):
+        """
+        Send the next fragments of our large messages to all of our neighbours; At most fragments_per_cycle
+        packets in every cycle, so a large message never is in our memory at once.
+
+        :return:
+        """
+        if self.stripes > 1:
+            stripe_links = [self.__get_stripe_links(stripe) for stripe in range(self.stripes)]
+        else:
+            addresses = [address for address, node in self.stream.nodes.items()
+                         if node.features & self.packet_factory.feature_fragments]
+        budget = self.fragments_per_cycle
+        while budget > 0 and len(self.outgoing_messages) > 0:
+            message = self.outgoing_messages[0]
+            message_id, content, size, offset = message
+            data = content.read(self.packet_factory.fragment_size)
+            if len(data) > 0:
+                buf = self.packet_factory.new_fragment_packet(self.address, message_id, size, offset, data).get_buf()
+                if self.stripes > 1:
+                    for address in stripe_links[self.packet_factory.get_stripe(offset, self.stripes)]:
+                        self.stream.add_message_to_out_buff(address, buf, is_stripe=True)
+                else:
+                    for address in addresses:
+                        self.stream.add_message_to_out_buff(address, buf)
+                message[3] += len(data)
+                budget -= 1
+            if len(data) == 0 or message[3] >= size:
+                content.close()
+                self.outgoing_messages.popleft()
+
     # Done
     def run(self):
         """
@@ -147,39 +525,74 @@ class Peer:
         :return:
         """
         while True:
-            if not self.is_root and self.reunion_failed:
-                # just receive advertise responses and send advertise messages
-                # do we need to clear buffer when reunion failed? yes. just for the advertise responses
-                removed_bufs = []
-                for buf in self.stream.read_in_buf():
-                    pck = self.packet_factory.parse_buffer(buf)
-                    if pck is None:
-                        continue
-                    if pck.get_type() == 2 and pck.get_body()[0:3] == 'RES':
-                        # handle the advertise packet
-                        self.handle_packet(pck)
-                        removed_bufs.append(buf)
-                [self.stream._server_in_buf.remove(removed_buf) for removed_buf in removed_bufs]
-
-                for command in self.user_interface.buffer:
-                    if command == 'Advertise':
-                        pck = self.packet_factory.new_advertise_packet(type='REQ', source_server_address=self.address)
-                        # TODO what to do if there is no node with root address?
-                        self.stream.add_message_to_out_buff(self.root_address, pck.get_buf(), is_register=True)
-
-                self.stream.send_out_buf_messages(only_register=True)
-            else:
-                # do regularly
-                for buf in self.stream.read_in_buf():
-                    pck = self.packet_factory.parse_buffer(buf)
-                    if pck is None:
-                        continue
-                    self.handle_packet(pck)
-                self.handle_user_interface_buffer()
-                self.stream.send_out_buf_messages()
-                self.stream.clear_in_buff()
+            self.run_cycle()
             # sleep for 2 secs
-            time.sleep(2)
+            time.sleep(self.cycle_interval)
+
+    def run_cycle(self):
+        """
+        One cycle of the main loop: handle the received packets and the user commands and send the buffered
+        messages.
+
+        :return:
+        """
+        if not self.is_root and self.reunion_failed:
+            # just receive advertise responses and send advertise messages
+            # do we need to clear buffer when reunion failed? yes. just for the advertise responses
+            removed_bufs = []
+            bufs = list(self.stream.read_in_buf())
+            for buf, pck in zip(bufs, self.packet_factory.parse_many(bufs)):
+                if pck is None:
+                    continue
+                if pck.get_type() == 2 and pck.get_request_type() == 'RES':
+                    # handle the advertise packet
+                    self.handle_packet(pck)
+                    removed_bufs.append(buf)
+            [self.stream._server_in_buf.remove(removed_buf) for removed_buf in removed_bufs]
+
+            for command in self.user_interface.buffer:
+                if command == 'Advertise':
+                    pck = self.packet_factory.new_advertise_packet(
+                        type='REQ', source_server_address=self.address,
+                        version=self.__get_link_version(self.root_address, True))
+                    self.__send_to_root(pck)
+
+            self.stream.send_out_buf_messages(only_register=True)
+        else:
+            # do regularly
+            if self.is_root and not self.is_standby:
+                while self.standby_packets:
+                    self.handle_packet(self.standby_packets.popleft())
+            for pck in self.packet_factory.parse_many(self.stream.take_in_buf()):
+                if pck is None:
+                    continue
+                self.handle_packet(pck)
+            if self.is_root:
+                self.__handle_admitted_packets()
+                if self.standby_address is not None:
+                    self.__send_replication()
+                if self.journal is not None and self.journal.flush():
+                    self.journal.snapshot(self.network_graph, [address for address in self.stream.register_nodes
+                                                               if address != self.standby_address])
+            self.handle_user_interface_buffer()
+            self.__send_pending_messages()
+            self.__send_pending_unicasts()
+            self.routing_table.expire()
+            self.__send_fragments()
+            self.message_assembler.expire()
+            self.__send_summary(self.clock())
+            self.stream.send_out_buf_messages()
+
+    def __start_reunion_daemon(self):
+        """
+        Start the reunion daemon thread; Without our threads the caller sees reunion_daemon_started and runs
+        reunion_cycle.
+
+        :return:
+        """
+        self.reunion_daemon_started = True
+        if self.threads:
+            self.reunion_daemon.start()
 
     def run_reunion_daemon(self):
         """SendMessage: The following string will be added to a new Message packet and broadcast through the network.
@@ -206,45 +619,175 @@ class Peer:
 
         :return:
         """
+        if not self.is_root:
+            # spread the first Reunion Hello of the peers which have joined at the same time
+            time.sleep(self.reunion_timer.first_delay())
         while True:
-            t = time.time()
+            delay = self.reunion_cycle()
             if self.is_root:
-                removed_clients = []
-                for client_address in self.peer_last_reunion_hello_time.keys():
-                    # TODO calculate expected time of each client
-                    # wait_time = (self.network_graph.get_node_depth(client_address) + 1) * 2
-                    wait_time = 20
-                    if int(t - self.peer_last_reunion_hello_time[client_address]) > wait_time:
-                        # client time is over.
-                        logging.warning('reunion failed from ' + str(client_address))
-                        # TODO remove client from the network_graph and turn off its subtree
-                        self.network_graph.remove_node(client_address)
-                        # TODO remove from peer last reunion dict
-                        removed_clients.append(client_address)
-                # removing
-                [self.peer_last_reunion_hello_time.pop(client_address) for client_address in removed_clients]
-
+                time.sleep(delay)
             else:
-                if self.reunion_mode == 'pending':
-                    if int(t - self.last_sent_reunion_time) > self.time_interval:
-                        # time_out. need to send advertise again
-                        logging.warning('reunion back failed')
-                        pck = self.packet_factory.new_advertise_packet(type='REQ', source_server_address=self.address)
-                        self.stream.add_message_to_out_buff(self.root_address, pck.get_buf(), is_register=True)
-                        # self.stream.send_out_buf_messages(only_register=True)
-                        self.reunion_failed = True
-                    # TODO what to do when pending and it's not failed
-                else:
+                # a link down of our parent ends the sleep
+                self.link_down_event.wait(delay)
+                self.link_down_event.clear()
+
+    def reunion_cycle(self):
+        """
+        One cycle of the reunion daemon.
+
+        :return: Seconds until the next cycle.
+        :rtype: float
+        """
+        t = self.clock()
+        if self.is_root and self.is_standby:
+            if t - self.last_replication_time > 6:
+                logging.warning('no replication from the primary root since ' + str(self.last_replication_time))
+                self.__take_over()
+        elif self.is_root:
+            removed_clients = []
+            for client_address in self.peer_last_reunion_hello_time.keys():
+                # a Reunion Summary waits for one main loop cycle in every peer on its way up
+                wait_time = 20 + 2 * self.network_graph.node_depth.get(client_address, 0)
+                if int(t - self.peer_last_reunion_hello_time[client_address]) > wait_time:
+                    # client time is over.
+                    logging.warning('reunion failed from ' + str(client_address))
+                    # TODO remove client from the network_graph and turn off its subtree
+                    self.network_graph.remove_node(client_address)
+                    if self.striped_trees is not None and client_address in self.striped_trees:
+                        for address in self.striped_trees.remove(client_address):
+                            self.__send_stripe_parents(address)
+                    # TODO remove from peer last reunion dict
+                    removed_clients.append(client_address)
+            # removing
+            [self.peer_last_reunion_hello_time.pop(client_address) for client_address in removed_clients]
+
+        else:
+            # Stream removes the node when a message could not be sent to it or its link is down and a dead parent
+            # closes our connection, so a dead parent is found before the reunion timeout
+            parent = self.stream.get_node_by_server(self.parent_address[0], self.parent_address[1])
+            parent_lost = parent is None or not parent.is_alive()
+            if self.reunion_mode == 'pending' or parent_lost:
+                timed_out = self.reunion_mode == 'pending' and \
+                            int(t - self.last_sent_reunion_time) > self.time_interval
+                if parent_lost or timed_out:
+                    logging.warning('reunion back failed')
+                if parent_lost and ((self.parent_link_downs < 2 and self.__join_parent(self.parent_address)) or
+                                    (self.backup_address is not None and self.__join_backup_parent())):
+                    # our parent has restarted or we have joined the backup parent; the hello will tell the root
                     self.reunion_failed = False
-                    # send reunion hello
-                    self.last_sent_reunion_time = t
-                    self.reunion_mode = 'pending'
-                    pck = self.packet_factory.new_reunion_packet(type='REQ', source_address=self.address,
-                                                                 nodes_array=[self.address])
-                    self.stream.add_message_to_out_buff(self.parent_address, pck.get_buf())
+                    self.__send_reunion_hello(t)
+                elif timed_out and not parent_lost and not self.reunion_retried:
+                    # our parent is alive so the failure is above it and our ancestors will repair it
+                    self.reunion_retried = True
+                    self.__send_reunion_hello(t)
+                elif timed_out or parent_lost:
+                    # time_out or our parents are gone. need to send advertise again
+                    pck = self.packet_factory.new_advertise_packet(type='REQ',
+                                                                   source_server_address=self.address,
+                                                                   version=self.__get_link_version(
+                                                                       self.root_address, True))
+                    self.__send_to_root(pck)
+                    # self.stream.send_out_buf_messages(only_register=True)
+                    self.reunion_failed = True
+                # TODO what to do when pending and it's not failed
+            else:
+                self.reunion_failed = False
+                if not self.__is_link_active(self.parent_address, t) or \
+                        t - self.last_hello_back_time > self.hello_refresh_interval:
+                    self.__send_reunion_hello(t)
+                # otherwise our parent vouches for us in its Reunion Summary
+
+        if self.is_root:
+            # 4 seconds
+            return 4
+        return self.reunion_timer.next_delay()
+
+    def __send_to_root(self, packet):
+        """
+        Send the packet through our register_connection to the root; If the connection has failed, the root is down
+        and we will use the next root address.
+
+        :param packet: The packet for the root.
+        :type packet: Packet
+
+        :return:
+        """
+        node = self.stream.get_node_by_server(self.root_address[0], self.root_address[1], is_register=True)
+        if node is not None and not node.is_connected():
+            # the register connections are lazy; Connect now, so the packet is not lost on a root which is down
+            try:
+                node.connect()
+            except Exception:
+                self.stream.remove_node(node)
+                node = None
+        if node is None:
+            self.root_address = self.root_addresses[(self.root_addresses.index(self.root_address) + 1) %
+                                                    len(self.root_addresses)]
+            logging.warning('connection to the root has failed, using root: ' + str(self.root_address))
+            self.stream.add_node(self.root_address, set_register_connection=True)
+        self.stream.add_message_to_out_buff(self.root_address, packet.get_buf(), is_register=True)
 
-            # sleep for 4 seconds
-            time.sleep(4)
+    def __send_reunion_hello(self, t):
+        """
+        Send a new Reunion Hello packet to our parent and wait for its Hello Back.
+
+        :param t: Current time.
+        :return:
+        """
+        self.last_sent_reunion_time = t
+        self.reunion_mode = 'pending'
+        pck = self.packet_factory.new_reunion_packet(type='REQ', source_address=self.address,
+                                                     nodes_array=[self.address],
+                                                     version=self.__get_link_version(self.parent_address))
+        self.stream.add_message_to_out_buff(self.parent_address, pck.get_buf())
+
+    def __join_backup_parent(self):
+        """
+        When our parent fails we will join the backup parent which root has sent to us without asking the root.
+
+        :return: Whether we could connect to the backup parent.
+        :rtype: bool
+        """
+        backup_address = self.backup_address
+        self.backup_address = None
+        self.parent_link_downs = 0
+        logging.warning('parent failed, joining the backup parent: ' + str(backup_address))
+        return self.__join_parent(backup_address)
+
+    def __join_parent(self, address):
+        """
+        Connect to a new parent (or to our restarted parent) and send a Join packet to it.
+        The root finds out about our new parent from the path of our next Reunion Hello.
+
+        :param address: The parent address.
+        :type address: tuple
+
+        :return: Whether we could connect to the parent.
+        :rtype: bool
+        """
+        old_parent = self.stream.get_node_by_server(self.parent_address[0], self.parent_address[1])
+        if old_parent is not None:
+            self.stream.remove_node(old_parent)
+
+        self.parent_address = address
+        self.stream.add_node(self.parent_address)
+        if self.stream.get_node_by_server(self.parent_address[0], self.parent_address[1]) is None:
+            logging.warning('could not connect to the parent: ' + str(self.parent_address))
+            return False
+        self.__send_join_request()
+        return True
+
+    def __send_join_request(self):
+        """
+        Send a Join Request to our parent with the last messages that we have seen, so the parent sends back the
+        messages that we have missed.
+
+        :return:
+        """
+        pck = self.packet_factory.new_join_packet(self.address, features=self.packet_factory.supported_features,
+                                                  last_seen=self.history.get_last_seen(
+                                                      self.packet_factory.history_origins))
+        self.stream.add_message_to_out_buff(self.parent_address, pck.get_buf())
 
     # Done
     def send_broadcast_packet(self, broadcast_packet):
@@ -282,6 +825,23 @@ class Peer:
         if len(packet.get_body()) != packet.get_length():
             logging.warning('packet length is not correct')
             return
+        if packet.get_type() not in self.packet_factory.control_types and \
+                packet.get_source_server_address() in self.stream.nodes:
+            self.data_receive_times[packet.get_source_server_address()] = self.clock()
+        if packet.get_type() == 6:
+            self.__handle_replicate_packet(packet)
+            return
+        if self.is_root and self.is_standby:
+            # a peer may come to us when it can not reach the primary root, but we take over on the replication
+            # timeout only; Its packets wait for the take over
+            logging.warning('packet received from ' + str(packet.get_source_server_address()) + ' at standby root')
+            self.standby_packets.append(packet)
+            return
+        if self.is_root and packet.get_type() in (1, 2) and packet.get_request_type() == 'REQ':
+            # peers which are already in our NetworkGraph are recovering, admit them before the new ones
+            node = self.network_graph.find_node(packet.get_source_server_ip(), packet.get_source_server_port())
+            self.admission_queue.put(packet, priority=node is not None)
+            return
         if packet.get_type() == 1:
             self.__handle_register_packet(packet)
         elif packet.get_type() == 2:
@@ -292,6 +852,30 @@ class Peer:
             self.__handle_message_packet(packet)
         elif packet.get_type() == 5:
             self.__handle_reunion_packet(packet)
+        elif packet.get_type() == self.packet_factory.fragment_type:
+            self.__handle_fragment_packet(packet)
+        elif packet.get_type() == self.packet_factory.stripe_type:
+            self.__handle_stripe_packet(packet)
+        elif packet.get_type() == self.packet_factory.unicast_type:
+            self.__handle_unicast_packet(packet)
+        elif packet.get_type() == self.packet_factory.history_type:
+            self.__handle_history_packet(packet)
+
+    def __handle_admitted_packets(self):
+        """
+        Handle the Register and Advertise Requests which our AdmissionQueue has admitted in this cycle.
+        All admitted Advertise Requests will be placed in our NetworkGraph with one pass.
+
+        :return:
+        """
+        advertise_packets = []
+        for packet in self.admission_queue.take():
+            if packet.get_type() == 1:
+                self.__handle_register_packet(packet)
+            else:
+                advertise_packets.append(packet)
+        if len(advertise_packets) > 0:
+            self.__handle_advertise_requests(advertise_packets)
 
     # Done
     def __check_registered(self, source_address):
@@ -341,56 +925,35 @@ class Peer:
         :return:
         """
         # check if type of the packet is request
-        if packet.get_body()[0:3] == 'REQ':
+        if packet.get_request_type() == 'REQ':
             if not self.is_root:
                 logging.warning('received a request advertise packet on a non-root peer')
             else:
-                if not self.__check_registered(packet.get_source_server_address()):
-                    logging.warning(
-                        'not registered node wants to advertise, node address: ' + str(
-                            packet.get_source_server_address()))
-                    return
-
-                logging.warning('advertise request received from: ' + str(packet.get_source_server_address()))
-                # find the neighbour
-                neighbour_node = self.__get_neighbour(packet.get_source_server_address())
-                # add the node to its networkgraph
-                node = self.network_graph.find_node(packet.get_source_server_ip(), packet.get_source_server_port())
-                if node is not None:
-                    self.network_graph.turn_on_node(node.address, sub_tree=True)
-                    node.set_parent(neighbour_node)
-                else:
-                    self.network_graph.add_node(packet.get_source_server_ip(), packet.get_source_server_port(),
-                                                neighbour_node.address)
-
-                pck = self.packet_factory.new_advertise_packet(type='RES', source_server_address=self.address,
-                                                               neighbour=neighbour_node.address)
-                # send through register node
-                self.stream.add_message_to_out_buff(packet.get_source_server_address(), pck.get_buf(), is_register=True)
-
-                # add to peer last reunion hello time TODO im not sure of this
-                self.peer_last_reunion_hello_time[packet.get_source_server_address()] = time.time()
+                self.__handle_advertise_requests([packet])
 
-        elif packet.get_body()[0:3] == 'RES':
+        elif packet.get_request_type() == 'RES':
             if self.is_root:
                 logging.warning('root received advertise response')
                 return
             if packet.get_source_server_address() != self.root_address:
                 logging.warning('received advertise response from non-root peer')
                 return
+            try:
+                neighbour, backup = self.packet_factory.parse_advertise_body(packet)
+            except ValueError:
+                logging.warning('advertise response has invalid body')
+                return
 
-            neighbour_ip = packet.get_body()[3:18]
-            neighbour_port = packet.get_body()[18:23]
             # update parent
-            self.parent_address = (neighbour_ip, neighbour_port)
+            self.parent_address = neighbour
+            self.backup_address = backup
 
             logging.warning('advertise response received. the neighbour is: ' + str(self.parent_address))
             # Add parent node to the stream
             self.stream.add_node(self.parent_address)
 
             # make a join packet
-            pck = self.packet_factory.new_join_packet(self.address)
-            self.stream.add_message_to_out_buff(self.parent_address, pck.get_buf())
+            self.__send_join_request()
 
             # TODO im not sure of this
             self.reunion_failed = False
@@ -399,11 +962,57 @@ class Peer:
             self.reunion_mode = 'accept'
             # start reunion daemon
             if self.first_advertise_response:
-                self.reunion_daemon.start()
+                self.__start_reunion_daemon()
                 self.first_advertise_response = False
         else:
             logging.warning('undefined packet received')
 
+    def __handle_advertise_requests(self, packets):
+        """
+        Root will find the neighbours for a batch of Advertise Request packets with one NetworkGraph pass and answer
+        every sender with an Advertise Response packet.
+
+        :param packets: Advertise Request packets.
+        :type packets: list
+
+        :return:
+        """
+        senders = []
+        seen = set()
+        for packet in packets:
+            sender = packet.get_source_server_address()
+            if not self.__check_registered(sender):
+                logging.warning('not registered node wants to advertise, node address: ' + str(sender))
+                continue
+            if sender in seen:
+                continue
+            logging.warning('advertise request received from: ' + str(sender))
+            senders.append(sender)
+            seen.add(sender)
+
+        # find the neighbours and add the senders to our networkgraph
+        neighbours = self.network_graph.place_nodes(senders)
+        t = self.clock()
+        placed = []
+        responses = []
+        for sender, neighbour_node in zip(senders, neighbours):
+            if neighbour_node is None:
+                continue
+            placed.append(sender)
+            responses.append(self.packet_factory.new_advertise_packet(type='RES', source_server_address=self.address,
+                                                                      neighbour=neighbour_node.address,
+                                                                      backup=self.__get_backup(sender),
+                                                                      version=self.__get_link_version(sender, True)))
+            # add to peer last reunion hello time TODO im not sure of this
+            self.peer_last_reunion_hello_time[sender] = t
+            self.__log_operation('hello', sender)
+        for sender, buf in zip(placed, self.packet_factory.encode_many(responses)):
+            # send through register node
+            self.stream.add_message_to_out_buff(sender, buf, is_register=True)
+        if self.striped_trees is not None:
+            for sender in placed:
+                self.__place_in_striped_trees(sender)
+
     # Done
     def __handle_register_packet(self, packet):
         """
@@ -424,23 +1033,39 @@ class Peer:
             if packet.get_body()[0:3] != 'REQ':
                 logging.warning('response register packet arrived at root:)')
                 return
-            ip = packet.get_body()[3:18]
-            port = packet.get_body()[18:23]
-            sender_address = (ip, port)
+            try:
+                sender_address = PeerAddress.from_text(packet.get_body()[3:18], packet.get_body()[18:23])
+            except ValueError:
+                logging.warning('register request has an invalid address')
+                return
+            # old peers do not announce their features
+            features = self.packet_factory.parse_features(packet.get_body()[23:27]) or 0
             if not self.__check_registered(sender_address):
                 logging.warning('Register Request received from: ' + str(packet.get_source_server_address()))
                 self.stream.add_node(sender_address, set_register_connection=True)
-                pck = self.packet_factory.new_register_packet(type='RES', source_server_address=self.address)
+                self.__set_link_features(sender_address, features, True)
+                self.__log_operation('register', sender_address)
+                pck = self.packet_factory.new_register_packet(type='RES', source_server_address=self.address,
+                                                              phase=self.next_reunion_phase,
+                                                              features=self.packet_factory.supported_features)
+                # golden ratio steps keep the phases of the registered peers evenly spread
+                self.next_reunion_phase = (self.next_reunion_phase + 0.618034) % 1
                 self.stream.add_message_to_out_buff(address=sender_address,
                                                     message=pck.get_buf(), is_register=True)
             else:
                 logging.warning('an already registered node wants to register again')
+                self.__set_link_features(sender_address, features, True)
 
         else:
             if packet.get_body()[0:3] == 'REQ':
                 logging.warning('register request arrived at a non-root peer')
             elif packet.get_body()[0:3] == 'RES' and packet.get_body()[3:6] == 'ACK':
                 logging.warning('Register response received at ' + str(self.address))
+                if len(packet.get_body()) in (9, 13):
+                    self.reunion_timer.set_phase(int(packet.get_body()[6:9]) / 1000)
+                if len(packet.get_body()) in (10, 13):
+                    features = self.packet_factory.parse_features(packet.get_body()[-4:]) or 0
+                    self.__set_link_features(packet.get_source_server_address(), features, True)
             else:
                 logging.warning('incorrect register response received at ' + str(self.address))
 
@@ -480,12 +1105,125 @@ class Peer:
             logging.warning('received packet from unknown source')
             return
 
-        pck = self.packet_factory.new_message_packet(packet.get_body(), self.address)
-        logging.warning('message ' + packet.get_body() + ' received from ' + str(packet.get_source_server_address()))
-        for node_address in self.stream.nodes:
-            if node_address != packet.get_source_server_address():
-                logging.warning('message ' + packet.get_body() + ' sent to ' + str(node_address))
-                self.stream.add_message_to_out_buff(node_address, pck.get_buf())
+        try:
+            message = self.packet_factory.get_message_payload(packet)
+            if self.packet_factory.get_message_id(packet) is None:
+                # the message has come from a link without the Message History feature, we give it its ID
+                packet = self.packet_factory.new_forwarded_message_packet(
+                    packet, self.address, version=4, message_id=(self.address, self.history.next_sequence()))
+        except UnicodeDecodeError:
+            logging.warning('received message was wrong')
+            return
+        except ValueError:
+            logging.warning('received compressed message was wrong')
+            return
+
+        self.__handle_identified_message(packet, message)
+
+    def __handle_identified_message(self, packet, message):
+        """
+        Keep a version 4 Message in our history, forward it to our other neighbours and deliver it if it is not
+        older than the last message of its origin that we have seen.
+
+        :param packet: Version 4 Message packet.
+        :param message: The message of the packet.
+
+        :type packet: Packet
+        :type message: str or bytes
+
+        :return:
+        """
+        origin, sequence = self.packet_factory.get_message_id(packet)
+        if not self.history.add(origin, sequence, packet.get_body()[self.packet_factory.message_id_struct.size:]):
+            return
+
+        # the body is not decoded (or decompressed) for the links of the same version
+        self.__send_message_packet(lambda version: self.packet_factory.new_forwarded_message_packet(
+            packet, self.address, version=version), except_address=packet.get_source_server_address())
+
+        self.message_callback(memoryview(message.encode() if isinstance(message, str) else message))
+
+    def __handle_history_packet(self, packet):
+        """
+        Handle the messages that we have missed, which our new parent has sent after our Join, like the Message
+        packets; So our children receive them too.
+
+        :param packet: Arrived History packet.
+        :type packet: Packet
+
+        :return:
+        """
+        source = packet.get_source_server_address()
+        if not self.__check_neighbour(source):
+            logging.warning('received packet from unknown source')
+            return
+        try:
+            messages = self.packet_factory.parse_history_body(packet)
+        except ValueError:
+            logging.warning('received history packet was wrong')
+            return
+
+        for origin, sequence, body in messages:
+            message_packet = self.packet_factory.new_identified_message_packet(source, origin, sequence, body)
+            try:
+                message = self.packet_factory.get_message_payload(message_packet)
+            except ValueError:
+                logging.warning('received compressed message was wrong')
+                continue
+            self.__handle_identified_message(message_packet, message)
+
+    def __handle_fragment_packet(self, packet):
+        """
+        Forward the fragment to our other neighbours right now (before the whole message arrives) and put it in its
+        message.
+
+        :param packet: Arrived Fragment packet
+
+        :type packet Packet
+
+        :return:
+        """
+        source = packet.get_source_server_address()
+        if not self.__check_neighbour(source) and source not in self.stripe_parents and \
+                source not in self.stripe_children:
+            logging.warning('received packet from unknown source')
+            return
+        try:
+            message_id, message_size, offset, data = self.packet_factory.parse_fragment_body(packet)
+        except ValueError:
+            logging.warning('fragment packet has invalid body')
+            return
+
+        buf = None
+        if self.stripes > 1:
+            # only on the links of the fragment tree
+            for address in self.__get_stripe_links(self.packet_factory.get_stripe(offset, self.stripes), source):
+                if buf is None:
+                    buf = self.packet_factory.new_forwarded_fragment_packet(packet, self.address).get_buf()
+                self.stream.add_message_to_out_buff(address, buf, is_stripe=True)
+        else:
+            for node_address, node in self.stream.nodes.items():
+                if node_address != source and node.features & self.packet_factory.feature_fragments:
+                    if buf is None:
+                        buf = self.packet_factory.new_forwarded_fragment_packet(packet, self.address).get_buf()
+                    self.stream.add_message_to_out_buff(node_address, buf)
+
+        message = self.message_assembler.add(message_id, message_size, offset, data)
+        if message is None:
+            return
+        if not isinstance(message, str):
+            logging.warning('fragmented message %016x of %d bytes received' % (message_id, message_size))
+            self.message_callback(memoryview(message))
+            return
+        logging.warning('fragmented message %016x of %d bytes received, saved in %s' % (
+            message_id, message_size, message))
+        # the callback reads the file through the page cache
+        with open(message, 'rb') as content, mmap.mmap(content.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view = memoryview(data)
+            try:
+                self.message_callback(view)
+            finally:
+                view.release()
 
     # Done
     def __handle_reunion_packet(self, packet):
@@ -511,56 +1249,180 @@ class Peer:
         :param packet: Arrived reunion packet
         :return:
         """
+        if packet.get_request_type() == 'SUM':
+            self.__handle_summary_packet(packet)
+            return
+        if packet.get_request_type() == 'PRB':
+            # the ACK of a Reunion Probe is its answer
+            return
+        if packet.get_request_type() == 'REQ' and not self.is_root:
+            # add your ip/port; the entries are not parsed here (unless the link to our parent needs another
+            # version), the root will check them
+            try:
+                self.routing_table.learn(self.packet_factory.get_reunion_origin(packet),
+                                         packet.get_source_server_address())
+                pck = self.packet_factory.new_relayed_reunion_packet(
+                    packet, self.address, version=self.__get_link_version(self.parent_address))
+            except ValueError:
+                logging.warning('reunion packet has invalid body (nodes array is not correct)')
+                return
+            if pck is not None:
+                self.stream.add_message_to_out_buff(self.parent_address, pck.get_buf())
+            return
+
         try:
-            body = packet.get_body()
-            nodes_array = []
-            i = 5
-            while i < len(body):
-                nodes_array.append((body[i:(i + 15)], body[(i + 15):(i + 20)]))
-                i += 20
-        except:
+            nodes_array, backup = self.packet_factory.parse_reunion_body(packet)
+        except ValueError:
             logging.warning('reunion packet has invalid body (nodes array is not correct)')
             return
 
         # reunion hello
-        t = time.time()
-        if packet.get_body()[0:3] == 'REQ':
+        t = self.clock()
+        if packet.get_request_type() == 'REQ':
             if self.is_root:
                 # Answer reunion hello back
-                self.peer_last_reunion_hello_time[nodes_array[0]] = t
+                self.routing_table.learn(nodes_array[0], nodes_array[-1])
+                # the peer may have joined its backup parent, or its ancestors may have been removed after a failure
+                parent_address = self.address
+                for address in reversed(nodes_array):
+                    self.__update_peer_parent(address, parent_address)
+                    parent_address = address
+                    # the middle peers have relayed the hello, so they are alive too
+                    self.__refresh_peer(address, t)
                 self.network_graph.turn_on_node(nodes_array[0])
+                backup = self.__get_backup(nodes_array[0])
                 nodes_array.reverse()
                 pck = self.packet_factory.new_reunion_packet(type='RES', source_address=self.address,
-                                                             nodes_array=nodes_array)
+                                                             nodes_array=nodes_array, backup=backup,
+                                                             version=self.__get_link_version(nodes_array[0]))
                 neighbour_addr = nodes_array[0]
                 self.stream.add_message_to_out_buff(neighbour_addr, pck.get_buf())
 
-            else:
-                # add your ip/port
-                nodes_array.append(self.address)
-                pck = self.packet_factory.new_reunion_packet(type='REQ', source_address=self.address,
-                                                             nodes_array=nodes_array)
-                self.stream.add_message_to_out_buff(self.parent_address, pck.get_buf())
-
         # reunion hello back
-        elif packet.get_body()[0:3] == 'RES':
+        elif packet.get_request_type() == 'RES':
             if nodes_array[0] != self.address:
                 logging.warning(
                     'the last address in the reunion back packet body and the receiver address are not the same')
                 return
             if len(nodes_array) == 1:
                 # the end client
+                self.last_hello_back_time = t
+                self.parent_link_downs = 0
                 self.reunion_mode = 'accept'
+                self.reunion_retried = False
+                self.backup_address = backup
                 # self.time_interval = t - self.last_sent_reunion_time
                 # self.last_sent_reunion_time = t
             elif len(nodes_array) > 1:
                 # the middle client
-                pck = self.packet_factory.new_reunion_packet(type='RES', source_address=self.address,
-                                                             nodes_array=nodes_array[1:])
+                pck = self.packet_factory.new_forwarded_reunion_packet(
+                    packet, self.address, version=self.__get_link_version(nodes_array[1]))
                 self.stream.add_message_to_out_buff(nodes_array[1], pck.get_buf())
             else:
                 logging.warning('the reunion back packet has no nodes array in its body')
 
+    def __handle_summary_packet(self, packet):
+        """
+        Keep the peers which our child has vouched for in our next Reunion Summary; The root refreshes them.
+        They are in the sub-tree of the child, so the Summary refreshes our routes to them like their Reunion Hellos.
+
+        :param packet: Arrived Reunion Summary.
+        :type packet: Packet
+
+        :return:
+        """
+        source = packet.get_source_server_address()
+        if not self.__check_neighbour(source) or source == self.parent_address:
+            logging.warning('reunion summary received from a peer which is not our child: ' + str(source))
+            return
+        try:
+            addresses, _ = self.packet_factory.parse_reunion_body(packet)
+        except ValueError:
+            logging.warning('reunion packet has invalid body (nodes array is not correct)')
+            return
+        for address in addresses:
+            self.routing_table.learn(address, source)
+        if self.is_root:
+            t = self.clock()
+            for address in addresses:
+                self.__refresh_peer(address, t)
+        else:
+            self.summary.update(addresses)
+
+    def __handle_link_down(self, address, is_register):
+        """
+        Stream has removed the node of 'address' because its link is down; Its buffered messages are discarded.
+        If it was our parent, the reunion daemon wakes up and joins our backup parent (or advertises again); A dead
+        child is removed from our NetworkGraph by the reunion timeout.
+
+        :param address: The neighbour.
+        :param is_register: Whether it was a register node; The root connections are handled in __send_to_root.
+
+        :type address: PeerAddress
+        :type is_register: bool
+
+        :return:
+        """
+        if is_register:
+            return
+        self.data_receive_times.pop(address, None)
+        if not self.is_root and address == self.parent_address:
+            logging.warning('link down to our parent: ' + str(address))
+            self.parent_link_downs += 1
+            self.link_down_event.set()
+        else:
+            logging.warning('link down to our child: ' + str(address))
+
+    def __is_link_active(self, address, t):
+        """
+
+        :return: Whether a data packet or the ACK of our data packet has passed the link to 'address' in the last
+                 idle_threshold seconds.
+        :rtype: bool
+        """
+        node = self.stream.nodes.get(address)
+        if node is None or not node.is_alive():
+            return False
+        return t - max(node.last_data_ack_time, self.data_receive_times.get(address, 0)) < self.idle_threshold
+
+    def __send_summary(self, t):
+        """
+        Vouch for our active children and the peers that they have vouched for: the root refreshes them, otherwise
+        we send them to our parent in Reunion Summary packets.
+
+        :param t: Current time.
+        :return:
+        """
+        for address in list(self.data_receive_times):
+            if address not in self.stream.nodes:
+                del self.data_receive_times[address]
+        summary, self.summary = self.summary, set()
+        summary.update(address for address in self.stream.nodes
+                       if address != self.parent_address and self.__is_link_active(address, t))
+        if self.is_root:
+            for address in summary:
+                self.__refresh_peer(address, t)
+        elif len(summary) > 0 and self.parent_address is not None:
+            for pck in self.packet_factory.new_summary_packets(self.address, list(summary),
+                                                               version=self.__get_link_version(self.parent_address)):
+                self.stream.add_message_to_out_buff(self.parent_address, pck.get_buf())
+
+    def __refresh_peer(self, address, t):
+        """
+        Root will keep the peer alive; Our standby root is told at most once per Reunion interval of the peer.
+
+        :param address: A peer of our NetworkGraph.
+        :param t: Current time.
+
+        :return:
+        """
+        if self.network_graph.find_node(address[0], address[1]) is None:
+            return
+        last_time = self.peer_last_reunion_hello_time.get(address, 0)
+        self.peer_last_reunion_hello_time[address] = t
+        if t - last_time >= 4:
+            self.__log_operation('hello', address)
+
     # Done
     def __handle_join_packet(self, packet):
         """
@@ -574,6 +1436,12 @@ class Peer:
 
         :return:
         """
+        features, join_type = self.packet_factory.parse_join_body(packet)
+        if join_type == 'RES':
+            # the answer of our Join Request
+            self.__set_link_features(packet.get_source_server_address(), features)
+            return
+
         if self.stream.get_node_by_server(packet.get_source_server_ip(), packet.get_source_server_port()) is None:
             self.stream.add_node(packet.get_source_server_address())
             # Do nothing else??
@@ -581,22 +1449,324 @@ class Peer:
         else:
             logging.warning('an already joined peer wants to join again, the address is: ' + str(
                 packet.get_source_server_address()))
+        # a new child
+        self.routing_table.learn(packet.get_source_server_address(), packet.get_source_server_address())
+        if join_type == 'REQ' and self.__set_link_features(packet.get_source_server_address(), features):
+            pck = self.packet_factory.new_join_packet(self.address, features=self.packet_factory.supported_features,
+                                                      type='RES')
+            self.stream.add_message_to_out_buff(packet.get_source_server_address(), pck.get_buf())
+            last_seen = self.packet_factory.parse_join_history(packet)
+            if last_seen is not None and features & self.packet_factory.feature_message_history:
+                # the messages that the new child has missed, in as few packets as possible
+                for pck in self.packet_factory.new_history_packets(self.address, self.history.get_after(last_seen)):
+                    self.stream.add_message_to_out_buff(packet.get_source_server_address(), pck.get_buf())
+
+    def __handle_unicast_packet(self, packet):
+        """
+        Deliver the Unicast packet if it is for us, otherwise send it to the next hop.
 
-    # Done
-    def __get_neighbour(self, sender):
+        :param packet: Arrived Unicast packet.
+        :type packet: Packet
+
+        :return:
         """
-        Finds the best neighbour for the 'sender' from the network_nodes array.
+        source = packet.get_source_server_address()
+        if not self.__check_neighbour(source):
+            logging.warning('received packet from unknown source')
+            return
+        try:
+            ttl, origin, destination, message = self.packet_factory.parse_unicast_body(packet)
+        except ValueError:
+            logging.warning('unicast packet has invalid body')
+            return
+        if source != self.parent_address:
+            # the origin is in the sub-tree of the child
+            self.routing_table.learn(origin, source)
+        if destination == self.address:
+            self.unicast_callback(origin, memoryview(message))
+            return
+        pck = self.packet_factory.new_forwarded_unicast_packet(packet, self.address)
+        if pck is None:
+            logging.warning('unicast packet to ' + str(destination) + ' is dropped, its TTL is over')
+            return
+        self.__route_unicast(destination, pck.get_buf(), came_from=source)
+
+    def __handle_stripe_packet(self, packet):
+        """
+        Parents: The root has placed us in its striped trees; Tell the new parents (and the old ones which are not
+        our parents anymore) which trees our links are in.
+
+        Link: A child in the striped trees tells us the trees of its link.
+
+        :param packet: Arrived Stripe packet.
+        :type packet: Packet
+
+        :return:
+        """
+        try:
+            kind, value = self.packet_factory.parse_stripe_body(packet)
+        except ValueError:
+            logging.warning('stripe packet has invalid body')
+            return
+        source = packet.get_source_server_address()
+        if kind == 'RES':
+            if self.is_root or source != self.root_address:
+                logging.warning('stripe parents received from ' + str(source) + ' which is not the root')
+                return
+            parents = {}
+            for stripe, parent in enumerate(value):
+                parents[parent] = parents.get(parent, 0) | (1 << stripe)
+            for address in set(parents) | set(self.stripe_parents):
+                bitmap = parents.get(address, 0)
+                if bitmap != self.stripe_parents.get(address, 0):
+                    self.__add_stripe_link(address)
+                    pck = self.packet_factory.new_stripe_packet(self.address, bitmap=bitmap)
+                    self.stream.add_message_to_out_buff(address, pck.get_buf(), is_stripe=True)
+            self.stripe_parents = parents
+            self.stripes = len(value)
+            logging.warning('stripe parents received: ' + ', '.join(str(parent) for parent in value))
+        elif self.is_root and not self.__check_registered(source):
+            # our register nodes are the registered peers
+            logging.warning('stripe link from a not registered peer: ' + str(source))
+        elif value == 0:
+            self.stripe_children.pop(source, None)
+        else:
+            self.__add_stripe_link(source)
+            self.stripe_children[source] = value
+
+    def __place_in_striped_trees(self, address):
+        """
+        Root places the peer in its striped trees (if it is not there) and sends the new parents to the peer and to
+        the peers whose parents have changed.
+
+        :param address: The peer address.
+        :type address: tuple
+
+        :return:
+        """
+        node = self.stream.get_node_by_server(address[0], address[1], is_register=True)
+        if node is None or not node.features & self.packet_factory.feature_striped_trees:
+            return
+        for changed in self.striped_trees.add(address) | {address}:
+            self.__send_stripe_parents(changed)
+
+    def __send_stripe_parents(self, address):
+        pck = self.packet_factory.new_stripe_packet(self.address, parents=self.striped_trees.get_parents(address))
+        self.stream.add_message_to_out_buff(address, pck.get_buf(), is_register=True)
+
+    def __add_stripe_link(self, address):
+        """
+        Links of the striped trees are lazy connections like the register connections, but they are stripe nodes of
+        our Stream; Our register nodes are the registered peers (of the root) and our connection to the root.
+
+        :param address: The peer address.
+        :type address: tuple
+
+        :return:
+        """
+        if self.stream.get_node_by_server(address[0], address[1], is_stripe=True) is None:
+            self.stream.add_node(address, set_stripe_connection=True)
+
+    def __get_stripe_links(self, stripe, except_address=None):
+        """
+        :param stripe: A striped tree.
+        :param except_address: The peer which the fragment came from.
+
+        :type stripe: int
+        :type except_address: tuple
+
+        :return: Addresses of our parent and children in the tree which we still have a connection to.
+        :rtype: list
+        """
+        bit = 1 << stripe
+        return [address for links in (self.stripe_parents, self.stripe_children) for address, bitmap in links.items()
+                if bitmap & bit and address != except_address and address in self.stream.stripe_nodes]
+
+    def __set_link_features(self, address, features, is_register=False):
+        """
+        Keep the features that both of us and the peer with 'address' support in the Node of the link.
+
+        :param address: The peer address.
+        :param features: Feature bitmap of the peer.
+        :param is_register: Whether the link is a register connection or not.
+
+        :return: Whether the link exists.
+        :rtype: bool
+        """
+        node = self.stream.get_node_by_server(address[0], address[1], is_register=is_register)
+        if node is None:
+            return False
+        node.features = self.packet_factory.supported_features & (features or 0)
+        return True
+
+    def __get_link_version(self, address, is_register=False):
+        """
+
+        :return: Version of the fastest body format which the link to 'address' supports.
+        :rtype: int
+        """
+        node = self.stream.get_node_by_server(address[0], address[1], is_register=is_register)
+        return self.packet_factory.get_version(0 if node is None else node.features)
+
+    def __update_peer_parent(self, address, parent_address):
+        """
+        Root will move the peer in the NetworkGraph if it has joined a new parent (e.g. its backup parent).
+
+        :param address: The peer address.
+        :param parent_address: The parent address which the peer has reported.
+        :return:
+        """
+        node = self.network_graph.find_node(address[0], address[1])
+        if node is None:
+            self.network_graph.add_node(address[0], address[1], parent_address)
+        elif node.parent is None or node.parent.address != parent_address:
+            logging.warning('peer ' + str(address) + ' has joined a new parent: ' + str(parent_address))
+            self.network_graph.move_node(address, parent_address)
+
+    def __get_backup(self, address):
+        """
+        Finds the backup parent for the peer with 'address'.
         This function only will call when you are a root peer.
 
-        Code design suggestion:
-            1. Use your NetworkGraph find_live_node to find the best neighbour.
+        :param address: The peer address.
+        :return: Backup parent address or None.
+        """
+        node = self.network_graph.find_backup_node(address)
+        if node is None:
+            # the children of the root will join our standby root
+            return self.standby_address
+        return node.address
+
+    def __log_operation(self, operation, address, argument=None):
+        """
+        Keep the operation for our standby root and our journal; It is also our NetworkGraph listener.
+
+        :return:
+        """
+        if self.standby_address is not None:
+            self.replication_log.append((operation, address, argument))
+        if self.journal is not None:
+            self.journal.record(operation, address, argument)
+
+    def __load_journal(self, directory):
+        """
+        Load our NetworkGraph and registered peers from our journal after a restart.
 
-        :param sender: Sender of the packet
-        :return: The specified neighbour for the sender; The format is like ('192.168.001.001', '05335').
+        Warnings:
+            1. The hello times are not in the journal; the peers get twice the usual time to find out that we have
+               restarted and send their Reunion Hello again.
+
+        :param directory: The journal directory.
+        :type directory: str
+
+        :return:
+        """
+        self.journal = RootJournal(directory)
+        t = self.clock()
+        registered = self.journal.load(self.network_graph)
+        for address in registered:
+            if not self.__check_registered(address):
+                self.stream.add_node(address, set_register_connection=True)
+        for address in self.network_graph.nodes:
+            if address != self.address:
+                self.peer_last_reunion_hello_time[address] = t + 20
+        logging.warning('journal loaded in %.3f seconds: %d nodes, %d registered peers' % (
+            self.clock() - t, len(self.peer_last_reunion_hello_time), len(registered)))
+
+    def __get_state_operations(self):
         """
-        node = self.network_graph.find_live_node(sender)
+
+        :return: Replicate operations which make our whole state in the standby root.
+        :rtype: list
+        """
+        operations = [('reset', None, None)]
+        for address in self.stream.register_nodes:
+            if address != self.standby_address:
+                operations.append(('register', address, None))
+        operations += self.network_graph.get_operations()
+        for address in self.peer_last_reunion_hello_time:
+            operations.append(('hello', address, None))
+        return operations
+
+    def __send_replication(self):
+        """
+        Root will send the logged operations to its standby root in every interval; An empty Replicate Response
+        is a heartbeat.
+
+        Warnings:
+            1. If the connection to the standby has failed we have lost some operations, so send the whole state
+               again.
+
+        :return:
+        """
+        if self.stream.get_node_by_server(self.standby_address[0], self.standby_address[1], is_register=True) is None:
+            self.stream.add_node(self.standby_address, set_register_connection=True)
+            self.replication_log = self.__get_state_operations()
+
+        operations = self.replication_log
+        self.replication_log = []
+        # every packet should fit in one read of the standby server
+        for i in range(0, max(len(operations), 1), 40):
+            pck = self.packet_factory.new_replicate_packet('RES', self.address, operations[i:(i + 40)])
+            self.stream.add_message_to_out_buff(self.standby_address, pck.get_buf(), is_register=True)
+
+    def __handle_replicate_packet(self, packet):
+        """
+        Request:
+            The standby root wants our whole state.
+
+        Response:
+            If we are a standby root, do the operations of the primary root.
+
+        :param packet: Arrived replicate packet.
+        :type packet: Packet
+
+        :return:
+        """
+        if not self.is_root:
+            logging.warning('replicate packet arrived at a non-root peer')
+        elif packet.get_body()[0:3] == 'REQ':
+            if packet.get_source_server_address() != self.standby_address:
+                logging.warning('replicate request from unknown standby: ' + str(packet.get_source_server_address()))
+                return
+            self.replication_log = self.__get_state_operations()
+        elif packet.get_body()[0:3] == 'RES':
+            if not self.is_standby or packet.get_source_server_address() != self.primary_address:
+                logging.warning('replicate response from unknown primary: ' + str(packet.get_source_server_address()))
+                return
+            self.last_replication_time = self.clock()
+            try:
+                operations = self.packet_factory.parse_replicate_body(packet.get_body())
+            except (KeyError, IndexError, ValueError, struct.error):
+                logging.warning('replicate packet has invalid body')
+                return
+            for operation, address, argument in operations:
+                if operation == 'reset':
+                    self.network_graph = NetworkGraph(self.primary_address)
+                    self.peer_last_reunion_hello_time = {}
+                elif operation == 'register':
+                    if not self.__check_registered(address):
+                        self.stream.add_node(address, set_register_connection=True)
+                elif operation == 'hello':
+                    self.peer_last_reunion_hello_time[address] = self.last_replication_time
+                else:
+                    if operation == 'remove':
+                        self.peer_last_reunion_hello_time.pop(address, None)
+                    self.network_graph.apply(operation, address, argument)
+
+    def __take_over(self):
+        """
+        The primary root has failed; A standby root will become the root of the network with the replicated state.
+        The peers get a grace period before their Reunion Hello times out.
+
+        :return:
+        """
+        logging.warning('standby root takes over the network')
+        self.is_standby = False
+        self.network_graph.set_root_address(self.address)
+        t = self.clock()
+        for address in self.peer_last_reunion_hello_time:
+            self.peer_last_reunion_hello_time[address] = t
+        node = self.stream.get_node_by_server(self.primary_address[0], self.primary_address[1], is_register=True)
         if node is not None:
-            return node
-        else:
-            logging.warning('There is no neighbour node for the sender')
-            return None
+            self.stream.remove_node(node)
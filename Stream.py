@@ -1,8 +1,17 @@
+import collections
+import os
+import socket
+import stat
+import tempfile
+import time
+import unittest
 import warnings
 
+from Packet import PacketFactory
 from tools.simpletcp.tcpserver import TCPServer
 
 from tools.Node import Node
+from tools.PeerAddress import PeerAddress
 import threading
 
 import logging
@@ -12,28 +21,75 @@ logging.basicConfig(format='%(asctime)s %(message)s')
 
 class Stream:
 
-    def __init__(self, ip, port):
+    def __init__(self, ip, port, register_idle_timeout=10, max_register_connections=256, is_control=None,
+                 socket_options=None, probe=None, probe_interval=4, link_down_callback=None, unix_directory=None,
+                 clock=time.time, frame_length=None):
         """
         The Stream object constructor.
 
         Code design suggestion:
             1. Make a separate Thread for your TCPServer and start immediately.
 
+        Register nodes only open their ClientSocket when they have something to send and we close it after
+        'register_idle_timeout' seconds, so the root does not hold a socket for every peer of the network.
 
         :param ip: 15 characters
         :param port: 5 characters
+        :param register_idle_timeout: Seconds after the last send that a register connection will be closed.
+        :param max_register_connections: Maximum number of open register connections; least recently used
+                                         connections will be closed after this.
+        :param is_control: Function which tells whether a message is a control message; Control messages are sent
+                           before the other messages of every node, so they do not wait behind a bulk of data.
+        :param socket_options: Keyword arguments of the ClientSockets (keepalive, user_timeout and timeout); The
+                               keepalive and user_timeout are also set on the connections of our TCPServer.
+        :param probe: A control message which is sent to a node that we have sent nothing for 'probe_interval'
+                      seconds; A dead or hung peer does not answer it, so an idle link is checked too.
+        :param probe_interval: Seconds.
+        :param link_down_callback: Function which is called with the address of a node and whether it is a register
+                                   node, when we remove the node because its link is down; It is not called for the
+                                   stripe nodes.
+        :param unix_directory: Directory of the Unix domain sockets of the peers on this host; Our TCPServer also
+                               listens on one and a node of a peer on this host (loopback or our IP) connects to
+                               the socket of the peer, if there is one, instead of TCP. None turns it off. It should
+                               be a private directory of our user (e.g. made by tempfile.mkdtemp), otherwise
+                               another user could listen on the socket of a peer; We do not use a directory which
+                               other users can write to.
+        :param clock: Function which returns the current time in seconds.
+        :param frame_length: Function which tells the size of a message from its start (see ServerSocket); With it
+                             our TCPServer puts whole messages in our in_buf, even if they have arrived in more
+                             than one read. Without it every read is a message.
         """
 
-        ip = Node.parse_ip(ip)
-        port = Node.parse_port(port)
-
-        self.server_address = (ip, port)
+        self.server_address = PeerAddress.from_text(ip, port)
+        ip, port = self.server_address
         self._server_in_buf = []
 
         # Dict for nodes {address: node object} and register nodes
-        # address is (ip, port)
+        # address is a PeerAddress
         self.nodes = {}
         self.register_nodes = {}
+        # links of the striped trees; They are lazy like the register nodes, but they are not our neighbours in the
+        # tree and not registered peers, so they are kept apart from both
+        self.stripe_nodes = {}
+
+        self.register_idle_timeout = register_idle_timeout
+        self.max_register_connections = max_register_connections
+        # open register connections in least recently used order, {address: node}
+        self._connected_register_nodes = collections.OrderedDict()
+        self.is_control = is_control
+        # nodes which have control messages to send, they may be added by other threads (e.g. the reunion daemon)
+        self._control_nodes = collections.deque()
+        self.socket_options = socket_options or {}
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.link_down_callback = link_down_callback
+        if unix_directory is not None and not self.__is_private_directory(unix_directory):
+            logging.warning('the Unix socket directory is not private, using TCP only: ' + str(unix_directory))
+            unix_directory = None
+        self.unix_directory = unix_directory
+        self.clock = clock
+        self.frame_length = frame_length
+        self._server = None
 
         def callback(address, queue, data):
             """
@@ -47,10 +103,53 @@ class Stream:
             queue.put(bytes('ACK', 'utf8'))
             self._server_in_buf.append(data)
 
-        server = TCPServer(ip, int(port), callback)
+        self._start_server(callback)
+
+    def _start_server(self, callback):
+        """
+        Start our TCPServer in its thread.
+
+        :param callback: The read callback of the TCPServer.
+
+        :return:
+        """
+        ip, port = self.server_address
+        server = TCPServer(ip, int(port), callback, maximum_connections=128,
+                           keepalive=self.socket_options.get('keepalive'),
+                           user_timeout=self.socket_options.get('user_timeout'),
+                           unix_path=self.get_unix_path(self.server_address), frame_length=self.frame_length)
 
         tcp = threading.Thread(target=server.run)
         tcp.start()
+        self._server = server
+
+    def close(self):
+        """
+        Stop our TCPServer (its Unix domain socket is removed) and close the connections of our nodes.
+
+        :return:
+        """
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for node in list(self.nodes.values()) + list(self.register_nodes.values()) + list(self.stripe_nodes.values()):
+            node.close()
+        self._connected_register_nodes.clear()
+
+    @staticmethod
+    def __is_private_directory(directory):
+        """
+
+        :return: Whether the directory is ours and the other users can not write to it.
+        :rtype: bool
+        """
+        try:
+            status = os.stat(directory)
+        except OSError:
+            return False
+        if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+            return False
+        return stat.S_ISDIR(status.st_mode) and not status.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
 
     def get_server_address(self):
         """
@@ -60,6 +159,22 @@ class Stream:
         """
         return self.server_address
 
+    def get_unix_path(self, address):
+        """
+
+        :param address: IP/Port of a peer.
+        :type address: tuple
+
+        :return: The Unix domain socket of the peer if it is on this host, otherwise None.
+        :rtype: str
+        """
+        if self.unix_directory is None:
+            return None
+        address = PeerAddress.get(address)
+        if not address.ip.startswith('127.') and address.ip != self.server_address.ip:
+            return None
+        return os.path.join(self.unix_directory, 'peer-%s-%s.sock' % (address.ip, address.port))
+
     def clear_in_buff(self):
         """
         Discard any data in TCPServer input buffer.
@@ -68,27 +183,50 @@ class Stream:
         """
         self._server_in_buf.clear()
 
-    def add_node(self, server_address, set_register_connection=False):
+    def add_node(self, server_address, set_register_connection=False, set_stripe_connection=False):
         """
         Will add new a node to our Stream.
 
         :param server_address: New node TCPServer address.
         :param set_register_connection: Shows that is this connection a register_connection or not.
+        :param set_stripe_connection: Whether the connection is a link of the striped trees.
 
         :type server_address: tuple
         :type set_register_connection: bool
+        :type set_stripe_connection: bool
 
         :return:
         """
         try:
-            node = Node(server_address, set_register_connection)
-            if set_register_connection:
-                self.register_nodes[server_address] = node
-            else:
-                self.nodes[server_address] = node
+            node = self._new_node(server_address, set_register_connection, set_stripe_connection)
+            self._get_nodes(set_register_connection, set_stripe_connection)[node.get_server_address()] = node
         except:
             logging.warning('node did not added')
 
+    def _get_nodes(self, is_register=False, is_stripe=False):
+        """
+
+        :return: Our nodes of the kind, {address: node}.
+        :rtype: dict
+        """
+        if is_stripe:
+            return self.stripe_nodes
+        return self.register_nodes if is_register else self.nodes
+
+    def _new_node(self, server_address, set_register_connection, set_stripe_connection=False):
+        """
+        Make the Node of a peer; Register and stripe nodes are lazy.
+
+        :return: The new node.
+        :rtype: Node
+        """
+        socket_options = self.socket_options
+        unix_path = self.get_unix_path(server_address)
+        if unix_path is not None:
+            socket_options = dict(socket_options, unix_path=unix_path)
+        return Node(server_address, set_register_connection, lazy=set_register_connection or set_stripe_connection,
+                    socket_options=socket_options, clock=self.clock, set_stripe=set_stripe_connection)
+
     def remove_node(self, node):
         """
         Remove the node from our Stream.
@@ -103,43 +241,38 @@ class Stream:
         """
         node.close()
         server_address = node.get_server_address()
+        self._connected_register_nodes.pop(server_address, None)
         # remove the node from nodes dict
-        if node.is_register:
-            t = self.register_nodes.pop(server_address, None)
-        else:
-            t = self.nodes.pop(server_address, None)
-        if t is None:
+        if self._get_nodes(node.is_register, node.is_stripe).pop(server_address, None) is None:
             logging.warning(
                 'wants to remove a non-existing node in the stream, address: ' + str(self.get_server_address()))
 
-    def get_node_by_server(self, ip, port, is_register=False):
+    def get_node_by_server(self, ip, port, is_register=False, is_stripe=False):
         """
 
         Will find the node that has IP/Port address of input.
 
         Warnings:
-            1. Before comparing the address parse it to a standard format with Node.parse_### functions.
+            1. Before comparing the address parse it to a standard format with PeerAddress.from_text.
 
         :param ip: input address IP
         :param port: input address Port
         :param is_register: if the node is register node
+        :param is_stripe: if the node is a link of the striped trees
 
         :return: The node that input address.
         :rtype: Node
 
         """
 
-        node_address = (Node.parse_ip(ip), Node.parse_port(port))
-        if is_register:
-            node = self.register_nodes.get(node_address)
-        else:
-            node = self.nodes.get(node_address)
+        node_address = PeerAddress.from_text(ip, port)
+        node = self._get_nodes(is_register, is_stripe).get(node_address)
         # if node is None:
         #     logging.warning(
         #         'node does not exit, node: ' + str(node_address) + ' stream address: ' + str(self.get_server_address()))
         return node
 
-    def add_message_to_out_buff(self, address, message, is_register=False):
+    def add_message_to_out_buff(self, address, message, is_register=False, is_stripe=False):
         """
         In this function, we will add the message to the output buffer of the node that has the input address.
         Later we should use send_out_buf_messages to send these buffers into their sockets.
@@ -147,19 +280,20 @@ class Stream:
         :param address: Node address that we want to send the message
         :param message: Message we want to send
         :param is_register: If the node is register
+        :param is_stripe: If the node is a link of the striped trees
 
         Warnings:
             1. Check whether the node address is in our nodes or not.
 
         :return:
         """
-        if is_register:
-            node = self.register_nodes.get(address)
-        else:
-            node = self.nodes.get(address)
+        node = self._get_nodes(is_register, is_stripe).get(address)
         if node is None:
             logging.warning(
                 "There is no node with this address: " + str(address) + " in Stream: " + str(self.get_server_address()))
+        elif self.is_control is not None and self.is_control(message):
+            node.add_message_to_out_buff(message, control=True)
+            self._control_nodes.append(node)
         else:
             node.add_message_to_out_buff(message)
 
@@ -172,7 +306,18 @@ class Stream:
         """
         return self._server_in_buf
 
-    def _send_messages_to_node(self, node):
+    def take_in_buf(self):
+        """
+        Returns the input buffer of our TCPServer and starts a new one, so the data which arrives while we are
+        handling the buffer is kept for the next cycle.
+
+        :return: TCPServer input buffer.
+        :rtype: list
+        """
+        in_buf, self._server_in_buf = self._server_in_buf, []
+        return in_buf
+
+    def _send_messages_to_node(self, node, send=None):
         """
         Send buffered messages to the 'node'
 
@@ -181,33 +326,272 @@ class Stream:
             you need to remove this node from stream nodes.
 
         :param node:
+        :param send: The send method of the node; By default all of the messages are sent.
         :type node Node
 
-        :return:
+        :return: Whether the node is still in our Stream.
+        :rtype: bool
         """
         # TODO Im not sure of this
         try:
-            node.send_message()
+            (send or node.send_message)()
         except:
             logging.warning('Node could not send message to dest peer. Maybe the dest peer is turned off')
-            if node.is_register:
-                self.register_nodes.pop(node.get_server_address(), None)
-            else:
-                self.nodes.pop(node.get_server_address(), None)
+            self._link_down(node)
+            return False
+        if node.is_register and node.is_connected():
+            self._connected_register_nodes[node.get_server_address()] = node
+            self._connected_register_nodes.move_to_end(node.get_server_address())
+        return True
+
+    def _link_down(self, node):
+        """
+        Remove the node whose link is down and tell the link_down_callback; Its buffered messages are discarded.
+
+        :param node: The node.
+        :type node: Node
+
+        :return:
+        """
+        if not self._has_node(node):
+            return
+        node.close()
+        server_address = node.get_server_address()
+        self._get_nodes(node.is_register, node.is_stripe).pop(server_address, None)
+        if node.is_register:
+            self._connected_register_nodes.pop(server_address, None)
+        if self.link_down_callback is not None and not node.is_stripe:
+            self.link_down_callback(server_address, node.is_register)
+
+    def check_links(self):
+        """
+        Remove the nodes whose peer has closed our connection (or the kernel has broken it, see socket_options) and
+        put a probe in the control buffer of the idle nodes; The probe is sent with the other messages.
+
+        Register and stripe nodes are not checked, they are not the links of the tree.
+
+        :return:
+        """
+        t = self.clock()
+        for node in list(self.nodes.values()):
+            if not node.is_alive():
+                logging.warning('link down, the connection is closed: ' + str(node.get_server_address()))
+                self._link_down(node)
+            elif self.probe is not None and not node.has_messages() and \
+                    t - node.last_send_time >= self.probe_interval:
+                node.add_message_to_out_buff(self.probe, control=True)
+                self._control_nodes.append(node)
+
+    def _has_node(self, node):
+        return self._get_nodes(node.is_register, node.is_stripe).get(node.get_server_address()) is node
+
+    def _send_control_messages(self, only_register=False):
+        """
+        Send the control messages of every node.
+
+        :param only_register: Only send the messages of the register nodes; The other nodes keep them.
+
+        :return:
+        """
+        for _ in range(len(self._control_nodes)):
+            node = self._control_nodes.popleft()
+            if only_register and not node.is_register:
+                self._control_nodes.append(node)
+            elif len(node.control_buff) > 0 and self._has_node(node):
+                self._send_messages_to_node(node, node.send_control_messages)
+
+    def close_idle_register_connections(self):
+        """
+        Close the register connections which are idle or are more than max_register_connections.
+        The register nodes remain in our Stream and will connect again when they have a new message.
+
+        :return:
+        """
+        t = self.clock()
+        while len(self._connected_register_nodes) > 0:
+            address, node = next(iter(self._connected_register_nodes.items()))
+            if len(self._connected_register_nodes) <= self.max_register_connections and \
+                    t - node.last_send_time < self.register_idle_timeout:
+                break
+            self._connected_register_nodes.popitem(last=False)
+            node.close()
 
     def send_out_buf_messages(self, only_register=False):
         """
         In this function, we will send whole out buffers to their own clients.
 
+        The nodes take turns, one message each, and the control messages of every node are sent before each of
+        these messages; So a control message waits for at most one message, even when a node has a bulk of data to
+        send.
+
         :return:
         """
-        register_nodes = self.register_nodes.copy().values()
-        nodes = self.nodes.copy().values()
-        if only_register:
-            for node in register_nodes:
-                self._send_messages_to_node(node)
-        else:
+        if not only_register:
+            self.check_links()
+        nodes = [node for node in self.register_nodes.copy().values() if node.has_messages()]
+        if not only_register:
+            nodes = [node for nodes in (self.nodes, self.stripe_nodes) for node in nodes.copy().values()
+                     if node.has_messages()] + nodes
+        while len(nodes) > 0:
             for node in nodes:
-                self._send_messages_to_node(node)
-            for node in register_nodes:
-                self._send_messages_to_node(node)
+                self._send_control_messages(only_register)
+                if self._has_node(node):
+                    self._send_messages_to_node(node, node.send_next_message)
+            nodes = [node for node in nodes if node.has_messages() and self._has_node(node)]
+        self._send_control_messages(only_register)
+        self.close_idle_register_connections()
+
+
+class TestStream(unittest.TestCase):
+
+    class LocalStream(Stream):
+        # without the TCPServer thread; The tests connect the nodes to their own sockets
+        def _start_server(self, callback):
+            pass
+
+    class RecordingClient:
+        def __init__(self):
+            self.sent = []
+
+        def send(self, data):
+            self.sent.append(data)
+            return b'ACK'
+
+        def peer_closed(self):
+            return False
+
+        def close(self):
+            pass
+
+    def test_control_before_data(self):
+        node = Node(('127.0.0.1', 5000), lazy=True)
+        node.client = client = self.RecordingClient()
+        node.add_message_to_out_buff(b'data 1')
+        node.add_message_to_out_buff(b'data 2')
+        self.assertTrue(node.send_next_message())
+        node.add_message_to_out_buff(b'control', control=True)
+        node.send_message()
+        self.assertEqual(client.sent, [b'data 1', b'control', b'data 2'])
+
+        stream = self.LocalStream('127.0.0.1', 5001, is_control=lambda message: message.startswith(b'control'))
+        address = PeerAddress.from_text('127.0.0.1', 5002)
+        stream.nodes[address] = node = Node(address, lazy=True)
+        node.client = client = self.RecordingClient()
+        for message in (b'data 1', b'data 2', b'control 1', b'data 3', b'control 2'):
+            stream.add_message_to_out_buff(address, message)
+        stream.send_out_buf_messages()
+        self.assertEqual(client.sent, [b'control 1', b'control 2', b'data 1', b'data 2', b'data 3'])
+
+    def test_link_down_and_probe(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        t = [0]
+        link_downs = []
+        stream = self.LocalStream('127.0.0.1', 5001, probe=b'probe', probe_interval=4,
+                                  link_down_callback=lambda *args: link_downs.append(args), clock=lambda: t[0])
+        address = PeerAddress.from_text(*listener.getsockname())
+        stream.add_node(address)
+        connection, _ = listener.accept()
+        node = stream.nodes[address]
+
+        t[0] = 3
+        stream.check_links()
+        self.assertEqual(len(node.control_buff), 0)
+        # the link is idle for probe_interval seconds
+        t[0] = 4
+        stream.check_links()
+        stream.check_links()
+        self.assertEqual(list(node.control_buff), [b'probe'])
+        self.assertFalse(node.client.peer_closed())
+
+        connection.close()
+        self.assertTrue(node.client.peer_closed())
+        stream.check_links()
+        stream.check_links()
+        self.assertNotIn(address, stream.nodes)
+        self.assertEqual(link_downs, [(address, False)])
+        listener.close()
+
+    def test_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        ports = []
+        for _ in range(2):
+            with socket.socket() as sock:
+                sock.bind(('127.0.0.1', 0))
+                ports.append(sock.getsockname()[1])
+        receiver = Stream('127.0.0.1', ports[0], unix_directory=directory)
+        self.addCleanup(receiver.close)
+        sender = Stream('127.0.0.1', ports[1], unix_directory=directory)
+        self.addCleanup(sender.close)
+        path = receiver.get_unix_path(receiver.get_server_address())
+        self.assertTrue(os.path.exists(path))
+        sender.add_node(receiver.get_server_address())
+        node = sender.nodes[receiver.get_server_address()]
+        self.assertTrue(node.client.is_unix)
+        node.add_message_to_out_buff(b'hello')
+        node.send_message()
+        self.assertEqual([bytes(data) for data in receiver.take_in_buf()], [b'hello'])
+        receiver.close()
+        sender.close()
+        self.assertFalse(os.path.exists(path))
+
+        # other users can write to it
+        os.chmod(directory, 0o777)
+        self.assertIsNone(self.LocalStream('127.0.0.1', ports[0], unix_directory=directory).unix_directory)
+        os.rmdir(directory)
+
+    def test_lazy_register_nodes(self):
+        receivers = []
+        for _ in range(2):
+            with socket.socket() as sock:
+                sock.bind(('127.0.0.1', 0))
+                port = sock.getsockname()[1]
+            receivers.append(Stream('127.0.0.1', port))
+            self.addCleanup(receivers[-1].close)
+        t = [0]
+        stream = self.LocalStream('127.0.0.1', 5001, register_idle_timeout=10, max_register_connections=1,
+                                  clock=lambda: t[0])
+        first, second = [receiver.get_server_address() for receiver in receivers]
+        stream.add_node(first, set_register_connection=True)
+        node = stream.register_nodes[first]
+        # the connection is made on the first message
+        self.assertFalse(node.is_connected())
+        stream.add_message_to_out_buff(first, b'register 1', is_register=True)
+        stream.send_out_buf_messages(only_register=True)
+        self.assertTrue(node.is_connected())
+
+        # the least recently used connection is closed for the new one, the node stays
+        stream.add_node(second, set_register_connection=True)
+        stream.add_message_to_out_buff(second, b'register 2', is_register=True)
+        stream.send_out_buf_messages(only_register=True)
+        self.assertFalse(node.is_connected())
+        self.assertTrue(stream.register_nodes[second].is_connected())
+        # the idle connection is closed
+        t[0] = 10
+        stream.close_idle_register_connections()
+        self.assertFalse(stream.register_nodes[second].is_connected())
+
+        # the node connects again on the next Register
+        stream.add_message_to_out_buff(first, b'register 3', is_register=True)
+        stream.send_out_buf_messages(only_register=True)
+        self.assertIs(stream.register_nodes[first], node)
+        self.assertTrue(node.is_connected())
+        self.assertEqual([bytes(data) for data in receivers[0].take_in_buf()], [b'register 1', b'register 3'])
+        self.assertEqual([bytes(data) for data in receivers[1].take_in_buf()], [b'register 2'])
+        stream.close()
+
+    def test_split_packet(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        receiver = Stream('127.0.0.1', port, frame_length=PacketFactory.frame_length)
+        self.addCleanup(receiver.close)
+        buf = PacketFactory.new_message_packet('x' * 3000, ('127.000.000.001', '05000')).get_buf()
+        with socket.create_connection(('127.0.0.1', port)) as sender:
+            # the packet arrives in two reads
+            sender.sendall(buf[:1000])
+            time.sleep(0.1)
+            sender.sendall(buf[1000:])
+            self.assertEqual(sender.recv(3), b'ACK')
+        self.assertEqual([bytes(data) for data in receiver.take_in_buf()], [buf])
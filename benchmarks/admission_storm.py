@@ -0,0 +1,126 @@
+"""
+    Synthetic Register/Advertise storm on the root.
+
+    The root already has 'existing' live peers which send a Reunion Hello every 4 seconds; then 'storm' new peers send
+    their Advertise Requests in the same cycle (e.g. after a large partition heals).
+    The 'sequential' mode is the old root: every packet is handled in arrival order and every Advertise Request runs
+    its own BFS. The 'admission' mode handles the Reunion packets first and admits the Advertise Requests with
+    AdmissionQueue, placing each cycle's batch with NetworkGraph.place_nodes.
+
+    Latencies are measured from the start of the root cycle in which the packet has arrived (a cycle is 2 seconds of
+    sleep plus the handling time).
+
+    Usage:
+        python -m benchmarks.admission_storm --existing 2000 --storm 2000
+"""
+import argparse
+import time
+
+from tools.AdmissionQueue import AdmissionQueue
+from tools.NetworkGraph import NetworkGraph
+
+CYCLE = 2
+ROOT_ADDRESS = ('127.000.000.001', '05000')
+
+
+class StormPacket:
+    def __init__(self, kind, address, arrival_cycle):
+        self.kind = kind
+        self.address = address
+        self.arrival_cycle = arrival_cycle
+
+    def get_source_server_address(self):
+        return self.address
+
+
+def peer_address(i):
+    return '10.%03d.%03d.%03d' % (i // 65536 % 256, i // 256 % 256, i % 256), '05000'
+
+
+def build_graph(existing):
+    graph = NetworkGraph(ROOT_ADDRESS)
+    graph.place_nodes([peer_address(i) for i in range(existing)])
+    return graph
+
+
+def arrivals(cycle, existing, storm):
+    """
+
+    :return: Packets which arrive in this cycle, the storm arrives in cycle 0 before the Reunion Hello packets.
+    """
+    packets = []
+    if cycle == 0:
+        packets += [StormPacket('advertise', peer_address(existing + i), 0) for i in range(storm)]
+    # every existing peer sends a Reunion Hello every two cycles
+    packets += [StormPacket('reunion', peer_address(i), cycle) for i in range(cycle % 2, existing, 2)]
+    return packets
+
+
+def handle_reunion(graph, hello_times, packet):
+    hello_times[packet.address] = time.time()
+    graph.turn_on_node(packet.address)
+
+
+def run(mode, existing, storm, rate):
+    graph = build_graph(existing)
+    hello_times = {}
+    cycle = 0
+    # the token bucket sees one cycle of time passing in every cycle
+    queue = AdmissionQueue(rate=rate, burst=rate * CYCLE, max_size=storm + existing, clock=lambda: cycle * CYCLE)
+    advertise_latency = []
+    reunion_latency = []
+    placement_time = 0
+    while cycle == 0 or len(queue) > 0:
+        cycle_start = time.perf_counter()
+        for packet in arrivals(cycle, existing, storm):
+            if packet.kind == 'reunion':
+                handle_reunion(graph, hello_times, packet)
+                reunion_latency.append(time.perf_counter() - cycle_start)
+            elif mode == 'sequential':
+                t = time.perf_counter()
+                neighbour = graph.find_live_node(packet.address)
+                graph.add_node(packet.address[0], packet.address[1], neighbour.address)
+                placement_time += time.perf_counter() - t
+                advertise_latency.append(time.perf_counter() - cycle_start)
+            else:
+                queue.put(packet)
+        if mode == 'admission':
+            admitted = queue.take()
+            t = time.perf_counter()
+            graph.place_nodes([packet.address for packet in admitted])
+            placement_time += time.perf_counter() - t
+            done = time.perf_counter() - cycle_start
+            advertise_latency += [(cycle - packet.arrival_cycle) * CYCLE + done for packet in admitted]
+        cycle += 1
+    return {
+        'placements/s': storm / placement_time,
+        'advertise p50': percentile(advertise_latency, 50),
+        'advertise p99': percentile(advertise_latency, 99),
+        'reunion p50': percentile(reunion_latency, 50),
+        'reunion p99': percentile(reunion_latency, 99),
+        'reunion max': max(reunion_latency),
+    }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--existing', type=int, default=2000)
+    parser.add_argument('--storm', type=int, default=2000)
+    parser.add_argument('--rate', type=int, default=500, help='admitted requests per second')
+    args = parser.parse_args()
+
+    columns = ['placements/s', 'advertise p50', 'advertise p99', 'reunion p50', 'reunion p99', 'reunion max']
+    print('%-12s' % 'mode' + ''.join('%15s' % column for column in columns))
+    for mode in ('sequential', 'admission'):
+        result = run(mode, args.existing, args.storm, args.rate)
+        print('%-12s' % mode + '%15.0f' % result[columns[0]] + ''.join('%14.4fs' % result[column]
+                                                                       for column in columns[1:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+    A local cluster of real peer processes on loopback, driven end to end, with a JSON report.
+
+    Starts a root and 'peers' client processes on free ports which the system chooses, sends every client its
+    Register and then its Advertise command (one client at a time, each waits for the Advertise Response of the
+    previous one, so the tree is filled level by level) and lets the network settle. Then 'broadcasts' random clients
+    broadcast a message one after another, 'kills' random clients (never the root) are killed and a survivor
+    broadcasts a probe every 2 seconds until a probe reaches all of the other survivors.
+
+    The report shows:
+        join:       seconds from the Register command to the Register Response and from the Advertise command to the
+                    Advertise Response of every client.
+        broadcast:  seconds until the first and the last of the other clients received each message.
+        kill:       seconds from the kills until a probe reached all of the survivors, and the probes it took.
+        processes:  CPU seconds, mean CPU load and peak RSS of every process (read from /proc, so on Linux only).
+
+    The same numbers and the configuration are written to the 'report' JSON file, for comparing runs.
+
+    Usage:
+        python -m benchmarks.cluster --peers 8 --broadcasts 3 --kills 1 --report cluster.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+
+from benchmarks.standby_failover import PeerProcess, REPOSITORY
+
+
+def free_ports(count):
+    """
+    Ports which are free on loopback now; The sockets are held until all of the ports are chosen, so they differ.
+
+    :return: The ports.
+    :rtype: list
+    """
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+def process_usage(process, started):
+    """
+
+    :return: CPU seconds, mean CPU load (1.0 is one core) and peak RSS in KB of the process, or None if /proc does not
+             have them.
+    :rtype: dict
+    """
+    try:
+        with open('/proc/%d/stat' % process.pid) as stat:
+            # the fields after the name, which may contain spaces
+            fields = stat.read().rsplit(')', 1)[1].split()
+        with open('/proc/%d/status' % process.pid) as status:
+            peak_rss = next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+    except (OSError, StopIteration):
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return {'cpu_seconds': cpu, 'cpu_load': cpu / (time.time() - started), 'peak_rss_kb': peak_rss}
+
+
+def wait_for_log(process, text, after, timeout):
+    """
+
+    :return: Time of the first log line of the process after 'after' which contains 'text', or None after 'timeout'
+             seconds.
+    """
+    while True:
+        times = [t for t in process.log_times(text) if t >= after]
+        if times:
+            return times[0]
+        if time.time() - after > timeout:
+            return None
+        time.sleep(0.1)
+
+
+def wait_for_message(clients, text, after, timeout):
+    """
+
+    :return: The times when each of the clients received the message 'text', None for the clients which had not
+             received it after 'timeout' seconds.
+    :rtype: list
+    """
+    line = 'message %s received' % text
+    while True:
+        times = [min([t for t in client.log_times(line) if t >= after], default=None) for client in clients]
+        if None not in times or time.time() - after > timeout:
+            return times
+        time.sleep(0.2)
+
+
+def summary(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {'median': statistics.median(values), 'p90': values[int(0.9 * (len(values) - 1))], 'max': values[-1],
+            'count': len(values)}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPOSITORY, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=8)
+    parser.add_argument('--broadcasts', type=int, default=3)
+    parser.add_argument('--kills', type=int, default=1)
+    parser.add_argument('--settle', type=float, default=5, help='seconds to wait after the joins')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for a response or a message')
+    parser.add_argument('--seed', type=int, default=0, help='chooses the broadcasting and the killed clients')
+    parser.add_argument('--report', help='path of the JSON report')
+    args = parser.parse_args()
+    if not 0 <= args.kills < args.peers:
+        parser.error('kills should be less than peers')
+
+    rng = random.Random(args.seed)
+    log_dir = tempfile.mkdtemp(prefix='cluster_')
+    root_port, *client_ports = free_ports(args.peers + 1)
+    root_address = ('127.0.0.1', root_port)
+    report = {'config': dict(vars(args), python=platform.python_version(), revision=git_revision(),
+                             log_dir=log_dir, root_port=root_port)}
+    processes = []
+    started = {}
+    usage = {}
+    try:
+        root = PeerProcess(log_dir, root_port, is_root=True)
+        processes.append(root)
+        started[root] = time.time()
+        time.sleep(1)
+        clients = []
+        for port in client_ports:
+            client = PeerProcess(log_dir, port, root_address=root_address)
+            clients.append(client)
+            started[client] = time.time()
+        processes += clients
+        time.sleep(1)
+
+        joins = {}
+        for client in clients:
+            t = time.time()
+            client.command('Register')
+            response = wait_for_log(client, 'Register response received', t, args.timeout)
+            joins[client.port] = {'register': None if response is None else response - t}
+        for client in clients:
+            t = time.time()
+            client.command('Advertise')
+            response = wait_for_log(client, 'advertise response received', t, args.timeout)
+            joins[client.port]['advertise'] = None if response is None else response - t
+        report['join'] = {'peers': joins,
+                          'register': summary(join['register'] for join in joins.values()),
+                          'advertise': summary(join['advertise'] for join in joins.values())}
+        time.sleep(args.settle)
+
+        broadcasts = []
+        for k in range(args.broadcasts):
+            sender = rng.choice(clients)
+            others = [client for client in clients if client is not sender]
+            t = time.time()
+            sender.command('SendMessage broadcast%d' % k)
+            times = wait_for_message(others, 'broadcast%d' % k, t, args.timeout)
+            received = [x - t for x in times if x is not None]
+            broadcasts.append({'sender': sender.port, 'received': len(received), 'of': len(others),
+                               'first': min(received, default=None),
+                               'completed': max(received) if len(received) == len(others) else None})
+        report['broadcast'] = broadcasts
+
+        if args.kills > 0:
+            victims = rng.sample(clients, args.kills)
+            for victim in victims:
+                usage[victim.port] = process_usage(victim.process, started[victim])
+                victim.kill()
+            kill_time = time.time()
+            survivors = [client for client in clients if client not in victims]
+            sender = survivors[-1]
+            recovered = None
+            probe = 0
+            while recovered is None and time.time() - kill_time < args.timeout:
+                sender.command('SendMessage probe%d' % probe)
+                probe += 1
+                time.sleep(2)
+                for k in range(probe):
+                    times = wait_for_message(survivors[:-1], 'probe%d' % k, kill_time, 0)
+                    if None not in times:
+                        recovered = max(times, default=kill_time) - kill_time
+                        break
+            report['kill'] = {'killed': [victim.port for victim in victims], 'recovered': recovered,
+                              'probes': probe}
+
+        for process in processes:
+            if process.port not in usage:
+                usage[process.port] = process_usage(process.process, started[process])
+        report['processes'] = {str(port): dict(usage[port] or {}, role='root' if port == root_port else 'client')
+                               for port in sorted(usage)}
+    finally:
+        for process in processes:
+            process.kill()
+
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def print_report(report):
+    def seconds(value):
+        return '-' if value is None else '%.2fs' % value
+
+    print('logs: %s' % report['config']['log_dir'])
+    for name in ('register', 'advertise'):
+        stats = report['join'][name] or {}
+        print('%10s  median %8s  p90 %8s  max %8s  answered %s of %d' % (
+            name, seconds(stats.get('median')), seconds(stats.get('p90')), seconds(stats.get('max')),
+            stats.get('count', 0), len(report['join']['peers'])))
+    for k, broadcast in enumerate(report['broadcast']):
+        print('%10s  from %d  first %8s  all %8s  received by %d of %d' % (
+            'broadcast%d' % k, broadcast['sender'], seconds(broadcast['first']), seconds(broadcast['completed']),
+            broadcast['received'], broadcast['of']))
+    if 'kill' in report:
+        print('%10s  %s  recovered after %s (%d probes)' % (
+            'kill', ', '.join(map(str, report['kill']['killed'])), seconds(report['kill']['recovered']),
+            report['kill']['probes']))
+    print('%10s %8s %12s %10s %14s' % ('process', 'role', 'CPU seconds', 'CPU load', 'peak RSS MB'))
+    for port, process in report['processes'].items():
+        if 'cpu_seconds' in process:
+            print('%10s %8s %12.2f %10.3f %14.1f' % (port, process['role'], process['cpu_seconds'],
+                                                     process['cpu_load'], process['peak_rss_kb'] / 1024))
+        else:
+            print('%10s %8s %12s %10s %14s' % (port, process['role'], '-', '-', '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+    Reunion Hello round trip time while a link is saturated with broadcast data.
+
+    Two Streams on loopback play a parent and its child. The child's main loop keeps 'burst' Fragment packets queued
+    for the parent and flushes them without sleeping, like a peer which forwards a large message. Every 'interval'
+    seconds the child queues a Reunion Hello from another thread (like the reunion daemon) and the parent answers it
+    with a Hello Back as soon as its loop sees it; the time from queueing the Hello to receiving the Hello Back is
+    the round trip time.
+
+    The report shows the data throughput and the median, 99th percentile and maximum round trip time, with the
+    control packets sent first (priority) and with one queue for all of the packets (fifo).
+
+    Usage:
+        python -m benchmarks.control_priority --duration 10 --burst 2000
+"""
+import argparse
+import logging
+import os
+import statistics
+import threading
+import time
+
+from Packet import PacketFactory
+from Stream import Stream
+
+
+def run(args, port, is_control):
+    """
+
+    :return: Data bytes per second and the round trip times.
+    """
+    child = Stream('127.0.0.1', port, is_control=is_control)
+    parent = Stream('127.0.0.1', port + 1, is_control=is_control)
+    child_address, parent_address = child.get_server_address(), parent.get_server_address()
+    time.sleep(0.2)
+    child.add_node(parent_address)
+    parent.add_node(child_address)
+
+    fragment = PacketFactory.new_fragment_packet(child_address, 1, 1 << 30, 0,
+                                                 bytes(PacketFactory.fragment_size)).get_buf()
+    hello = PacketFactory.new_reunion_packet('REQ', child_address, [child_address]).get_buf()
+    hello_back = PacketFactory.new_reunion_packet('RES', parent_address, [child_address]).get_buf()
+    stop = time.time() + args.duration
+    sent = [0]
+    rtts = []
+
+    def child_loop():
+        node = child.nodes[parent_address]
+        while time.time() < stop:
+            while len(node.out_buff) < args.burst:
+                node.add_message_to_out_buff(fragment)
+                sent[0] += 1
+            child.send_out_buf_messages()
+
+    def parent_loop():
+        while time.time() < stop:
+            for buf in parent.take_in_buf():
+                if PacketFactory.is_control_buffer(buf):
+                    parent.add_message_to_out_buff(child_address, hello_back)
+            parent.send_out_buf_messages()
+            time.sleep(0.001)
+
+    def reunion_daemon():
+        while time.time() + args.interval < stop:
+            t = time.time()
+            child.add_message_to_out_buff(parent_address, hello)
+            while time.time() < stop:
+                if any(PacketFactory.is_control_buffer(buf) for buf in child.take_in_buf()):
+                    rtts.append(time.time() - t)
+                    break
+                time.sleep(0.001)
+            time.sleep(max(0.0, args.interval - (time.time() - t)))
+
+    threads = [threading.Thread(target=target) for target in (child_loop, parent_loop, reunion_daemon)]
+    t = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    queued = len(child.nodes[parent_address].out_buff)
+    return (sent[0] - queued) * len(fragment) / (time.time() - t), rtts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--burst', type=int, default=2000, help='data packets which are kept in the queue')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between the hellos')
+    parser.add_argument('--base-port', type=int, default=25000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print('%10s %12s %8s %12s %12s %12s' % ('queue', 'data MB/s', 'hellos', 'median ms', 'p99 ms', 'max ms'))
+    for i, (name, is_control) in enumerate((('fifo', None), ('priority', PacketFactory.is_control_buffer))):
+        throughput, rtts = run(args, args.base_port + 2 * i, is_control)
+        rtts = sorted(rtts) or [float('nan')]
+        print('%10s %12.1f %8d %12.1f %12.1f %12.1f' % (
+            name, throughput / 1e6, len(rtts), 1000 * statistics.median(rtts),
+            1000 * rtts[min(len(rtts) - 1, int(0.99 * len(rtts)))], 1000 * rtts[-1]))
+    # the TCPServer threads never stop
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
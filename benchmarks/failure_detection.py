@@ -0,0 +1,96 @@
+"""
+    Time until the neighbours of a failed peer find out that it is gone.
+
+    Starts a root and 'peers' client processes on loopback, registers and advertises all clients (the tree is filled
+    level by level) and lets the network idle. Then the first client (a child of the root) is killed, so its
+    connections are closed, and after 'settle' seconds the second client is stopped with SIGSTOP, like a hung host:
+    its connections stay open and the kernel still acknowledges the packets, but nothing answers them.
+
+    The report shows, for the parent and the children of each failed peer, the seconds until it noticed the failure
+    (a link down or, without link_timeout, the reunion timeouts) and until each child went to a new parent (it joined
+    its backup parent or the root answered its new Advertise Request). Run it with --link-timeout 0 to see the same without the transport-level liveness.
+
+    Usage:
+        python -m benchmarks.failure_detection --peers 6 --link-timeout 8
+"""
+import argparse
+import datetime
+import signal
+import tempfile
+import time
+
+from benchmarks.standby_failover import PeerProcess
+
+
+def first_after(process, texts, t, port=None):
+    """
+
+    :return: Seconds from 't' to the first log line of the process which contains one of 'texts' (and the port).
+    """
+    times = []
+    with open(process.log_path) as log:
+        for line in log:
+            if any(text in line for text in texts) and (port is None or '%05d' % port in line):
+                times.append(datetime.datetime.strptime(line[:23], '%Y-%m-%d %H:%M:%S,%f').timestamp())
+    times = [x for x in times if x >= t]
+    return '%.1fs' % (min(times) - t) if times else '-'
+
+
+def report(name, victim, parent, children, t):
+    print('%10s %8s %14s' % (name, 'parent', first_after(parent, ('link down to our child', 'reunion failed from'), t,
+                                                          victim.port)))
+    for child in children:
+        print('%10s %8d %14s %14s' % (
+            name, child.port, first_after(child, ('link down to our parent', 'reunion back failed'), t),
+            first_after(child, ('joining the backup parent', 'advertise response received'), t)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=6)
+    parser.add_argument('--base-port', type=int, default=27000)
+    parser.add_argument('--link-timeout', type=float, default=8, help='0 turns the transport-level liveness off')
+    parser.add_argument('--settle', type=float, default=60, help='seconds to wait after each failure')
+    args = parser.parse_args()
+
+    link_timeout = args.link_timeout or None
+    log_dir = tempfile.mkdtemp(prefix='failure_detection_')
+    root_address = ('127.0.0.1', args.base_port)
+    processes = []
+    try:
+        root = PeerProcess(log_dir, args.base_port, is_root=True, link_timeout=link_timeout)
+        processes.append(root)
+        time.sleep(1)
+        clients = [PeerProcess(log_dir, args.base_port + 10 + i, root_address=root_address,
+                               link_timeout=link_timeout) for i in range(args.peers)]
+        processes += clients
+        time.sleep(1)
+        for client in clients:
+            client.command('Register')
+            time.sleep(0.2)
+        time.sleep(3)
+        # one by one, so the tree is filled level by level
+        for client in clients:
+            client.command('Advertise')
+            time.sleep(2)
+        time.sleep(10)
+
+        # the children of the first two clients are the next four clients
+        clients[0].kill()
+        kill_time = time.time()
+        time.sleep(args.settle)
+        clients[1].process.send_signal(signal.SIGSTOP)
+        stop_time = time.time()
+        time.sleep(args.settle)
+
+        print('logs: %s' % log_dir)
+        print('%10s %8s %14s %14s' % ('failure', 'peer', 'detected', 'new parent'))
+        report('kill', clients[0], root, clients[2:4], kill_time)
+        report('stop', clients[1], root, clients[4:6], stop_time)
+    finally:
+        for process in processes:
+            process.kill()
+
+
+if __name__ == '__main__':
+    main()
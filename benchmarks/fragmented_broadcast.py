@@ -0,0 +1,114 @@
+"""
+    End-to-end throughput of a large broadcast message in Fragment packets.
+
+    Starts a root and 'peers' client processes on loopback; The clients advertise one by one, so the tree is filled
+    level by level (8 clients make a tree of 4 levels with the root). The deepest client broadcasts a file of 'size'
+    MB with the SendFile command and every other peer saves it in its message directory.
+
+    The report shows when the last peer had the whole message, the throughput, whether every copy is correct and
+    the peak memory (VmHWM) of the peers; The peak memory should not grow with the message size. With --stripes the
+    root keeps that many striped trees and the fragments are sent round-robin on them.
+
+    Usage:
+        python -m benchmarks.fragmented_broadcast --peers 8 --size 100
+        python -m benchmarks.fragmented_broadcast --peers 8 --size 100 --stripes 4
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from benchmarks.standby_failover import PeerProcess
+
+
+def peak_memory(process):
+    """
+
+    :return: Peak resident memory of the process in MB.
+    """
+    with open('/proc/%d/status' % process.process.pid) as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as content:
+        for block in iter(lambda: content.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=8)
+    parser.add_argument('--size', type=float, default=100, help='message size in MB')
+    parser.add_argument('--base-port', type=int, default=24000)
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--stripes', type=int, default=1)
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix='fragmented_broadcast_')
+    root_address = ('127.0.0.1', args.base_port)
+    processes = []
+    try:
+        root = PeerProcess(log_dir, args.base_port, is_root=True, stripes=args.stripes,
+                           message_directory=os.path.join(log_dir, str(args.base_port)))
+        processes.append(root)
+        time.sleep(1)
+        clients = []
+        for i in range(args.peers):
+            port = args.base_port + 10 + i
+            clients.append(PeerProcess(log_dir, port, root_address=root_address,
+                                       message_directory=os.path.join(log_dir, str(port))))
+        processes += clients
+        time.sleep(1)
+        for client in clients:
+            client.command('Register')
+        time.sleep(4)
+        for client in clients:
+            client.command('Advertise')
+            time.sleep(2)
+        time.sleep(4)
+
+        path = os.path.join(log_dir, 'message')
+        with open(path, 'wb') as message:
+            for _ in range(int(args.size)):
+                message.write(os.urandom(1 << 20))
+            message.write(os.urandom(int((args.size % 1) * (1 << 20))))
+        size = os.path.getsize(path)
+
+        origin = clients[-1]
+        receivers = [root] + clients[:-1]
+        start_time = time.time()
+        origin.command('SendFile ' + path)
+        while time.time() - start_time < args.timeout:
+            if all(receiver.log_times('bytes received') for receiver in receivers):
+                break
+            time.sleep(1)
+        times = [receiver.log_times('bytes received') for receiver in receivers]
+
+        print('logs:                  %s' % log_dir)
+        if not all(times):
+            print('message did not reach %d of %d peers' % (sum(1 for t in times if not t), len(receivers)))
+            return
+        elapsed = max(t[0] for t in times) - start_time
+        copies = [os.path.join(log_dir, str(receiver.port), name) for receiver in receivers
+                  for name in os.listdir(os.path.join(log_dir, str(receiver.port)))]
+        correct = sum(1 for copy in copies if digest(copy) == digest(path))
+        print('message size:          %.1f MB' % (size / 1e6))
+        print('last peer received at: %.1fs' % elapsed)
+        print('throughput:            %.2f MB/s' % (size / 1e6 / elapsed))
+        print('correct copies:        %d of %d' % (correct, len(receivers)))
+        print('peak memory (VmHWM):   origin %.0f MB, root %.0f MB, max of all %.0f MB' % (
+            peak_memory(origin), peak_memory(root), max(peak_memory(process) for process in processes)))
+    finally:
+        for process in processes:
+            process.kill()
+
+
+if __name__ == '__main__':
+    main()
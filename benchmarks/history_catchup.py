@@ -0,0 +1,93 @@
+"""
+    Broadcast messages which reach the peers that were cut off from the tree, with the MessageHistory catch-up.
+
+    Starts a root and 'peers' client processes on loopback, registers and advertises all clients (the tree is filled
+    level by level) and then kills the first client, which is a child of the root. The second client (the other
+    child of the root) broadcasts a message every 'interval' seconds for 'gap' seconds while the orphaned sub-tree
+    finds its new parent; After that a new client joins the network late.
+
+    The report shows, for every orphaned client and the late client, how many of the messages sent after the kill
+    it received and when the last of them arrived. Run it with --history-size 0 to see the same without catch-up.
+
+    Usage:
+        python -m benchmarks.history_catchup --peers 6 --history-size 1048576
+"""
+import argparse
+import tempfile
+import time
+
+from benchmarks.standby_failover import PeerProcess
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=6)
+    parser.add_argument('--base-port', type=int, default=24000)
+    parser.add_argument('--history-size', type=int, default=1024 * 1024)
+    parser.add_argument('--gap', type=float, default=20)
+    parser.add_argument('--interval', type=float, default=0.5)
+    parser.add_argument('--settle', type=float, default=30, help='seconds to wait for the catch-up')
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix='history_catchup_')
+    root_address = ('127.0.0.1', args.base_port)
+    processes = []
+    try:
+        root = PeerProcess(log_dir, args.base_port, is_root=True, history_size=args.history_size)
+        processes.append(root)
+        time.sleep(1)
+        clients = []
+        for i in range(args.peers):
+            clients.append(PeerProcess(log_dir, args.base_port + 10 + i, root_address=root_address,
+                                       history_size=args.history_size))
+        processes += clients
+        time.sleep(1)
+        for client in clients:
+            client.command('Register')
+            time.sleep(0.2)
+        time.sleep(3)
+        # one by one, so the tree is filled level by level
+        for client in clients:
+            client.command('Advertise')
+            time.sleep(2)
+        time.sleep(5)
+
+        # the first client is a child of the root; its sub-tree is the children of the second level
+        clients[0].kill()
+        kill_time = time.time()
+        orphans = clients[2:4]
+        sent = 0
+        while time.time() - kill_time < args.gap:
+            clients[1].command('SendMessage gap%03d' % sent)
+            sent += 1
+            time.sleep(args.interval)
+
+        late = PeerProcess(log_dir, args.base_port + 10 + args.peers, root_address=root_address,
+                           history_size=args.history_size)
+        processes.append(late)
+        time.sleep(1)
+        late.command('Register')
+        time.sleep(2)
+        late.command('Advertise')
+        time.sleep(args.settle)
+
+        print('logs: %s' % log_dir)
+        print('messages sent after the kill: %d' % sent)
+        print('%12s %10s %14s' % ('peer', 'received', 'last arrival'))
+        for name, client in [('orphan %d' % client.port, client) for client in orphans] + [('late', late)]:
+            received = set()
+            last = None
+            for i in range(sent):
+                times = client.log_times('message gap%03d received' % i)
+                if times:
+                    received.add(i)
+                    last = max(times) if last is None else max(last, max(times))
+            print('%12s %10s %14s' % (name, '%d/%d' % (len(received), sent),
+                                      '%.1fs' % (last - kill_time) if last is not None else '-'))
+    finally:
+        for process in processes:
+            process.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+    Reunion traffic of an idle network and of a network with broadcast traffic.
+
+    Starts a root and 'peers' client processes on loopback, registers and advertises all clients (the tree is filled
+    level by level) and counts the Reunion packets that every peer receives (Hellos and the relayed Hellos, Hello
+    Backs and Summaries). The network is measured for 'duration' seconds while it is idle and then while every
+    client broadcasts a message every 'interval' seconds; With traffic the parents vouch for their children in
+    Summaries and the active peers do not send Hellos.
+
+    The report shows the Reunion packets per second which the root and all of the peers receive, how many peers the
+    root removed (false failures) and the share of the messages which reached every client.
+
+    Usage:
+        python -m benchmarks.liveness_traffic --peers 14 --duration 60
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the peer logs the number of the Reunion packets that it has received every second
+PEER_CODE = '''import sys, threading, time, logging
+sys.path.insert(0, %r)
+from Peer import Peer
+counts = {}
+handle_packet = Peer.handle_packet
+def counting_handle_packet(self, packet):
+    if packet.get_type() == 5:
+        counts[packet.get_request_type()] = counts.get(packet.get_request_type(), 0) + 1
+    handle_packet(self, packet)
+Peer.handle_packet = counting_handle_packet
+def report():
+    while True:
+        time.sleep(1)
+        logging.warning('reunion packets %%r' %% counts)
+threading.Thread(target=report, daemon=True).start()
+Peer(*%r, **%r).run()
+'''
+
+
+class CountingPeer:
+    def __init__(self, log_dir, port, **kwargs):
+        self.port = port
+        self.log_path = os.path.join(log_dir, '%d.log' % port)
+        code = PEER_CODE % (REPOSITORY, ('127.0.0.1', port), kwargs)
+        self.process = subprocess.Popen([sys.executable, '-u', '-W', 'ignore', '-c', code], stdin=subprocess.PIPE,
+                                        stdout=open(self.log_path, 'w'), stderr=subprocess.STDOUT, text=True)
+
+    def command(self, command):
+        self.process.stdin.write(command + '\n')
+        self.process.stdin.flush()
+
+    def reunion_packets(self):
+        """
+
+        :return: The last counts of the Reunion packets, {request type: count}.
+        """
+        counts = {}
+        with open(self.log_path) as log:
+            for line in log:
+                match = re.search(r'reunion packets (\{.*\})', line)
+                if match:
+                    counts = eval(match.group(1))
+        return counts
+
+    def log_count(self, text):
+        with open(self.log_path) as log:
+            return sum(1 for line in log if text in line)
+
+    def kill(self):
+        self.process.kill()
+
+
+def measure(peers, duration, interval, tick=None):
+    """
+
+    :param tick: Function which is called every 'interval' seconds during the measurement.
+
+    :return: Reunion packets per second of the root and of all of the peers, {request type: rate}.
+    """
+    before = [peer.reunion_packets() for peer in peers]
+    start = time.time()
+    i = 0
+    while time.time() - start < duration:
+        if tick is not None:
+            tick(i)
+        i += 1
+        time.sleep(interval)
+    after = [peer.reunion_packets() for peer in peers]
+    elapsed = time.time() - start
+    rates = []
+    for counts_before, counts_after in zip(before, after):
+        rates.append({key: (value - counts_before.get(key, 0)) / elapsed for key, value in counts_after.items()})
+    total = {}
+    for rate in rates:
+        for key, value in rate.items():
+            total[key] = total.get(key, 0) + value
+    return rates[0], total
+
+
+def format_rates(rates):
+    return ' '.join('%s %.1f' % (key, rates.get(key, 0)) for key in ('REQ', 'RES', 'SUM'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=14)
+    parser.add_argument('--base-port', type=int, default=26000)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--interval', type=float, default=1)
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix='liveness_traffic_')
+    root_address = ('127.0.0.1', args.base_port)
+    processes = []
+    try:
+        root = CountingPeer(log_dir, args.base_port, is_root=True)
+        processes.append(root)
+        time.sleep(1)
+        clients = [CountingPeer(log_dir, args.base_port + 10 + i, root_address=root_address)
+                   for i in range(args.peers)]
+        processes += clients
+        time.sleep(1)
+        for client in clients:
+            client.command('Register')
+            time.sleep(0.2)
+        time.sleep(3)
+        # one by one, so the tree is filled level by level
+        for client in clients:
+            client.command('Advertise')
+            time.sleep(2)
+        time.sleep(10)
+
+        idle_root, idle_total = measure(processes, args.duration, args.interval)
+        sent = []
+
+        def broadcast(i):
+            for client in clients:
+                client.command('SendMessage traffic%d' % i)
+            sent.append(i)
+
+        busy_root, busy_total = measure(processes, args.duration, args.interval, broadcast)
+        # the last messages are still on their way
+        time.sleep(15)
+
+        delivered = sum(client.log_count('message traffic') for client in clients)
+        print('logs: %s' % log_dir)
+        print('%10s %36s %36s' % ('network', 'root receives (packets/s)', 'all peers receive (packets/s)'))
+        print('%10s %36s %36s' % ('idle', format_rates(idle_root), format_rates(idle_total)))
+        print('%10s %36s %36s' % ('traffic', format_rates(busy_root), format_rates(busy_total)))
+        print('peers removed by the root: %d' % root.log_count('reunion failed from'))
+        print('messages delivered:        %.1f%%' % (100 * delivered / max(1, len(sent) * args.peers * (args.peers - 1))))
+    finally:
+        for process in processes:
+            process.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+    Latency and throughput of a link between two peers on the same host, over TCP loopback and a Unix domain socket.
+
+    Two Streams in two processes play the peers; The sender's node is connected to the receiver's TCPServer through
+    TCP loopback, or through the receiver's Unix domain socket when the Streams have a unix_directory. Every packet is
+    sent and its ACK is awaited like Node does, so the latency is the round trip of one packet ('size' bytes) and the
+    throughput is the packets which the receiver has received in 'duration' seconds of sending.
+
+    The report shows the median and 99th percentile latency, the packets per second and the MB/s of each transport.
+
+    Usage:
+        python -m benchmarks.local_transport --size 1024 --duration 5
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from Stream import Stream
+from tools.PeerAddress import PeerAddress
+
+
+def receive(port, unix_directory, connection):
+    """
+    The receiver process; It counts the received bytes and sends the count when the sender asks for it.
+    """
+    logging.disable(logging.WARNING)
+    receiver = Stream('127.0.0.1', port, unix_directory=unix_directory)
+    connection.send(None)
+    received = 0
+    while True:
+        received += sum(len(data) for data in receiver.take_in_buf())
+        if connection.poll(0.01):
+            connection.recv()
+            connection.send(received)
+
+
+def run(args, port, unix_directory):
+    """
+
+    :return: Whether the link used the Unix socket, the latencies and the received packets per second.
+    """
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=receive, args=(port, unix_directory, child_connection), daemon=True)
+    process.start()
+    connection.recv()
+    sender = Stream('127.0.0.1', port + 1, unix_directory=unix_directory)
+    receiver_address = PeerAddress.from_text('127.0.0.1', port)
+    sender.add_node(receiver_address)
+    node = sender.nodes[receiver_address]
+    message = bytes(args.size)
+
+    latencies = []
+    for _ in range(args.packets):
+        t = time.perf_counter()
+        node.add_message_to_out_buff(message)
+        node.send_message()
+        latencies.append(time.perf_counter() - t)
+
+    def received():
+        time.sleep(0.2)
+        connection.send(None)
+        return connection.recv() / args.size
+
+    before = received()
+    t = time.perf_counter()
+    while time.perf_counter() - t < args.duration:
+        for _ in range(100):
+            node.add_message_to_out_buff(message)
+        node.send_message()
+    elapsed = time.perf_counter() - t
+    rate = (received() - before) / elapsed
+    process.kill()
+    return node.client.is_unix, latencies, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1024, help='bytes of a packet, at most 2048')
+    parser.add_argument('--packets', type=int, default=5000, help='packets of the latency measurement')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--base-port', type=int, default=28000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    print('%10s %12s %12s %12s %10s' % ('transport', 'median us', 'p99 us', 'packets/s', 'MB/s'))
+    for i, (name, unix_directory) in enumerate((('tcp', None), ('unix', tempfile.mkdtemp(prefix='local_transport_')))):
+        is_unix, latencies, rate = run(args, args.base_port + 2 * i, unix_directory)
+        assert is_unix == (unix_directory is not None)
+        latencies.sort()
+        print('%10s %12.1f %12.1f %12.0f %10.1f' % (
+            name, 1e6 * statistics.median(latencies), 1e6 * latencies[int(0.99 * len(latencies))], rate,
+            rate * args.size / 1e6))
+    # the TCPServer threads never stop
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
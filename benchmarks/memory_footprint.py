@@ -0,0 +1,89 @@
+"""
+    Memory per peer on the root and on an interior peer, measured with tracemalloc.
+
+    Root: for every peer of the network the root has its PeerAddress, a GraphNode in the NetworkGraph (placed in
+    batches like the root main loop), a register Node without an open connection and a Reunion Hello time.
+
+    Interior peer: memory for one Reunion cycle of its sub-tree; every peer of the sub-tree sends a Hello which the
+    interior peer receives, parses and relays to its parent, so it holds the received buffer, the Packet and the
+    relayed buffer for each of them until the end of the cycle.
+
+    Usage:
+        python -m benchmarks.memory_footprint --peers 10000 100000
+"""
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+
+from Packet import PacketFactory
+from tools.NetworkGraph import NetworkGraph
+from tools.Node import Node
+from tools.PeerAddress import PeerAddress
+
+ROOT_ADDRESS = ('127.000.000.001', '05000')
+INTERIOR_ADDRESS = ('010.255.255.254', '05000')
+BATCH = 500
+
+
+def peer_address(i):
+    return '010.%03d.%03d.%03d' % (i // 65536 % 256, i // 256 % 256, i % 256), '%05d' % (5000 + i % 1000)
+
+
+def root(peers):
+    graph = NetworkGraph(ROOT_ADDRESS)
+    register_nodes = {}
+    hello_times = {}
+    t = time.time()
+    for i in range(0, peers, BATCH):
+        addresses = [PeerAddress.get(peer_address(j)) for j in range(i, min(peers, i + BATCH))]
+        graph.place_nodes(addresses)
+        for address in addresses:
+            register_nodes[address] = Node(address, set_register=True, lazy=True)
+            hello_times[address] = t
+    return graph, register_nodes, hello_times
+
+
+def interior(peers, version):
+    in_buf = []
+    for i in range(peers):
+        # a Hello from a peer two levels below us
+        path = [peer_address(i), peer_address(peers + i)]
+        in_buf.append(PacketFactory.new_reunion_packet('REQ', path[-1], path, version=version).get_buf())
+    packets = PacketFactory.parse_many(in_buf)
+    out_buff = [PacketFactory.new_relayed_reunion_packet(packet, INTERIOR_ADDRESS).get_buf() for packet in packets]
+    return in_buf, packets, out_buff
+
+
+def measure(function, *args):
+    """
+
+    :return: Bytes which are allocated by 'function' and are alive after it.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    state = function(*args)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del state
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+    # Node logs every new node
+    logging.disable(logging.WARNING)
+
+    print('%8s %18s %18s %18s' % ('peers', 'root B/peer', 'interior v1 B/peer', 'interior v2 B/peer'))
+    for peers in args.peers:
+        sizes = [measure(root, peers), measure(interior, peers, 1), measure(interior, peers, 2)]
+        print('%8d' % peers + ''.join('%19.0f' % (size / peers) for size in sizes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+    Bytes on the wire against CPU cost of compressed Message packets.
+
+    For every message size and compression level the origin makes one version 3 Message packet (level 0 is
+    codec 0, no compression); The report shows the packet size (bytes on every tree edge), its ratio to the
+    uncompressed version 2 packet and the CPU time of the origin (compress and encode), of a middle peer which
+    forwards the packet to a link of the same version (no decompression), and of the receiver (parse and
+    decompress), in microseconds per message.
+
+    The messages are text like chat lines and JSON status records; With --random they are random bytes, which
+    do not get smaller and are sent with codec 0.
+
+    Usage:
+        python -m benchmarks.message_compression --sizes 64 256 1024 2004 --levels 0 1 6 9
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from Packet import PacketFactory
+
+SOURCE = ('010.000.000.001', '05000')
+MIDDLE = ('010.000.000.002', '05000')
+WORDS = ('peer', 'root', 'message', 'network', 'join', 'the', 'a', 'of', 'to', 'is', 'hello', 'reunion', 'tree',
+         'status', 'ok', 'sent', 'received', 'node', 'parent', 'child', 'link', 'time', 'cycle', 'broadcast')
+
+
+def text_message(size):
+    random.seed(size)
+    parts = []
+    length = 0
+    while length < size:
+        if random.random() < 0.5:
+            part = ' '.join(random.choice(WORDS) for _ in range(random.randint(4, 12))) + '.'
+        else:
+            part = json.dumps({'peer': '010.000.%03d.%03d' % (random.randrange(256), random.randrange(256)),
+                               'status': random.choice(['ok', 'joined', 'left']), 'time': random.randrange(10 ** 9),
+                               'children': random.randrange(3)})
+        parts.append(part)
+        length += len(part) + 1
+    return '\n'.join(parts).encode()[:size]
+
+
+def cost(function, seconds=0.2):
+    """
+
+    :return: Microseconds per call.
+    """
+    calls = 0
+    t = time.perf_counter()
+    while time.perf_counter() - t < seconds:
+        function()
+        calls += 1
+    return (time.perf_counter() - t) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 256, 1024, PacketFactory.fragment_size])
+    parser.add_argument('--levels', type=int, nargs='+', default=[0, 1, 6, 9])
+    parser.add_argument('--random', action='store_true', help='random messages')
+    args = parser.parse_args()
+
+    columns = ['size', 'level', 'wire bytes', 'ratio', 'origin us', 'forward us', 'receive us']
+    print('%8s %6s %11s %7s %10s %11s %11s' % tuple(columns))
+    for size in args.sizes:
+        message = os.urandom(size) if args.random else text_message(size)
+        plain = len(PacketFactory.new_message_packet(message, SOURCE, version=2).get_buf())
+        for level in args.levels:
+            codec = 0 if level == 0 else PacketFactory.message_codec_zlib
+
+            def origin():
+                return PacketFactory.new_message_packet(message, SOURCE, version=3, codec=codec,
+                                                        level=level).get_buf()
+
+            buf = origin()
+            packet = PacketFactory.parse_buffer(buf)
+            assert PacketFactory.get_message_payload(packet) == message
+            print('%8d %6d %11d %7.2f %10.2f %11.2f %11.2f' % (
+                size, level, len(buf), len(buf) / plain, cost(origin),
+                cost(lambda: PacketFactory.new_forwarded_message_packet(packet, MIDDLE, version=3).get_buf()),
+                cost(lambda: PacketFactory.get_message_payload(PacketFactory.parse_buffer(buf)))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+    Microbenchmarks of the hot paths: the packet codec, the Reunion bodies, the NetworkGraph and the Stream.
+
+    Every case runs its operation on inputs made with a fixed seed, in 'repeat' runs of at least 'min-time' seconds,
+    and the report shows the median and the best nanoseconds per operation of the runs. The cases are:
+
+        codec.*     PacketFactory.parse_buffer of each packet type, the new_*_packet builders and Packet.get_buf.
+        reunion.*   parse_reunion_body, the rebuild of a Hello (parse and new_reunion_packet with one more address)
+                    and new_relayed_reunion_packet, for a few path lengths.
+        graph.*     NetworkGraph.find_live_node on a stable graph and after a change (the BFS), find_node and
+                    remove_node (of a leaf, which is added back) for a complete binary tree of each size.
+        stream.*    Stream.add_message_to_out_buff, and send_out_buf_messages to a receiver process over TCP
+                    loopback; An operation is one message of 'size' bytes and its ACK.
+
+    With --output the results are written to a JSON file; With --baseline (a JSON file of an earlier run) every case
+    is compared with the baseline (by the best run) and the command fails if a case is more than 'threshold' slower.
+
+    Usage:
+        python -m benchmarks.microbenchmarks --output baseline.json
+        python -m benchmarks.microbenchmarks --baseline baseline.json --filter codec. graph.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+from Packet import PacketFactory
+from Stream import Stream
+from benchmarks.cluster import git_revision
+from benchmarks.local_transport import receive
+from tools.NetworkGraph import NetworkGraph
+from tools.PeerAddress import PeerAddress
+
+SOURCE = ('127.000.000.001', '05000')
+GRAPH_SIZES = (1000, 10000, 100000)
+HOPS = (1, 8, 64)
+
+
+def address(i):
+    return '010.%03d.%03d.%03d' % (i // 65536 % 256, i // 256 % 256, i % 256), '%05d' % (5000 + i % 1000)
+
+
+def codec_cases(rng):
+    message = bytes(rng.getrandbits(8) for _ in range(1024))
+    path = [address(i) for i in range(4)]
+    builders = {
+        'message': lambda: PacketFactory.new_message_packet(message.hex()[:512], SOURCE),
+        'reunion': lambda: PacketFactory.new_reunion_packet('REQ', SOURCE, path, version=2),
+        'advertise': lambda: PacketFactory.new_advertise_packet('RES', SOURCE, neighbour=address(1), version=2),
+        'join': lambda: PacketFactory.new_join_packet(SOURCE, features=PacketFactory.supported_features),
+        'register': lambda: PacketFactory.new_register_packet('REQ', SOURCE, address=SOURCE,
+                                                              features=PacketFactory.supported_features),
+        'fragment': lambda: PacketFactory.new_fragment_packet(SOURCE, rng.getrandbits(64), 1 << 20, 0, message),
+        'unicast': lambda: PacketFactory.new_unicast_packet(SOURCE, address(1), address(2), message),
+    }
+    cases = {}
+    for name, build in builders.items():
+        packet = build()
+        buf = packet.get_buf()
+        cases['codec.new_%s_packet' % name] = lambda build=build: build
+        cases['codec.parse_buffer.%s' % name] = lambda buf=buf: lambda: PacketFactory.parse_buffer(buf)
+        cases['codec.get_buf.%s' % name] = lambda packet=packet: packet.get_buf
+    return cases
+
+
+def reunion_cases(rng):
+    cases = {}
+    for hops in HOPS:
+        buf = PacketFactory.new_reunion_packet('REQ', SOURCE, [address(rng.randrange(1 << 20)) for _ in range(hops)],
+                                               version=2).get_buf()
+        packet = PacketFactory.parse_buffer(buf)
+
+        def rebuild(packet=packet):
+            nodes_array, backup = PacketFactory.parse_reunion_body(packet)
+            nodes_array.append(SOURCE)
+            return PacketFactory.new_reunion_packet('REQ', SOURCE, nodes_array, version=2).get_buf()
+
+        cases['reunion.parse.%d' % hops] = lambda packet=packet: lambda: PacketFactory.parse_reunion_body(packet)
+        cases['reunion.rebuild.%d' % hops] = lambda rebuild=rebuild: rebuild
+        cases['reunion.relay.%d' % hops] = lambda packet=packet: lambda: PacketFactory.new_relayed_reunion_packet(
+            packet, SOURCE).get_buf()
+    return cases
+
+
+def make_graph(size):
+    """
+
+    :return: A NetworkGraph of a complete binary tree with 'size' nodes under the root.
+    """
+    graph = NetworkGraph(SOURCE)
+    # node k (1-indexed) is a child of node (k - 1) // 2 and 0 is the root
+    graph.load_nodes((address(k), (k - 1) // 2, True) for k in range(1, size + 1))
+    return graph
+
+
+def graph_cases(rng):
+    cases = {}
+    for size in GRAPH_SIZES:
+        def stable(size=size):
+            graph = make_graph(size)
+            sender = address(size + 1)
+            return lambda: graph.find_live_node(sender)
+
+        def changed(size=size):
+            graph = make_graph(size)
+            sender, middle = address(size + 1), address(1)
+
+            def find():
+                # a node which is turned off and on again changes the free slots
+                graph.turn_off_node(middle)
+                graph.turn_on_node(middle)
+                return graph.find_live_node(sender)
+            return find
+
+        def find(size=size):
+            graph = make_graph(size)
+            addresses = [address(rng.randrange(1, size + 1)) for _ in range(1000)]
+            return lambda: [graph.find_node(ip, port) for ip, port in addresses]
+
+        def remove(size=size):
+            graph = make_graph(size)
+            leaf = address(size)
+            parent = address((size - 1) // 2) if size > 2 else SOURCE
+
+            def remove_and_add():
+                graph.remove_node(leaf)
+                graph.add_node(leaf[0], leaf[1], parent)
+            return remove_and_add
+
+        cases['graph.find_live_node.%d' % size] = stable
+        cases['graph.find_live_node_after_change.%d' % size] = changed
+        cases['graph.find_node.%d' % size] = (find, 1000)
+        cases['graph.remove_node.%d' % size] = remove
+    return cases
+
+
+def start_receiver(args):
+    """
+    Start the receiver process of the stream cases.
+
+    :return: The process.
+    """
+    connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=receive, args=(args.base_port + 1, None, child_connection), daemon=True)
+    process.start()
+    connection.recv()
+    return process
+
+
+def stream_cases(args):
+    def add(batch=1000):
+        stream = Stream('127.0.0.1', args.base_port, unix_directory=None)
+        receiver_address = PeerAddress.from_text('127.0.0.1', args.base_port + 1)
+        stream.add_node(receiver_address)
+        message = bytes(args.size)
+
+        def add_messages():
+            for _ in range(batch):
+                stream.add_message_to_out_buff(receiver_address, message)
+            stream.nodes[receiver_address].out_buff.clear()
+        return add_messages
+
+    def send(batch=100):
+        stream = Stream('127.0.0.1', args.base_port + 2, unix_directory=None)
+        receiver_address = PeerAddress.from_text('127.0.0.1', args.base_port + 1)
+        stream.add_node(receiver_address)
+        message = bytes(args.size)
+
+        def send_messages():
+            for _ in range(batch):
+                stream.add_message_to_out_buff(receiver_address, message)
+            stream.send_out_buf_messages()
+        return send_messages
+
+    return {'stream.add_message_to_out_buff': (add, 1000), 'stream.send_out_buf_messages': (send, 100)}
+
+
+def measure(setup, operations, args):
+    """
+
+    :return: Nanoseconds per operation of every run.
+    :rtype: list
+    """
+    function = setup()
+    # calls of a run, so a run takes at least min_time
+    calls = 1
+    while True:
+        t = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - t
+        if elapsed >= args.min_time / 4:
+            break
+        calls *= 2
+    calls = max(1, int(calls * args.min_time / elapsed))
+    runs = []
+    for _ in range(args.repeat):
+        t = time.perf_counter()
+        for _ in range(calls):
+            function()
+        runs.append(1e9 * (time.perf_counter() - t) / (calls * operations))
+    return runs
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of the best run of every case against the baseline.
+
+    :return: The cases which are more than 'threshold' slower.
+    :rtype: list
+    """
+    regressions = []
+    print('\n%-45s %12s %12s %9s' % ('case', 'baseline ns', 'best ns', 'change'))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        # the best run is the least disturbed by the other processes of the host
+        before, now = baseline[name]['best_ns'], result['best_ns']
+        change = now / before - 1
+        slower = change > threshold
+        if slower:
+            regressions.append(name)
+        print('%-45s %12.1f %12.1f %+8.1f%%%s' % (name, before, now, 100 * change, '  slower' if slower else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', nargs='*', default=[], help='run the cases which start with one of these')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds of a run')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=1024, help='bytes of a stream message, at most 2048')
+    parser.add_argument('--base-port', type=int, default=29500)
+    parser.add_argument('--output', help='path of the JSON results')
+    parser.add_argument('--baseline', help='path of the JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    rng = random.Random(args.seed)
+    cases = {}
+    cases.update(codec_cases(rng))
+    cases.update(reunion_cases(rng))
+    cases.update(graph_cases(rng))
+    cases.update(stream_cases(args))
+    if args.filter:
+        cases = {name: case for name, case in cases.items() if any(name.startswith(prefix) for prefix in args.filter)}
+
+    results = {}
+    receiver = None
+    print('%-45s %12s %12s %14s' % ('case', 'median ns', 'best ns', 'ops/s'))
+    for name, case in cases.items():
+        if name.startswith('stream.') and receiver is None:
+            # it would take CPU time from the other cases
+            receiver = start_receiver(args)
+        setup, operations = case if isinstance(case, tuple) else (case, 1)
+        runs = measure(setup, operations, args)
+        median = statistics.median(runs)
+        results[name] = {'median_ns': median, 'best_ns': min(runs), 'runs_ns': runs}
+        print('%-45s %12.1f %12.1f %14.0f' % (name, median, min(runs), 1e9 / median))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': dict(vars(args), python=platform.python_version(), machine=platform.machine(),
+                                      revision=git_revision()),
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+        print('\n%d of %d cases are more than %.0f%% slower than the baseline' % (
+            len(regressions), len(results), 100 * args.threshold))
+
+    if receiver is not None:
+        receiver.kill()
+    sys.stdout.flush()
+    # the TCPServer threads of the Streams never stop
+    os._exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+    Packets per second of the PacketFactory codec for mixed traffic.
+
+    The traffic is a mix like the one that a middle peer sees: Messages, Reunion Hellos and Hello Backs of a few
+    hops, Advertise and Join packets from a small set of senders. The report shows the decode rate of parse_buffer
+    (one call per packet) and parse_many (one call per main loop cycle) and the encode rate of get_buf and
+    encode_many, all in packets per second.
+
+    With --profile it also profiles the packet path of one main loop cycle: parse the packets, find the Node of
+    every sender like Stream.get_node_by_server and encode the packets again, and prints the top functions.
+
+    Usage:
+        python -m benchmarks.packet_codec --packets 1000 --senders 16
+        python -m benchmarks.packet_codec --profile
+"""
+import argparse
+import cProfile
+import pstats
+import random
+import time
+
+from Packet import PacketFactory
+from tools.PeerAddress import PeerAddress
+
+
+def address(i):
+    return '010.000.%03d.%03d' % (i // 256 % 256, i % 256), '%05d' % (5000 + i)
+
+
+def traffic(packets, senders, version):
+    random.seed(1)
+    result = []
+    for _ in range(packets):
+        sender = address(random.randrange(senders))
+        kind = random.random()
+        if kind < 0.5:
+            result.append(PacketFactory.new_message_packet('message from ' + sender[0], sender))
+        elif kind < 0.8:
+            path = [address(random.randrange(senders)) for _ in range(random.randint(1, 6))]
+            result.append(PacketFactory.new_reunion_packet(random.choice(['REQ', 'RES']), sender, path,
+                                                           version=version))
+        elif kind < 0.9:
+            result.append(PacketFactory.new_advertise_packet('RES', sender, neighbour=address(0), version=version))
+        else:
+            result.append(PacketFactory.new_join_packet(sender, features=PacketFactory.supported_features))
+    return result
+
+
+def rate(function, count, seconds=0.5):
+    """
+
+    :return: Packets per second; 'function' handles 'count' packets.
+    """
+    calls = 0
+    t = time.perf_counter()
+    while time.perf_counter() - t < seconds:
+        function()
+        calls += 1
+    return calls * count / (time.perf_counter() - t)
+
+
+def profile(packets, senders):
+    buffers = PacketFactory.encode_many(traffic(packets, senders, 2))
+    nodes = {PeerAddress.get(address(i)): i for i in range(senders)}
+
+    def cycle():
+        parsed = PacketFactory.parse_many(buffers)
+        for packet in parsed:
+            nodes.get(PeerAddress.from_text(packet.get_source_server_ip(), packet.get_source_server_port()))
+        PacketFactory.encode_many(parsed)
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(20):
+        cycle()
+    profiler.disable()
+    pstats.Stats(profiler).sort_stats('tottime').print_stats(8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--packets', type=int, default=1000, help='packets in one main loop cycle')
+    parser.add_argument('--senders', type=int, default=16)
+    parser.add_argument('--profile', action='store_true', help='profile the packet path')
+    args = parser.parse_args()
+
+    columns = ['parse_buffer', 'parse_many', 'get_buf', 'encode_many']
+    print('%8s' % 'version' + ''.join('%14s' % column for column in columns))
+    for version in (1, 2):
+        packets = traffic(args.packets, args.senders, version)
+        buffers = PacketFactory.encode_many(packets)
+        assert [packet.buf for packet in PacketFactory.parse_many(buffers)] == [packet.buf for packet in packets]
+        rates = [rate(lambda: [PacketFactory.parse_buffer(buf) for buf in buffers], len(buffers)),
+                 rate(lambda: PacketFactory.parse_many(buffers), len(buffers)),
+                 rate(lambda: [packet.get_buf() for packet in packets], len(packets)),
+                 rate(lambda: PacketFactory.encode_many(packets), len(packets))]
+        print('%8d' % version + ''.join('%14.0f' % value for value in rates))
+    if args.profile:
+        profile(args.packets, args.senders)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+    Cost of the TCPServer receive path: a new bytes object for every read, or recv_into a BufferPool chunk.
+
+    A socket pair on this host plays a link; Every packet ('size' bytes) is written to one side and read from the
+    other like ServerSocket does, one packet per read. The reads of a cycle ('cycle' packets, like the input buffer of
+    one main loop cycle of a Peer) are kept in a list and then parsed with PacketFactory.parse_many, and the list is
+    dropped. The 'recv' path is the old ServerSocket read (sock.recv), the 'recv_into' path is the new one (a view of
+    the current chunk of a BufferPool).
+
+    The report shows the packets per second of the path (read and parse), the peak memory of a cycle measured with
+    tracemalloc and the number of chunks which the BufferPool has made.
+
+    Usage:
+        python -m benchmarks.receive_path --size 1024 --packets 200000 --cycle 10000
+"""
+import argparse
+import socket
+import time
+import tracemalloc
+
+from Packet import PacketFactory
+from tools.simpletcp.bufferpool import BufferPool
+
+RECEIVED_BYTES = 2048
+
+
+def run(args, use_pool):
+    """
+
+    :return: Packets per second, the peak memory of a cycle in bytes and the chunks which the pool has made.
+    """
+    writer, reader = socket.socketpair()
+    body = bytes(args.size - 20)
+    buf = PacketFactory.new_fragment_packet(('127.000.000.001', '05000'), 1, len(body), 0, body).get_buf()
+    pool = BufferPool()
+    received = 0
+    peak = 0
+    t = time.perf_counter()
+    while received < args.packets:
+        if args.trace:
+            tracemalloc.start()
+        buffers = []
+        for _ in range(args.cycle):
+            writer.send(buf)
+            if use_pool:
+                buffers.append(pool.recv(reader, RECEIVED_BYTES))
+            else:
+                buffers.append(reader.recv(RECEIVED_BYTES))
+        packets = PacketFactory.parse_many(buffers)
+        assert all(len(packet.get_body()) == packet.get_length() for packet in packets)
+        del buffers, packets
+        if args.trace:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        received += args.cycle
+    elapsed = time.perf_counter() - t
+    writer.close()
+    reader.close()
+    return received / elapsed, peak, pool.allocated if use_pool else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=1024, help='bytes of a packet, at most %d' % RECEIVED_BYTES)
+    parser.add_argument('--packets', type=int, default=200000)
+    parser.add_argument('--cycle', type=int, default=10000)
+    args = parser.parse_args()
+
+    print('%10s %12s %16s %8s' % ('path', 'packets/s', 'cycle peak KB', 'chunks'))
+    for name, use_pool in (('recv', False), ('recv_into', True)):
+        # the throughput without tracemalloc, then the memory with it
+        args.trace = False
+        rate, _, _ = run(args, use_pool)
+        args.trace = True
+        _, peak, chunks = run(args, use_pool)
+        print('%10s %12.0f %16.0f %8d' % (name, rate, peak / 1024, chunks))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+    Number of open file descriptors on a root with many registered peers.
+
+    The root Stream registers 'peers' register nodes and sends a Register Response to every one of them. All of the
+    peers are served by one TCPServer which listens on every loopback address, so only the root side sockets are
+    counted. The report shows the open register connections and the file descriptors of this process right after the
+    storm and after the register idle timeout.
+
+    Usage:
+        python -m benchmarks.register_connections --peers 10000
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+from Packet import PacketFactory
+from Stream import Stream
+from tools.simpletcp.tcpserver import TCPServer
+
+
+def open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=10000)
+    parser.add_argument('--root-port', type=int, default=5600)
+    parser.add_argument('--peers-port', type=int, default=21000)
+    parser.add_argument('--idle-timeout', type=float, default=2)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    def callback(address, queue, data):
+        queue.put(b'ACK')
+
+    peers_server = TCPServer('0.0.0.0', args.peers_port, callback, maximum_connections=1024)
+    threading.Thread(target=peers_server.run, daemon=True).start()
+    root = Stream('127.0.0.1', args.root_port, register_idle_timeout=args.idle_timeout)
+    time.sleep(0.5)
+    fds_before = open_fds()
+
+    t = time.time()
+    for i in range(args.peers):
+        address = ('127.%03d.%03d.%03d' % (i // (254 * 256), i // 254 % 256, i % 254 + 1), str(args.peers_port))
+        root.add_node(address, set_register_connection=True)
+        pck = PacketFactory.new_register_packet('RES', root.get_server_address(), phase=0)
+        root.add_message_to_out_buff(address, pck.get_buf(), is_register=True)
+        # the root main loop flushes its buffers every cycle
+        if i % 500 == 499:
+            root.send_out_buf_messages()
+    root.send_out_buf_messages()
+    print('registered peers:            %d' % len(root.register_nodes))
+    print('storm time:                  %.2fs' % (time.time() - t))
+    print('open register connections:   %d' % len(root._connected_register_nodes))
+    print('extra file descriptors:      %d' % (open_fds() - fds_before))
+
+    time.sleep(args.idle_timeout + 0.5)
+    root.send_out_buf_messages()
+    time.sleep(0.5)
+    print('after idle timeout:          %d connections, %d extra file descriptors' % (
+        len(root._connected_register_nodes), open_fds() - fds_before))
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
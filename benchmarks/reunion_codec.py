@@ -0,0 +1,69 @@
+"""
+    Wire size and codec throughput of Reunion bodies in protocol version 1 (text) and version 2 (binary).
+
+    For every path length the report shows the packet size, the parse rate (PacketFactory.parse_buffer plus
+    parse_reunion_body, like the root does), the rebuild rate (parse, append an address and build the new packet
+    buffer, like the middle peers did before) and the relay rate (new_relayed_reunion_packet, which appends an
+    address without parsing the entries). Version 1 bodies can not have more than 99 entries, so
+    its longest measured path is 98 entries (one is appended by the relay).
+
+    Usage:
+        python -m benchmarks.reunion_codec --hops 1 8 98 1000
+"""
+import argparse
+import time
+
+from Packet import PacketFactory
+
+SOURCE = ('127.000.000.001', '05000')
+
+
+def path(hops):
+    return [('010.%03d.%03d.%03d' % (i // 65536 % 256, i // 256 % 256, i % 256), '%05d' % (5000 + i % 1000))
+            for i in range(hops)]
+
+
+def rate(function, seconds=0.3):
+    count = 0
+    t = time.perf_counter()
+    while time.perf_counter() - t < seconds:
+        for _ in range(100):
+            function()
+        count += 100
+    return count / (time.perf_counter() - t)
+
+
+def measure(version, hops):
+    buf = PacketFactory.new_reunion_packet('REQ', SOURCE, path(hops), version=version).get_buf()
+
+    def parse():
+        return PacketFactory.parse_reunion_body(PacketFactory.parse_buffer(buf))
+
+    def rebuild():
+        nodes_array, backup = parse()
+        nodes_array.append(SOURCE)
+        return PacketFactory.new_reunion_packet('REQ', SOURCE, nodes_array, version=version).get_buf()
+
+    def relay():
+        packet = PacketFactory.parse_buffer(buf)
+        return PacketFactory.new_relayed_reunion_packet(packet, SOURCE).get_buf()
+
+    assert parse()[0] == path(hops)
+    return len(buf), rate(parse), rate(rebuild), rate(relay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hops', type=int, nargs='+', default=[1, 8, 98, 1000])
+    args = parser.parse_args()
+
+    columns = ['bytes', 'parse/s', 'rebuild/s', 'relay/s']
+    print('%6s %8s' % ('hops', 'version') + ''.join('%12s' % column for column in columns))
+    for hops in args.hops:
+        for version in (1, 2):
+            if version == 1 and hops > 98:
+                continue
+            print('%6d %8d' % (hops, version) + ''.join('%12.0f' % value for value in measure(version, hops)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+    Simulation of the Reunion Hello load on the root after a mass restart.
+
+    All clients start their reunion daemon at the same moment (when the root answers a storm of Advertise Requests
+    in one main loop cycle) and every Reunion Hello waits for the main loop of each peer on its path to the root.
+    In the 'restart' scenario the main loops of all peers are in phase too (all processes were restarted together),
+    in the 'staggered' scenario they have random phases and in the 'immediate' scenario the peers forward Reunion
+    Hello packets as soon as they arrive (no main loop wait).
+    The simulation reports the peak-to-mean ratio of the Reunion Hello arrivals at the root in 100ms windows and per
+    root main loop cycle (2 seconds) for the fixed schedule and the jittered schedules of ReunionTimer.
+
+    Usage:
+        python -m benchmarks.reunion_jitter --peers 1000 --duration 120
+"""
+import argparse
+import math
+import random
+
+from tools.ReunionTimer import ReunionTimer
+
+MAIN_LOOP_INTERVAL = 2
+LINK_LATENCY = 0.001
+GOLDEN_RATIO_STEP = 0.618034
+
+
+def next_tick(offset, t):
+    """
+
+    :return: The first main loop cycle of a peer (with 'offset') which starts at or after 't'.
+    :rtype: float
+    """
+    return offset + math.ceil((t - offset) / MAIN_LOOP_INTERVAL) * MAIN_LOOP_INTERVAL
+
+
+def simulate(peers, duration, make_timer, seed, scenario):
+    """
+    Peers are placed in a complete binary tree; peer k (1-indexed) is a child of peer (k - 1) // 2 and 0 is the root.
+
+    :return: Arrival times of Reunion Hello packets at the root.
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    loop_spread = MAIN_LOOP_INTERVAL if scenario == 'staggered' else 0.05
+    loop_offsets = [rng.uniform(0, loop_spread) for _ in range(peers + 1)]
+    arrivals = []
+    for k in range(1, peers + 1):
+        path = []
+        node = k
+        while node != 0:
+            path.append(node)
+            node = (node - 1) // 2
+        timer = make_timer(k, rng)
+        # the daemon starts while the main loop is handling the Advertise Response
+        send_time = loop_offsets[k] + LINK_LATENCY + timer.first_delay()
+        while send_time < duration:
+            t = send_time
+            for node in path:
+                if scenario != 'immediate':
+                    t = next_tick(loop_offsets[node], t)
+                t += LINK_LATENCY
+            arrivals.append(t)
+            send_time += timer.next_delay()
+    return arrivals
+
+
+def peak_to_mean(arrivals, duration, bin_width):
+    bins = [0] * int(math.ceil(duration / bin_width))
+    for t in arrivals:
+        if t < duration:
+            bins[int(t / bin_width)] += 1
+    mean = sum(bins) / len(bins)
+    return max(bins) / mean if mean else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    schedules = [
+        ('fixed', lambda k, rng: ReunionTimer(interval=4, jitter=0, phase=0, rng=rng)),
+        ('jitter', lambda k, rng: ReunionTimer(interval=4, jitter=0.25, rng=rng)),
+        ('jitter+root phase', lambda k, rng: ReunionTimer(interval=4, jitter=0.25,
+                                                          phase=(k * GOLDEN_RATIO_STEP) % 1, rng=rng)),
+    ]
+    print('%-12s %-20s %10s %14s %14s' % ('scenario', 'schedule', 'hellos', 'p/m (100ms)', 'p/m (cycle)'))
+    for scenario in ('restart', 'staggered', 'immediate'):
+        for name, make_timer in schedules:
+            arrivals = simulate(args.peers, args.duration, make_timer, args.seed, scenario)
+            print('%-12s %-20s %10d %14.2f %14.2f' % (scenario, name, len(arrivals),
+                                                      peak_to_mean(arrivals, args.duration, 0.1),
+                                                      peak_to_mean(arrivals, args.duration, MAIN_LOOP_INTERVAL)))
+
+
+if __name__ == '__main__':
+    main()
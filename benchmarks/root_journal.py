@@ -0,0 +1,120 @@
+"""
+    Cost of the root journal (RootJournal) with a large NetworkGraph.
+
+    Builds a NetworkGraph of 'nodes' peers with and without a journal listener, then turns every peer off and on
+    again; the write overhead per mutation is the difference of the off/on times. Then reports the snapshot size and
+    time, and the time to reload the state from the log alone, from the snapshot alone and from the snapshot plus a
+    log of 'nodes' mutations.
+
+    Usage:
+        python -m benchmarks.root_journal --nodes 100000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from tools.NetworkGraph import NetworkGraph
+from tools.RootJournal import RootJournal
+
+ROOT_ADDRESS = ('127.000.000.001', '05000')
+BATCH = 500
+
+
+def peer_address(i):
+    return '010.%03d.%03d.%03d' % (i // 65536 % 256, i // 256 % 256, i % 256), '05000'
+
+
+def build(graph, journal, nodes):
+    """
+    Place the peers in batches like the root main loop; The journal is flushed once in every batch.
+
+    :return:
+    """
+    for i in range(0, nodes, BATCH):
+        graph.place_nodes([peer_address(j) for j in range(i, min(nodes, i + BATCH))])
+        if journal is not None:
+            journal.flush()
+
+
+def toggle(graph, journal, nodes):
+    """
+    Turn every peer off and on again.
+
+    :return: Number of mutations and the time.
+    """
+    t = time.perf_counter()
+    for i in range(0, nodes, BATCH):
+        for j in range(i, min(nodes, i + BATCH)):
+            graph.turn_off_node(peer_address(j))
+            graph.turn_on_node(peer_address(j))
+        if journal is not None:
+            journal.flush()
+    return nodes * 2, time.perf_counter() - t
+
+
+def load(directory):
+    t = time.perf_counter()
+    journal = RootJournal(directory)
+    graph = NetworkGraph(ROOT_ADDRESS)
+    journal.load(graph)
+    elapsed = time.perf_counter() - t
+    journal.close()
+    return graph, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--sync', action='store_true', help='fsync every flush')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='root_journal_')
+    try:
+        plain_graph = NetworkGraph(ROOT_ADDRESS)
+        build(plain_graph, None, args.nodes)
+        mutations, plain_time = toggle(plain_graph, None, args.nodes)
+
+        journal = RootJournal(directory, sync=args.sync)
+        graph = NetworkGraph(ROOT_ADDRESS)
+        journal.load(graph)
+        graph.add_listener(journal.record)
+        build(graph, journal, args.nodes)
+        mutations, journal_time = toggle(graph, journal, args.nodes)
+        log_size = os.path.getsize(journal.get_log_path(journal.epoch))
+        print('log records:                %d' % journal.log_records)
+        print('on/off mutation time:       %.2f us without journal, %.2f us with journal' % (
+            plain_time / mutations * 1e6, journal_time / mutations * 1e6))
+        print('write overhead / mutation:  %.2f us' % ((journal_time - plain_time) / mutations * 1e6))
+        print('log size:                   %.1f MB' % (log_size / 1e6))
+
+        _, log_load_time = load(directory)
+        print('reload from log:            %.3fs' % log_load_time)
+
+        t = time.perf_counter()
+        journal.snapshot(graph, [])
+        print('snapshot time:              %.3fs' % (time.perf_counter() - t))
+        print('snapshot size:              %.1f MB' % (os.path.getsize(journal.get_snapshot_path()) / 1e6))
+        journal.close()
+
+        loaded, snapshot_load_time = load(directory)
+        assert loaded.get_operations() == graph.get_operations()
+        print('reload from snapshot:       %.3fs' % snapshot_load_time)
+
+        journal = RootJournal(directory)
+        graph = NetworkGraph(ROOT_ADDRESS)
+        journal.load(graph)
+        graph.add_listener(journal.record)
+        for i in range(args.nodes):
+            graph.turn_off_node(peer_address(i))
+        journal.close()
+        loaded, load_time = load(directory)
+        assert loaded.get_operations() == graph.get_operations()
+        print('reload from snapshot + log: %.3fs (%d log records)' % (load_time, args.nodes))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
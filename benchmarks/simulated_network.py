@@ -0,0 +1,114 @@
+"""
+    A whole network of Peers in the NetworkSimulator: tree formation, a broadcast and the failover of a crashed peer.
+
+    A root and 'peers' clients run on the virtual clock of the simulator (real Peer, PacketFactory and NetworkGraph
+    logic, simulated links). The clients start at 'join-rate' peers per second, each one sends a Register Request and
+    an Advertise Request 3 seconds later; The root admits them at the rate of its AdmissionQueue. When all clients
+    are in the NetworkGraph of the root (the tree is formed) the last client broadcasts a message and then the first
+    client, a child of the root with the largest sub-tree, crashes.
+
+    The report shows for each phase the virtual seconds until it has finished (formation: all clients are in the
+    tree; broadcast: the median and last arrival of the message; failover: the crashed peer is out of the tree and
+    the rest is in it again), the wall-clock seconds which the simulation took, how many times faster than real time
+    it ran and the number of events and sent packets. The same seed gives the same virtual times.
+
+    Usage:
+        python -m benchmarks.simulated_network --peers 10000 --join-rate 50 --loss 0.001
+"""
+import argparse
+import logging
+import statistics
+import time
+
+from tools.NetworkSimulator import NetworkSimulator
+from tools.PeerAddress import PeerAddress
+
+TYPE_NAMES = {1: 'register', 2: 'advertise', 3: 'join', 4: 'message', 5: 'reunion'}
+
+
+def client_address(i):
+    return PeerAddress.from_text('10.%d.%d.%d' % (1 + i // 65536, i // 256 % 256, i % 256), 5000)
+
+
+def join(network, address, root_address):
+    network.add_peer(address.ip, address.port, root_address=root_address)
+    network.command(address, 'Register')
+    network.command(address, 'Advertise', at=network.now + 3)
+
+
+def sub_tree_size(node):
+    size, stack = 0, [node]
+    while len(stack) > 0:
+        size += 1
+        stack.extend(stack.pop().children)
+    return size
+
+
+def run_until(network, done, limit, step=5):
+    """
+    Run the simulation in steps until done() is true or the virtual time 'limit'.
+
+    :return: The virtual time, or None if it has not finished.
+    """
+    while not done():
+        if network.now >= limit:
+            return None
+        network.run(network.now + step)
+    return network.now
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=1000)
+    parser.add_argument('--join-rate', type=float, default=50, help='clients which start in a second')
+    parser.add_argument('--latency', type=float, default=0.001, help='seconds')
+    parser.add_argument('--jitter', type=float, default=0.0005, help='seconds')
+    parser.add_argument('--loss', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600, help='virtual seconds of a phase at most')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    network = NetworkSimulator(latency=args.latency, jitter=args.jitter, loss=args.loss, seed=args.seed)
+    root_address = PeerAddress.from_text('10.0.0.1', 5000)
+    root = network.add_peer(root_address.ip, root_address.port, is_root=True)
+    clients = [client_address(i) for i in range(args.peers)]
+    for i, address in enumerate(clients):
+        network.schedule(i / args.join_rate, join, network, address, root_address)
+
+    print('%10s %12s %12s %10s %14s %12s %12s' % ('phase', 'virtual s', 'done at', 'wall s', 'x real time', 'events',
+                                                  'packets'))
+
+    def phase(name, done, result=None):
+        start, wall, events, packets = network.now, time.perf_counter(), network.events, sum(network.sent.values())
+        finished = run_until(network, done, start + args.timeout)
+        wall = time.perf_counter() - wall
+        print('%10s %12s %12s %10.1f %14.2f %12d %12d' % (
+            name, '-' if finished is None else '%.1f' % (result() if result else finished - start),
+            '-' if finished is None else '%.1f' % finished, wall, (network.now - start) / wall,
+            network.events - events, sum(network.sent.values()) - packets))
+
+    graph = root.network_graph.nodes
+    phase('formation', lambda: all(address in graph for address in clients))
+
+    message = b'simulated broadcast'
+    sent_at = network.now
+    network.command(clients[-1], 'SendMessage ' + message.decode())
+    arrivals = network.message_times[message]
+    phase('broadcast', lambda: len(arrivals) == len(clients), lambda: max(arrivals) - sent_at)
+    if len(arrivals) > 0:
+        print('%10s %12.3f' % ('median', statistics.median(arrivals) - sent_at))
+
+    victim = clients[0]
+    subtree = sub_tree_size(graph[victim]) - 1
+    network.crash(victim)
+    network.run(network.now)
+    phase('failover', lambda: victim not in graph and all(address in graph for address in clients[1:]))
+
+    print('peers under the crashed peer: %d' % subtree)
+    print('sent packets: ' + ', '.join('%s %d' % (TYPE_NAMES.get(packet_type, packet_type), count)
+                                       for packet_type, count in sorted(network.sent.items())))
+
+
+if __name__ == '__main__':
+    main()
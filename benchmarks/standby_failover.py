@@ -0,0 +1,118 @@
+"""
+    Time to recovery after the primary root fails, with a hot-standby root.
+
+    Starts a primary root, its standby root and 'peers' client processes on loopback, registers and advertises all
+    clients and then kills the primary root. The deepest client broadcasts a probe message every 2 seconds; the
+    network has recovered when a probe reaches every other client.
+
+    The report shows when the standby took over, when the network recovered and how many clients had to send a new
+    Advertise Request (all of the other clients kept their place in the tree).
+
+    Usage:
+        python -m benchmarks.standby_failover --peers 6
+"""
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PEER_CODE = 'import sys; sys.path.insert(0, %r); from Peer import Peer; Peer(*%r, **%r).run()'
+
+
+class PeerProcess:
+    def __init__(self, log_dir, port, **kwargs):
+        self.port = port
+        self.log_path = os.path.join(log_dir, '%d.log' % port)
+        code = PEER_CODE % (REPOSITORY, ('127.0.0.1', port), kwargs)
+        self.process = subprocess.Popen([sys.executable, '-u', '-W', 'ignore', '-c', code], stdin=subprocess.PIPE,
+                                        stdout=open(self.log_path, 'w'), stderr=subprocess.STDOUT, text=True)
+
+    def command(self, command):
+        self.process.stdin.write(command + '\n')
+        self.process.stdin.flush()
+
+    def log_times(self, text):
+        """
+
+        :return: Times of the log lines which contain 'text'.
+        """
+        times = []
+        with open(self.log_path) as log:
+            for line in log:
+                if text in line:
+                    times.append(datetime.datetime.strptime(line[:23], '%Y-%m-%d %H:%M:%S,%f').timestamp())
+        return times
+
+    def kill(self):
+        self.process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=6)
+    parser.add_argument('--base-port', type=int, default=23000)
+    parser.add_argument('--timeout', type=float, default=150)
+    args = parser.parse_args()
+
+    log_dir = tempfile.mkdtemp(prefix='standby_failover_')
+    primary_port, standby_port = args.base_port, args.base_port + 1
+    roots = [('127.0.0.1', primary_port), ('127.0.0.1', standby_port)]
+    processes = []
+    try:
+        primary = PeerProcess(log_dir, primary_port, is_root=True, standby_address=roots[1])
+        standby = PeerProcess(log_dir, standby_port, is_root=True, primary_address=roots[0])
+        processes += [primary, standby]
+        time.sleep(1)
+        clients = []
+        for i in range(args.peers):
+            clients.append(PeerProcess(log_dir, args.base_port + 10 + i, root_address=roots))
+        processes += clients
+        time.sleep(1)
+        for client in clients:
+            client.command('Register')
+        time.sleep(4)
+        # one by one, so the tree is filled level by level
+        for client in clients:
+            client.command('Advertise')
+            time.sleep(2)
+        time.sleep(10)
+
+        kill_time = time.time()
+        primary.kill()
+        measure(args, standby, clients, kill_time, log_dir)
+    finally:
+        for process in processes:
+            process.kill()
+
+
+def measure(args, standby, clients, kill_time, log_dir):
+    deepest = clients[-1]
+    recovered_time = None
+    probe = 0
+    probes = {}
+    while time.time() - kill_time < args.timeout and recovered_time is None:
+        probes[probe] = time.time()
+        deepest.command('SendMessage probe%d' % probe)
+        probe += 1
+        time.sleep(2)
+        for k in sorted(probes):
+            if all(client.log_times('message probe%d received' % k) for client in clients if client is not deepest):
+                recovered_time = max(max(client.log_times('message probe%d received' % k))
+                                     for client in clients if client is not deepest)
+                break
+
+    takeover = standby.log_times('standby root takes over')
+    advertised = [t for t in standby.log_times('advertise request received') if t > kill_time]
+
+    print('logs:                       %s' % log_dir)
+    print('standby took over after:    %s' % ('%.1fs' % (takeover[0] - kill_time) if takeover else 'never'))
+    print('network recovered after:    %s' % ('%.1fs' % (recovered_time - kill_time) if recovered_time else 'never'))
+    print('clients which re-advertised: %d of %d' % (len(advertised), args.peers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+    Broadcast throughput against the number of striped trees, in a simulation of the upload links.
+
+    Builds the trees of 'peers' peers like the root does: with 1 tree it is the NetworkGraph binary tree, with K
+    trees it is StripedTrees. In every tree each peer forwards every fragment of the tree to all of its tree
+    neighbours but the one which it came from, so the forward load of a peer is the sum of these sends over the
+    trees divided by K (in copies of the message); The origin of a message also sends one more copy.
+
+    Every peer (and the root) has the same upload capacity, so the broadcast rate is capped by the busiest peer:
+    the report shows the maximum forward load, the throughput as a fraction of the upload capacity when the origin
+    has a free upload link (1 / maximum forward load), for the worst origin and the mean over all origins, the share of the peers which upload anything and the depth of the
+    deepest tree. With --churn a fraction of the peers leaves and the trees are repaired before the mean
+    throughput is measured again (only for K > 1).
+
+    Usage:
+        python -m benchmarks.striped_trees --peers 1000 --stripes 1 2 4 8 16
+"""
+import argparse
+import logging
+import random
+
+from tools.NetworkGraph import NetworkGraph
+from tools.PeerAddress import PeerAddress
+from tools.StripedTrees import StripedTrees
+
+ROOT_ADDRESS = ('127.000.000.001', '05000')
+BATCH = 500
+
+
+def peer_address(i):
+    return PeerAddress.get(('010.%03d.%03d.%03d' % (i // 65536 % 256, i // 256 % 256, i % 256), '05000'))
+
+
+def graph_trees(addresses):
+    """
+
+    :return: The NetworkGraph tree as one {address: parent address} dict.
+    """
+    graph = NetworkGraph(ROOT_ADDRESS)
+    for i in range(0, len(addresses), BATCH):
+        graph.place_nodes(addresses[i:(i + BATCH)])
+    return [{address: node.parent.address for address, node in graph.nodes.items() if node.parent is not None}]
+
+
+def loads(trees):
+    """
+
+    :param trees: {address: parent address} of every tree.
+
+    :return: {address: forward load}, depth of the deepest tree.
+    """
+    load = {}
+    depth = 0
+    for parents in trees:
+        degrees = {}
+        for address, parent in parents.items():
+            degrees[address] = degrees.get(address, 0) + 1
+            degrees[parent] = degrees.get(parent, 0) + 1
+        for address, degree in degrees.items():
+            load[address] = load.get(address, 0) + (degree - 1) / len(trees)
+        depths = {}
+        for address in parents:
+            path = []
+            while address in parents and address not in depths:
+                path.append(address)
+                address = parents[address]
+            d = depths.get(address, 0)
+            for node in reversed(path):
+                d += 1
+                depths[node] = d
+        depth = max([depth] + list(depths.values()))
+    return load, depth
+
+
+def throughput(load, origins):
+    """
+
+    :return: Throughput for the worst origin and the mean throughput of the origins.
+    """
+    busiest = max(load.values())
+    rates = [1 / max(busiest, load[origin] + 1) for origin in origins]
+    return min(rates), sum(rates) / len(rates)
+
+
+def report(stripes, trees, origins, churned=None):
+    load, depth = loads(trees)
+    values = list(load.values())
+    line = '%8d %10.2f %12.3f %10.3f %10.3f %11.1f%% %6d' % (
+        stripes, max(values), 1 / max(values), *throughput(load, origins), 100 * sum(1 for value in values if value > 0) / len(values),
+        depth)
+    if churned is not None:
+        churned_load, _ = loads(churned)
+        line += ' %12.3f' % throughput(churned_load, [origin for origin in origins if origin in churned_load])[1]
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=1000)
+    parser.add_argument('--stripes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--churn', type=float, default=0.1, help='fraction of the peers which leave')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    # NetworkGraph and StripedTrees log every change
+    logging.disable(logging.WARNING)
+
+    random.seed(args.seed)
+    addresses = [peer_address(i) for i in range(args.peers)]
+    leaving = random.sample(addresses, int(args.churn * args.peers))
+
+    print('%8s %10s %12s %10s %10s %12s %6s %12s' % ('stripes', 'max load', 'free origin', 'worst', 'mean',
+                                                     'uploading', 'depth', 'after churn'))
+    for stripes in args.stripes:
+        if stripes == 1:
+            report(stripes, graph_trees(addresses), addresses)
+            continue
+        trees = StripedTrees(ROOT_ADDRESS, stripes)
+        for address in addresses:
+            trees.add(address)
+        before = [dict(parents) for parents in trees.parents]
+        for address in leaving:
+            trees.remove(address)
+        report(stripes, before, addresses, churned=trees.parents)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+    Hops and routing table memory of Unicast packets.
+
+    Builds the NetworkGraph tree of 'peers' peers like the root does and fills the RoutingTable of every peer like
+    the Reunion Hellos do in the steady state (a route for every peer of its sub-tree). Then Unicast packets between
+    random pairs of peers are routed like Peer does: to the destination if it is a neighbour, to the child of the
+    route, otherwise up to the parent.
+
+    The report shows the mean and maximum hops (a broadcast sends peers - 1 packets), the depth of the tree, the
+    routes of the root and the mean routes of a peer, and the memory of the tables (measured with tracemalloc) per
+    route, for the root and per peer.
+
+    Usage:
+        python -m benchmarks.unicast_routing --peers 1000 10000 100000
+"""
+import argparse
+import gc
+import logging
+import random
+import tracemalloc
+
+from tools.NetworkGraph import NetworkGraph
+from tools.PeerAddress import PeerAddress
+from tools.RoutingTable import RoutingTable
+
+ROOT_ADDRESS = ('127.000.000.001', '05000')
+BATCH = 500
+
+
+def peer_address(i):
+    return PeerAddress.get(('010.%03d.%03d.%03d' % (i // 65536 % 256, i // 256 % 256, i % 256), '05000'))
+
+
+def fill_tables(graph):
+    """
+
+    :return: {address: RoutingTable} with a route for every peer of the sub-tree.
+    """
+    tables = {address: RoutingTable() for address in graph.nodes}
+    for address, node in graph.nodes.items():
+        child = node
+        while child.parent is not None:
+            tables[child.parent.address].learn(address, child.address)
+            child = child.parent
+    return tables
+
+
+def route(graph, tables, source, destination):
+    """
+
+    :return: Number of hops from the source to the destination.
+    """
+    hops = 0
+    address = source
+    while address != destination:
+        node = graph.nodes[address]
+        neighbours = [child.address for child in node.children]
+        if destination in neighbours or (node.parent is not None and destination == node.parent.address):
+            address = destination
+        else:
+            next_hop = tables[address].lookup(destination)
+            address = next_hop if next_hop is not None else node.parent.address
+        hops += 1
+    return hops
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--pairs', type=int, default=2000)
+    args = parser.parse_args()
+    # NetworkGraph logs every new node
+    logging.disable(logging.WARNING)
+    random.seed(1)
+
+    print('%8s %9s %9s %6s %12s %12s %10s %12s %12s' % ('peers', 'mean hops', 'max hops', 'depth', 'root routes',
+                                                         'peer routes', 'B/route', 'root KB', 'B/peer'))
+    for peers in args.peers:
+        graph = NetworkGraph(ROOT_ADDRESS)
+        addresses = [peer_address(i) for i in range(peers)]
+        for i in range(0, peers, BATCH):
+            graph.place_nodes(addresses[i:(i + BATCH)])
+
+        gc.collect()
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        tables = fill_tables(graph)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        root_table = tables[graph.root.address]
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        copy = RoutingTable()
+        copy.routes = dict(root_table.routes)
+        root_size = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        del copy
+
+        routes = sum(len(table) for table in tables.values())
+        hops = [route(graph, tables, *random.sample(addresses, 2)) for _ in range(args.pairs)]
+        print('%8d %9.1f %9d %6d %12d %12.1f %10.1f %12.0f %12.0f' % (
+            peers, sum(hops) / len(hops), max(hops), max(graph.node_depth.values()), len(root_table),
+            routes / len(tables), size / routes, root_size / 1024, size / len(tables)))
+
+
+if __name__ == '__main__':
+    main()
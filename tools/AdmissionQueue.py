@@ -0,0 +1,136 @@
+import collections
+import time
+import unittest
+
+import logging
+
+logging.basicConfig(format='%(asctime)s %(message)s')
+
+
+class AdmissionQueue:
+    def __init__(self, rate=100, burst=200, max_size=100000, clock=time.time):
+        """
+        The AdmissionQueue object constructor.
+
+        Root puts Register and Advertise Request packets in this queue and admits them with a token bucket, so a
+        storm of requests (e.g. after a large partition heals) can not starve the Reunion packets.
+
+        :param rate: Number of admitted packets per second.
+        :param burst: Maximum number of tokens in the bucket.
+        :param max_size: Maximum number of waiting packets; The oldest packets will be dropped after this.
+        :param clock: Function which returns the current time in seconds.
+
+        :type rate: float
+        :type burst: int
+        :type max_size: int
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+        self.clock = clock
+
+        self.tokens = burst
+        self.last_refill_time = clock()
+
+        # recovering peers (e.g. after a Reunion failure) are admitted before new peers
+        self.priority_queue = collections.deque()
+        self.queue = collections.deque()
+
+    def __len__(self):
+        return len(self.priority_queue) + len(self.queue)
+
+    def put(self, packet, priority=False):
+        """
+        Add the packet to the end of the queue.
+
+        :param packet: Register or Advertise Request packet.
+        :param priority: Whether is the packet from a recovering peer or not.
+
+        :type priority: bool
+
+        :return:
+        """
+        if priority:
+            self.priority_queue.append(packet)
+        else:
+            self.queue.append(packet)
+        if len(self) > self.max_size:
+            dropped = self.queue.popleft() if len(self.queue) > 0 else self.priority_queue.popleft()
+            logging.warning('admission queue is full, dropped packet from: ' +
+                            str(dropped.get_source_server_address()))
+
+    def take(self):
+        """
+        Refill the bucket and pop as many packets as we have tokens.
+
+        :return: Admitted packets in order; priority packets first.
+        :rtype: list
+        """
+        t = self.clock()
+        self.tokens = min(self.burst, self.tokens + (t - self.last_refill_time) * self.rate)
+        self.last_refill_time = t
+
+        admitted = []
+        while self.tokens >= 1 and len(self) > 0:
+            if len(self.priority_queue) > 0:
+                admitted.append(self.priority_queue.popleft())
+            else:
+                admitted.append(self.queue.popleft())
+            self.tokens -= 1
+        return admitted
+
+
+class TestAdmissionQueue(unittest.TestCase):
+
+    class Packet:
+        def __init__(self, name):
+            self.name = name
+
+        def get_source_server_address(self):
+            return self.name
+
+    @staticmethod
+    def names(packets):
+        return [packet.name for packet in packets]
+
+    def test_refill_and_burst(self):
+        t = [0]
+        queue = AdmissionQueue(rate=2, burst=3, clock=lambda: t[0])
+        for i in range(10):
+            queue.put(self.Packet(i))
+        self.assertEqual(self.names(queue.take()), [0, 1, 2])
+        self.assertEqual(queue.take(), [])
+        t[0] = 1
+        self.assertEqual(self.names(queue.take()), [3, 4])
+        t[0] = 1.25
+        self.assertEqual(queue.take(), [])
+        t[0] = 1.5
+        self.assertEqual(self.names(queue.take()), [5])
+        # the bucket holds at most burst tokens
+        t[0] = 100
+        self.assertEqual(self.names(queue.take()), [6, 7, 8])
+        self.assertEqual(len(queue), 1)
+
+    def test_priority(self):
+        t = [0]
+        queue = AdmissionQueue(rate=1, burst=2, clock=lambda: t[0])
+        queue.put(self.Packet('new 1'))
+        queue.put(self.Packet('new 2'))
+        queue.put(self.Packet('recovering 1'), priority=True)
+        queue.put(self.Packet('recovering 2'), priority=True)
+        self.assertEqual(self.names(queue.take()), ['recovering 1', 'recovering 2'])
+        t[0] = 2
+        self.assertEqual(self.names(queue.take()), ['new 1', 'new 2'])
+
+    def test_max_size(self):
+        t = [0]
+        queue = AdmissionQueue(rate=1, burst=10, max_size=3, clock=lambda: t[0])
+        queue.put(self.Packet('recovering'), priority=True)
+        for i in range(4):
+            queue.put(self.Packet(i))
+        # the oldest normal packets are dropped first
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(self.names(queue.take()), ['recovering', 2, 3])
+        for i in range(4):
+            queue.put(self.Packet('recovering %d' % i), priority=True)
+        self.assertEqual(self.names(queue.take()), ['recovering 1', 'recovering 2', 'recovering 3'])
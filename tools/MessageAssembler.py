@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import logging
+
+logging.basicConfig(format='%(asctime)s %(message)s')
+
+
+class MessageAssembler:
+    def __init__(self, directory=None, max_message_size=256 * 1024 * 1024, max_messages=16, timeout=60,
+                 clock=time.time):
+        """
+        The MessageAssembler object constructor.
+
+        Puts the Fragment packets of large broadcast messages together. Every fragment is written at its offset as it
+        arrives, so a message is never copied or kept as a list of fragments: with a directory every message is
+        written to its own file and only the offsets of the received fragments are in memory, otherwise the
+        message is a bytearray of its size.
+
+        :param directory: The directory for the message files; If it is None messages are kept in memory.
+        :param max_message_size: Bigger messages will be ignored.
+        :param max_messages: Maximum number of incomplete messages; The oldest one will be dropped after this.
+        :param timeout: An incomplete message will be dropped when no fragment of it arrives for 'timeout' seconds.
+        :param clock: Function which returns the current time in seconds.
+
+        :type directory: str
+        :type max_message_size: int
+        :type max_messages: int
+        :type timeout: float
+        """
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.max_message_size = max_message_size
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self.clock = clock
+
+        # {message ID: [message size, bytearray or file, offsets of the received fragments, received bytes,
+        #               last fragment time]}; dicts keep the insertion order, the oldest message is the first one
+        self.messages = {}
+        # recently completed or dropped messages, their late fragments will be ignored
+        self.finished = set()
+
+    def get_path(self, message_id):
+        return os.path.join(self.directory, '%016x' % message_id)
+
+    def add(self, message_id, message_size, offset, data):
+        """
+        Write a fragment in its message.
+
+        :param message_id: ID of the message.
+        :param message_size: Number of bytes in the whole message.
+        :param offset: Offset of the data in the message.
+        :param data: The fragment data.
+
+        :type message_id: int
+        :type message_size: int
+        :type offset: int
+        :type data: bytes
+
+        :return: The whole message (bytes, or the path of its file if we have a directory) if this was its last
+                 fragment, otherwise None.
+        """
+        if message_id in self.finished:
+            return None
+        message = self.messages.get(message_id)
+        if message is None:
+            if message_size > self.max_message_size:
+                logging.warning('message %016x is too big: %d bytes' % (message_id, message_size))
+                self.__finish(message_id)
+                return None
+            if len(self.messages) >= self.max_messages:
+                oldest = next(iter(self.messages))
+                logging.warning('too many incomplete messages, message %016x dropped' % oldest)
+                self.__drop(oldest)
+            if self.directory is None:
+                content = bytearray(message_size)
+            else:
+                content = open(self.get_path(message_id), 'w+b')
+            message = [message_size, content, set(), 0, 0]
+            self.messages[message_id] = message
+        if message[0] != message_size or offset in message[2]:
+            return None
+
+        if self.directory is None:
+            message[1][offset:(offset + len(data))] = data
+        else:
+            message[1].seek(offset)
+            message[1].write(data)
+        message[2].add(offset)
+        message[3] += len(data)
+        message[4] = self.clock()
+        if message[3] < message_size:
+            return None
+
+        self.messages.pop(message_id)
+        self.__finish(message_id)
+        if self.directory is None:
+            return bytes(message[1])
+        message[1].close()
+        return self.get_path(message_id)
+
+    def expire(self):
+        """
+        Drop the incomplete messages which have timed out.
+
+        :return:
+        """
+        t = self.clock()
+        for message_id in [message_id for message_id, message in self.messages.items()
+                           if t - message[4] > self.timeout]:
+            logging.warning('message %016x timed out' % message_id)
+            self.__drop(message_id)
+
+    def __drop(self, message_id):
+        message = self.messages.pop(message_id)
+        self.__finish(message_id)
+        if self.directory is not None:
+            message[1].close()
+            os.remove(self.get_path(message_id))
+
+    def __finish(self, message_id):
+        if len(self.finished) >= 4096:
+            self.finished.clear()
+        self.finished.add(message_id)
+
+
+class TestMessageAssembler(unittest.TestCase):
+    message = bytes(range(256)) * 40
+
+    def fragments(self, size=1000):
+        return [(offset, self.message[offset:(offset + size)]) for offset in range(0, len(self.message), size)]
+
+    def test_memory(self):
+        assembler = MessageAssembler()
+        fragments = self.fragments()
+        # out of order and duplicated fragments
+        for offset, data in reversed(fragments[1:]):
+            self.assertIsNone(assembler.add(7, len(self.message), offset, data))
+        self.assertIsNone(assembler.add(7, len(self.message), *fragments[1]))
+        self.assertEqual(assembler.add(7, len(self.message), *fragments[0]), self.message)
+        self.assertIsNone(assembler.add(7, len(self.message), *fragments[0]))
+        self.assertEqual(assembler.messages, {})
+
+    def test_directory(self):
+        directory = tempfile.mkdtemp()
+        try:
+            t = [0]
+            assembler = MessageAssembler(directory, timeout=10, clock=lambda: t[0])
+            for offset, data in self.fragments():
+                path = assembler.add(1, len(self.message), offset, data)
+            with open(path, 'rb') as message:
+                self.assertEqual(message.read(), self.message)
+
+            assembler.add(2, len(self.message), *self.fragments()[0])
+            t[0] = 11
+            assembler.expire()
+            self.assertEqual(os.listdir(directory), ['%016x' % 1])
+            self.assertIsNone(assembler.add(2, len(self.message), *self.fragments()[1]))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,157 @@
+import collections
+import mmap
+import struct
+import time
+import unittest
+
+
+class MessageHistory:
+    # origin IP/Port, sequence number and length of a record
+    record_struct = struct.Struct('>6sQH')
+
+    def __init__(self, capacity=1024 * 1024, path=None, max_origins=4096, clock=time.time):
+        """
+        The MessageHistory object constructor.
+
+        A ring of the recent broadcast messages in a memory-mapped buffer of 'capacity' bytes; A new message
+        overwrites the oldest ones when the ring is full. Every message has an ID, the IP/Port of its origin and a
+        sequence number which only grows for every origin, so we also know the last message of every origin that we
+        have seen: a peer sends them in its Join and its new parent sends back the newer messages of the ring.
+
+        :param capacity: Size of the ring in bytes; With 0 no message is kept, only the last message IDs.
+        :param path: The file of the ring; If it is None the ring is in anonymous memory.
+        :param max_origins: Maximum number of origins which we keep their last sequence number; The origin which
+                            has sent nothing for the longest time will be forgotten after this.
+        :param clock: Function which returns the current time in seconds.
+
+        :type capacity: int
+        :type path: str
+        :type max_origins: int
+        :type clock: function
+        """
+        self.capacity = capacity
+        if capacity == 0:
+            self.buffer = None
+        elif path is None:
+            self.buffer = mmap.mmap(-1, capacity)
+        else:
+            with open(path, 'w+b') as ring:
+                ring.truncate(capacity)
+                self.buffer = mmap.mmap(ring.fileno(), capacity)
+        self.max_origins = max_origins
+        # (offset, size, origin, sequence) of the records in the ring, the oldest one is the first
+        self.records = collections.deque()
+        self.tail = 0
+        # {origin: last sequence number}, the origin which has sent a message most recently is the last one
+        self.last_seen = collections.OrderedDict()
+        # our own sequence numbers start from the time, so they still grow after a restart
+        self.sequence = int(clock() * 1000000)
+
+    def __len__(self):
+        return len(self.records)
+
+    def next_sequence(self):
+        self.sequence += 1
+        return self.sequence
+
+    def add(self, origin, sequence, body):
+        """
+        Put a message in the ring if it is newer than the last message of its origin.
+
+        :param origin: The origin of the message.
+        :param sequence: Sequence number of the message.
+        :param body: The message; It is kept as it is (e.g. compressed).
+
+        :type origin: PeerAddress
+        :type sequence: int
+        :type body: bytes
+
+        :return: Whether the message is new.
+        :rtype: bool
+        """
+        if sequence <= self.last_seen.get(origin, -1):
+            return False
+        self.last_seen[origin] = sequence
+        self.last_seen.move_to_end(origin)
+        if len(self.last_seen) > self.max_origins:
+            self.last_seen.popitem(last=False)
+
+        size = self.record_struct.size + len(body)
+        if size > self.capacity or len(body) > 0xffff:
+            return True
+        if self.tail + size > self.capacity:
+            # the records of the previous round at the end of the ring are the oldest ones
+            while len(self.records) > 0 and self.records[0][0] >= self.tail:
+                self.records.popleft()
+            self.tail = 0
+        # the oldest records are just after the tail
+        while len(self.records) > 0 and self.tail <= self.records[0][0] < self.tail + size:
+            self.records.popleft()
+        self.record_struct.pack_into(self.buffer, self.tail, origin.packed, sequence, len(body))
+        self.buffer[(self.tail + self.record_struct.size):(self.tail + size)] = body
+        self.records.append((self.tail, size, origin, sequence))
+        self.tail += size
+        return True
+
+    def get_last_seen(self, limit=None):
+        """
+        :param limit: Maximum number of origins.
+        :type limit: int
+
+        :return: {origin: last sequence number} of the origins which have sent a message most recently.
+        :rtype: dict
+        """
+        items = list(self.last_seen.items())
+        if limit is not None:
+            items = items[-limit:]
+        return dict(items)
+
+    def get_after(self, last_seen):
+        """
+        The messages of the ring which are newer than 'last_seen'; For an origin which is not in it every message.
+
+        :param last_seen: {origin: last sequence number} of a peer.
+        :type last_seen: dict
+
+        :return: List of (origin, sequence, body) from the oldest message.
+        :rtype: list
+        """
+        messages = []
+        for offset, size, origin, sequence in self.records:
+            if sequence > last_seen.get(origin, -1):
+                messages.append((origin, sequence, bytes(self.buffer[(offset + self.record_struct.size):
+                                                                     (offset + size)])))
+        return messages
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+
+
+class TestMessageHistory(unittest.TestCase):
+
+    def test_ring(self):
+        from tools.PeerAddress import PeerAddress
+        a = PeerAddress.from_text('010.000.000.001', '05000')
+        b = PeerAddress.from_text('010.000.000.002', '05000')
+        history = MessageHistory(capacity=100)
+        self.assertTrue(history.add(a, 1, b'x' * 20))
+        self.assertFalse(history.add(a, 1, b'x' * 20))
+        self.assertTrue(history.add(b, 7, b'y' * 20))
+        self.assertTrue(history.add(a, 2, b'z' * 20))
+        # the ring is full, the first message is overwritten
+        self.assertEqual([(origin, sequence) for origin, sequence, _ in history.get_after({})], [(b, 7), (a, 2)])
+        self.assertEqual(history.get_after({a: 1, b: 7}), [(a, 2, b'z' * 20)])
+        self.assertEqual(history.get_last_seen(limit=1), {a: 2})
+        for sequence in range(3, 100):
+            history.add(a, sequence, b'w' * (sequence % 30))
+        # the records in the ring never overlap
+        records = sorted(history.records)
+        self.assertTrue(all(x[0] + x[1] <= y[0] for x, y in zip(records, records[1:])))
+        self.assertTrue(all(body == b'w' * (sequence % 30) for _, sequence, body in history.get_after({})))
+        history.close()
+        # only the last message IDs
+        history = MessageHistory(capacity=0)
+        self.assertTrue(history.add(a, 1, b'x'))
+        self.assertFalse(history.add(a, 1, b'x'))
+        self.assertEqual(history.get_after({}), [])
@@ -1,13 +1,19 @@
+import heapq
+import itertools
 import time
 import unittest
 import warnings
 
+from tools.PeerAddress import PeerAddress
+
 import logging
 
 logging.basicConfig(format='%(asctime)s %(message)s')
 
 
 class GraphNode:
+    __slots__ = ('address', 'children', 'parent', 'alive')
+
     def __init__(self, address):
         """
 
@@ -15,7 +21,7 @@ class GraphNode:
         :type address: tuple
 
         """
-        self.address = address
+        self.address = PeerAddress.get(address)
         self.children = []
         self.parent = None
         self.alive = True
@@ -24,7 +30,7 @@ class GraphNode:
         self.parent = parent
 
     def set_address(self, new_address):
-        self.address = new_address
+        self.address = PeerAddress.get(new_address)
 
     def __reset(self):
         # not sure
@@ -40,12 +46,142 @@ class NetworkGraph:
     def __init__(self, root_address):
         root = GraphNode(root_address)
         self.root = root
-        self.nodes = [root]
+        # dict, {address: GraphNode}
+        self.nodes = {root.address: root}
         # for each address it's {address: depth}
-        self.node_depth = {root_address: 0}
+        self.node_depth = {root.address: 0}
+        # functions which will be called with (operation, address, argument) after every change in the graph
+        self.listeners = []
+        # the live nodes which have a free slot in BFS order, until the graph changes; The root looks for a backup
+        # parent at every Reunion Hello
+        self._free_slots = None
 
     def get_node_depth(self, address):
-        return self.node_depth[address]
+        return self.node_depth[PeerAddress.get(address)]
+
+    def add_listener(self, listener):
+        """
+        Add a function that will be called after every change in our NetworkGraph; e.g. for replicating the graph in a
+        standby root.
+
+        The operations are:
+            ('add', address, father_address)
+            ('remove', address, None)
+            ('move', address, father_address)
+            ('on', address, sub_tree)
+            ('off', address, sub_tree)
+
+        :param listener: function(operation, address, argument)
+
+        :return:
+        """
+        self.listeners.append(listener)
+
+    def __record(self, operation, address, argument=None):
+        for listener in self.listeners:
+            listener(operation, address, argument)
+
+    def apply(self, operation, address, argument=None):
+        """
+        Do an operation which a listener of another NetworkGraph has received.
+
+        :param operation: One of the operations in add_listener.
+        :param address: Node address.
+        :param argument: Father address or sub_tree flag.
+
+        :return:
+        """
+        if operation == 'add':
+            self.add_node(address[0], address[1], argument)
+        elif operation == 'remove':
+            if self.find_node(address[0], address[1]) is not None:
+                self.remove_node(address)
+        elif operation == 'move':
+            self.move_node(address, argument)
+        elif operation == 'on':
+            self.turn_on_node(address, sub_tree=argument)
+        elif operation == 'off':
+            self.turn_off_node(address, sub_tree=argument)
+        else:
+            logging.warning('undefined graph operation: ' + str(operation))
+
+    def get_operations(self):
+        """
+        The operations that will make our NetworkGraph from an empty NetworkGraph with the same root; Parents come
+        before their children.
+
+        Warnings:
+            1. The sub-trees of removed nodes are not connected to the root and will not be in the operations.
+
+        :return: List of (operation, address, argument).
+        :rtype: list
+        """
+        operations = []
+        off_operations = []
+        to_visit = [self.root]
+        for node in to_visit:
+            if node is not self.root:
+                operations.append(('add', node.address, node.parent.address))
+            if not node.alive:
+                off_operations.append(('off', node.address, False))
+            to_visit.extend(node.children)
+        return operations + off_operations
+
+    def get_nodes(self):
+        """
+        Compact form of our NetworkGraph for load_nodes; Parents come before their children.
+
+        Warnings:
+            1. The sub-trees of removed nodes are not connected to the root and will not be in the nodes.
+
+        :return: List of (address, parent_index, alive); parent_index is 0 for the root and i for the i-th node.
+        :rtype: list
+        """
+        nodes = []
+        index = {self.root: 0}
+        to_visit = list(self.root.children)
+        for node in to_visit:
+            nodes.append((node.address, index[node.parent], node.alive))
+            index[node] = len(nodes)
+            to_visit.extend(node.children)
+        return nodes
+
+    def load_nodes(self, nodes):
+        """
+        Add many nodes at once (e.g. from a RootJournal snapshot); It is much faster than add_node and the listeners
+        will not be called.
+
+        :param nodes: Iterable of (address, parent_index, alive) like get_nodes.
+        :type nodes: iterable
+
+        :return:
+        """
+        graph_nodes = [self.root]
+        for address, parent_index, alive in nodes:
+            parent = graph_nodes[parent_index]
+            node = GraphNode(address)
+            node.alive = alive
+            node.set_parent(parent)
+            parent.add_child(node)
+            graph_nodes.append(node)
+            self.nodes[node.address] = node
+            self.node_depth[node.address] = self.node_depth[parent.address] + 1
+        self._free_slots = None
+
+    def set_root_address(self, root_address):
+        """
+        Change the address of our root; A standby root uses it when it takes over the network.
+
+        :param root_address: New address of the root.
+        :type root_address: tuple
+
+        :return:
+        """
+        self.nodes.pop(self.root.address)
+        self.node_depth.pop(self.root.address)
+        self.root.set_address(root_address)
+        self.nodes[self.root.address] = self.root
+        self.node_depth[self.root.address] = 0
 
     def find_live_node(self, sender):
         """
@@ -65,56 +201,202 @@ class NetworkGraph:
         :return: Best neighbour for sender.
         :rtype: GraphNode
         """
+        if self._free_slots is None:
+            self._free_slots = []
+            to_visit = [self.root]
+            for node in to_visit:
+                # when the node is off, we won't advertise its children
+                if not node.alive:
+                    continue
+                if len(node.children) < 2:
+                    self._free_slots.append(node)
+                to_visit.extend(node.children)
+        sender_node = self.nodes.get(PeerAddress.get(sender))
+        for node in self._free_slots:
+            if sender_node is None or not self.__is_in_sub_tree(node, sender_node):
+                return node
+        return None
+
+    def find_backup_node(self, address):
+        """
+        Here we should find a backup parent for the node with 'address', so it can rejoin the network by itself
+        when its current parent fails.
+
+        Ranking:
+            1. The grandparent; It gets back the slot of the failed parent but only the first child can take it.
+            2. A live uncle (the parent's sibling) who has a free slot.
+            3. Best live node out of the parent sub-tree (like find_live_node).
+
+        Warnings:
+            1. Never return a node in the parent sub-tree; they will be disconnected with the parent.
+
+        :param address: The node address we want to find backup parent for it.
+        :type address: tuple
+
+        :return: Backup parent for the node or None.
+        :rtype: GraphNode
+        """
+        node = self.find_node(address[0], address[1])
+        if node is None or node.parent is None:
+            return None
+        parent = node.parent
+        grandparent = parent.parent
+        if grandparent is not None:
+            if grandparent.alive and parent.children[0] is node:
+                return grandparent
+            for uncle in grandparent.children:
+                if uncle is not parent and uncle.alive and len(uncle.children) < 2:
+                    return uncle
+        return self.find_live_node(parent.address)
+
+    def place_nodes(self, senders):
+        """
+        Find the best neighbours for a batch of senders with a single BFS and attach every sender to its neighbour.
+        It is the same as find_live_node for each sender (plus attaching) when a storm of Advertise Requests arrives.
+
+        Warnings:
+            1. A sender which exists in our NetworkGraph will be turned on (with its sub-tree) and moved, its
+               neighbour is never in its own sub-tree.
+
+        :param senders: Addresses of the senders in the order of arrival.
+        :type senders: list
+
+        :return: Neighbour of each sender (None if there is no neighbour for it).
+        :rtype: list
+        """
+        # heap of the live nodes who have a free slot, nearest the root first
+        slots = []
+        order = itertools.count()
         to_visit = [self.root]
-        visited = set()
-        while len(to_visit) > 0:
-            node = to_visit[0]
-            to_visit = to_visit[1:]
-            if node.address == sender:
-                visited.add(node)
-                continue
+        for node in to_visit:
             # when the node is off, we won't advertise its children
             if not node.alive:
-                visited.add(node)
                 continue
             if len(node.children) < 2:
-                return node
-            visited.add(node)
-            for child in node.children:
-                if child not in visited:
-                    to_visit.append(child)
-        return None
+                slots.append((self.node_depth[node.address], next(order), node))
+            to_visit.extend(node.children)
+        heapq.heapify(slots)
+
+        neighbours = []
+        for sender in senders:
+            sender = PeerAddress.get(sender)
+            sender_node = self.nodes.get(sender)
+            neighbour = None
+            skipped = []
+            while len(slots) > 0:
+                item = heapq.heappop(slots)
+                candidate = item[2]
+                if len(candidate.children) >= 2 or candidate.address not in self.nodes:
+                    continue
+                if sender_node is not None and self.__is_in_sub_tree(candidate, sender_node):
+                    skipped.append(item)
+                    continue
+                neighbour = candidate
+                # keep its place in the BFS order for its next free slot
+                skipped.append(item)
+                break
+            for item in skipped:
+                heapq.heappush(slots, item)
+            neighbours.append(neighbour)
+            if neighbour is None:
+                logging.warning('There is no neighbour node for the sender: ' + str(sender))
+                continue
+
+            if sender_node is None:
+                self.add_node(sender[0], sender[1], neighbour.address)
+                sender_node = self.nodes[sender]
+            else:
+                old_parent = sender_node.parent
+                self.turn_on_node(sender, sub_tree=True)
+                self.move_node(sender, neighbour.address)
+                if old_parent is not None and old_parent.alive and old_parent is not neighbour:
+                    heapq.heappush(slots, (self.node_depth[old_parent.address], next(order), old_parent))
+            if len(sender_node.children) < 2:
+                heapq.heappush(slots, (self.node_depth[sender], next(order), sender_node))
+        return neighbours
+
+    @staticmethod
+    def __is_in_sub_tree(node, sub_tree_root):
+        while node is not None:
+            if node is sub_tree_root:
+                return True
+            node = node.parent
+        return False
 
     def find_node(self, ip, port):
-        address = (ip, port)
-        for node in self.nodes:
-            if node.address == address:
-                return node
-        return None
+        return self.nodes.get(PeerAddress.from_text(ip, port))
 
     def turn_on_node(self, node_address, sub_tree=False):
         node = self.find_node(node_address[0], node_address[1])
-        node.alive = True
-        if sub_tree:
-            for child in node.children:
-                self.turn_on_node(child.address, sub_tree=True)
+        if node is None:
+            logging.warning('Wants to turn on a non-existing node with address: ' + str(node_address))
+            return
+        self.__set_alive(node, True, sub_tree)
+        self.__record('on', node_address, sub_tree)
 
     def turn_off_node(self, node_address, sub_tree=False):
         node = self.find_node(node_address[0], node_address[1])
-        node.alive = False
+        self.__set_alive(node, False, sub_tree)
+        self.__record('off', node_address, sub_tree)
+
+    def __set_alive(self, node, alive, sub_tree):
+        if node.alive != alive:
+            self._free_slots = None
+        node.alive = alive
         if sub_tree:
             for child in node.children:
-                self.turn_off_node(child.address, sub_tree=True)
+                self.__set_alive(child, alive, sub_tree=True)
 
     def remove_node(self, node_address):
         # remove the node and turn off its subtree
         node = self.find_node(node_address[0], node_address[1])
         if node.parent is not None:
             node.parent.children.remove(node)
+        self.__set_alive(node, False, sub_tree=True)
         for child in node.children:
             child.set_parent(None)
-        self.turn_off_node(node_address, sub_tree=True)
-        self.nodes.remove(node)
+        self.nodes.pop(node.address)
+        self._free_slots = None
+        self.__record('remove', node_address)
+
+    def move_node(self, node_address, father_address):
+        """
+        Move the node (with its sub-tree) under the node with father_address.
+        Root calls it when a peer has rejoined the network through its backup parent.
+
+        Warnings:
+            1. The father comes from the path of a Reunion Hello; A father in the sub-tree of the node would make a
+               cycle, so the move is ignored.
+
+        :param node_address: Address of the node we want to move.
+        :param father_address: Address of the new father.
+
+        :type node_address: tuple
+        :type father_address: tuple
+
+        :return:
+        """
+        node = self.find_node(node_address[0], node_address[1])
+        father_node = self.find_node(father_address[0], father_address[1])
+        if node is None or father_node is None:
+            logging.warning('Wants to move a non-existing node: ' + str(node_address) + ' ' + str(father_address))
+            return
+        if self.__is_in_sub_tree(father_node, node):
+            logging.warning('Wants to move a node into its own sub-tree: ' + str(node_address) + ' ' +
+                            str(father_address))
+            return
+        if node.parent is not None:
+            node.parent.children.remove(node)
+        node.set_parent(father_node)
+        father_node.add_child(node)
+        self.__update_depth(node, self.node_depth[father_node.address] + 1)
+        self._free_slots = None
+        self.__record('move', node_address, father_address)
+
+    def __update_depth(self, node, depth):
+        self.node_depth[node.address] = depth
+        for child in node.children:
+            self.__update_depth(child, depth + 1)
 
     # def remove_subtree(self, node):
     #     for child in node.children:
@@ -147,8 +429,10 @@ class NetworkGraph:
             node = GraphNode(address=(ip, port))
             node.set_parent(father_node)
             father_node.add_child(node)
-            self.nodes.append(node)
-            self.node_depth[(ip, port)] = self.node_depth[father_address] + 1
+            self.nodes[node.address] = node
+            self.node_depth[node.address] = self.node_depth[father_node.address] + 1
+            self._free_slots = None
+            self.__record('add', node.address, father_node.address)
         else:
             logging.warning('Wants to add an existing node with address: ' + str(ip) + " " + str(port))
 
@@ -167,19 +451,28 @@ class TestNetworkGraph(unittest.TestCase):
     def test_find_live_node_one(self):
         ng = self.initiate()
         node = ng.find_live_node(('192.168.1.6', "125"))
-        self.assertEqual(node.address, ('192.168.1.3', "125"))
+        self.assertEqual(node.address, PeerAddress.get(('192.168.1.3', "125")))
 
     def test_find_live_node_two(self):
         ng = self.initiate()
         node = ng.find_live_node(('192.168.1.3', "125"))
-        self.assertEqual(node.address, ('192.168.1.4', "125"))
+        self.assertEqual(node.address, PeerAddress.get(('192.168.1.4', "125")))
 
     def test_find_live_node_three(self):
         ng = self.initiate()
         ng.turn_off_node(('192.168.1.2', "125"))
         ng.remove_node(('192.168.1.3', "125"))
         node = ng.find_live_node(('192.168.1.6', "125"))
-        self.assertEqual(node.address, ('192.168.1.1', "2005"))
+        self.assertEqual(node.address, PeerAddress.get(('192.168.1.1', "2005")))
+
+    def test_find_live_node_after_change(self):
+        ng = self.initiate()
+        self.assertEqual(ng.find_live_node(('192.168.1.6', "125")).address, PeerAddress.get(('192.168.1.3', "125")))
+        ng.add_node(ip='192.168.1.6', port="125", father_address=('192.168.1.3', "125"))
+        ng.add_node(ip='192.168.1.7', port="125", father_address=('192.168.1.3', "125"))
+        self.assertEqual(ng.find_live_node(('192.168.1.8', "125")).address, PeerAddress.get(('192.168.1.4', "125")))
+        ng.turn_off_node(('192.168.1.2', "125"))
+        self.assertEqual(ng.find_live_node(('192.168.1.8', "125")).address, PeerAddress.get(('192.168.1.6', "125")))
 
     def test_remove_node(self):
         ng = self.initiate()
@@ -187,3 +480,60 @@ class TestNetworkGraph(unittest.TestCase):
         self.assertEqual(ng.find_node('192.168.1.2', "125"), None)
         self.assertEqual(ng.find_node('192.168.1.4', "125").alive, False)
         self.assertEqual(ng.find_node('192.168.1.5', "125").alive, False)
+
+    def test_find_backup_node(self):
+        ng = self.initiate()
+        ng.add_node(ip='192.168.1.6', port="125", father_address=('192.168.1.4', "125"))
+        ng.add_node(ip='192.168.1.7', port="125", father_address=('192.168.1.4', "125"))
+        # the first child takes the grandparent, the second one takes an uncle with free slot
+        self.assertEqual(ng.find_backup_node(('192.168.1.6', "125")).address, PeerAddress.get(('192.168.1.2', "125")))
+        self.assertEqual(ng.find_backup_node(('192.168.1.7', "125")).address, PeerAddress.get(('192.168.1.5', "125")))
+        # children of the root have no backup
+        self.assertEqual(ng.find_backup_node(('192.168.1.2', "125")), None)
+
+    def test_move_node(self):
+        ng = self.initiate()
+        ng.move_node(('192.168.1.4', "125"), ('192.168.1.3', "125"))
+        self.assertEqual(ng.find_node('192.168.1.4', "125").parent.address, PeerAddress.get(('192.168.1.3', "125")))
+        self.assertEqual(len(ng.find_node('192.168.1.2', "125").children), 1)
+        self.assertEqual(ng.get_node_depth(('192.168.1.4', "125")), 2)
+        # a node is never moved into its own sub-tree
+        ng.move_node(('192.168.1.3', "125"), ('192.168.1.4', "125"))
+        ng.move_node(('192.168.1.1', "2005"), ('192.168.1.2', "125"))
+        self.assertEqual(ng.find_node('192.168.1.3', "125").parent.address, PeerAddress.get(('192.168.1.1', "2005")))
+        self.assertIsNone(ng.find_node('192.168.1.1', "2005").parent)
+        self.assertEqual(ng.get_node_depth(('192.168.1.4', "125")), 2)
+
+    def test_place_nodes(self):
+        ng = self.initiate()
+        senders = [('192.168.1.6', "125"), ('192.168.1.7', "125"), ('192.168.1.8', "125"), ('192.168.1.2', "125")]
+        neighbours = ng.place_nodes(senders)
+        # same as calling find_live_node and add_node for every sender
+        self.assertEqual([node.address for node in neighbours],
+                         [PeerAddress.get(address) for address in [('192.168.1.3', "125"), ('192.168.1.3', "125"),
+                                                                   ('192.168.1.4', "125"), ('192.168.1.6', "125")]])
+        self.assertEqual(ng.find_node('192.168.1.8', "125").parent.address, PeerAddress.get(('192.168.1.4', "125")))
+        self.assertEqual(ng.get_node_depth(('192.168.1.4', "125")), 4)
+
+    def test_load_nodes(self):
+        ng = self.initiate()
+        ng.turn_off_node(('192.168.1.4', "125"))
+        loaded = NetworkGraph(root_address=('192.168.1.1', "2005"))
+        loaded.load_nodes(ng.get_nodes())
+        self.assertEqual(loaded.get_operations(), ng.get_operations())
+        self.assertEqual(loaded.get_node_depth(('192.168.1.4', "125")), 2)
+
+    def test_listener(self):
+        ng = NetworkGraph(root_address=('192.168.1.1', "2005"))
+        replica = NetworkGraph(root_address=('192.168.1.1', "2005"))
+        ng.add_listener(replica.apply)
+        ng.place_nodes([('192.168.1.%d' % i, "125") for i in range(2, 9)])
+        ng.turn_off_node(('192.168.1.3', "125"), sub_tree=True)
+        ng.remove_node(('192.168.1.2', "125"))
+        self.assertEqual(replica.get_operations(), ng.get_operations())
+        self.assertEqual(replica.find_node('192.168.1.6', "125").alive, False)
+
+        copy = NetworkGraph(root_address=('192.168.1.1', "2005"))
+        for operation in ng.get_operations():
+            copy.apply(*operation)
+        self.assertEqual(copy.get_operations(), ng.get_operations())
@@ -0,0 +1,417 @@
+import collections
+import functools
+import heapq
+import itertools
+import os
+import random
+import tempfile
+import unittest
+
+from Packet import header_struct
+from Peer import Peer
+from tools.PeerAddress import PeerAddress
+from tools.SimulatedStream import SimulatedStream
+
+
+class NetworkSimulator:
+    def __init__(self, latency=0.001, jitter=0.0005, loss=0.0, retransmit_timeout=0.2, seed=0):
+        """
+        The NetworkSimulator object constructor.
+
+        A deterministic discrete-event simulation of a network of real Peer objects: The peers run on our virtual
+        clock without their threads (threads=False) and their Streams are SimulatedStreams, so a message which a
+        Node sends is put in an event queue and arrives in the in_buf of the destination after the latency of the
+        link. The main loop cycle (Peer.run_cycle) of every peer runs every Peer.cycle_interval seconds with a random
+        phase and its reunion daemon (Peer.reunion_cycle) runs when the peer has started it, so the Peer,
+        PacketFactory and NetworkGraph logic is the same as in a real network; A run with the same seed and the same
+        commands gives the same events.
+
+        Every link is a TCP connection: its messages arrive in order and a lost segment is retransmitted after
+        'retransmit_timeout' seconds (doubled for each loss of the same message), so a loss delays the message and
+        the messages behind it. A crashed peer is gone at once: its links are closed (like the RST of its host) and
+        the messages on the way to it are dropped.
+
+        :param latency: One way latency of every link in seconds.
+        :param jitter: A random delay in [0, jitter] seconds is added to the latency of every message.
+        :param loss: Probability that a message is lost once (and retransmitted).
+        :param retransmit_timeout: Seconds.
+        :param seed: Seed of the random generators of the network and the peers.
+
+        :type latency: float
+        :type jitter: float
+        :type loss: float
+        :type retransmit_timeout: float
+        :type seed: int
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.retransmit_timeout = retransmit_timeout
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        # (time, sequence, function, args); the sequence keeps the order of the events at the same time
+        self._events = []
+        self._sequence = itertools.count()
+        # {address: Peer} and the SimulatedStreams of the peers which are up
+        self.peers = {}
+        self.streams = {}
+        self.crashed = set()
+        # {(source, destination): arrival time of the last message of the link}
+        self._link_arrivals = {}
+        # {address: [generation, waiting]} of the started reunion daemons; A scheduled reunion cycle of an older
+        # generation is dropped and a daemon which is waiting (not in its first delay) is woken by a link down
+        self._daemons = {}
+
+        self.events = 0
+        # sent messages by packet type, their bytes and the delivered messages
+        self.sent = collections.Counter()
+        self.sent_bytes = 0
+        self.delivered = 0
+        # {broadcast message: arrival times at the peers} and {(destination, unicast message): arrival times}
+        self.message_times = collections.defaultdict(list)
+        self.unicast_times = collections.defaultdict(list)
+
+    def clock(self):
+        """
+
+        :return: Virtual time in seconds.
+        :rtype: float
+        """
+        return self.now
+
+    def schedule(self, t, function, *args):
+        """
+        Call function(*args) at the virtual time t.
+
+        :return:
+        """
+        heapq.heappush(self._events, (t, next(self._sequence), function, args))
+
+    def run(self, until):
+        """
+        Run the events until the virtual time 'until'.
+
+        :param until: Seconds.
+        :type until: float
+
+        :return:
+        """
+        events = self._events
+        while len(events) > 0 and events[0][0] <= until:
+            t, _, function, args = heapq.heappop(events)
+            self.now = t
+            self.events += 1
+            function(*args)
+        self.now = max(self.now, until)
+
+    def add_peer(self, ip, port, is_root=False, root_address=None, **kwargs):
+        """
+        Make a Peer on the network now; The other keyword arguments are given to Peer. By default the peer has no
+        MessageHistory and no link_timeout, and its broadcast and unicast messages are recorded in message_times and
+        unicast_times.
+
+        :return: The peer.
+        :rtype: Peer
+        """
+        address = PeerAddress.from_text(ip, port)
+        kwargs.setdefault('history_size', 0)
+        # a simulated peer does not hang, a crashed one closes its links at once; So the probes of the idle links
+        # only add traffic
+        kwargs.setdefault('link_timeout', None)
+        kwargs.setdefault('message_callback', functools.partial(self._record_message, address))
+        kwargs.setdefault('unicast_callback', functools.partial(self._record_unicast, address))
+        peer = Peer(ip, port, is_root=is_root, root_address=root_address, unix_directory=None, clock=self.clock,
+                    rng=random.Random(self.rng.getrandbits(64)),
+                    stream_class=functools.partial(SimulatedStream, network=self), threads=False, **kwargs)
+        self.peers[address] = peer
+        self.schedule(self.now + self.rng.uniform(0, peer.cycle_interval), self._run_cycle, address)
+        self._check_daemon(peer)
+        return peer
+
+    def command(self, address, command, at=None):
+        """
+        Put a command (see Peer.handle_user_interface_buffer) in the user interface buffer of the peer.
+
+        :param address: The peer.
+        :param command: The command.
+        :param at: Virtual time, by default now.
+
+        :return:
+        """
+        self.schedule(self.now if at is None else at, self._command, PeerAddress.get(address), command)
+
+    def crash(self, address, at=None):
+        """
+        Crash the peer; It stops and its links are closed.
+
+        :param address: The peer.
+        :param at: Virtual time, by default now.
+
+        :return:
+        """
+        self.schedule(self.now if at is None else at, self._crash, PeerAddress.get(address))
+
+    def listen(self, address, stream):
+        """
+        The SimulatedStream of a peer is up.
+
+        :return:
+        """
+        self.streams[address] = stream
+
+    def is_up(self, address):
+        """
+
+        :return: Whether the peer is up.
+        :rtype: bool
+        """
+        return address in self.streams
+
+    def transmit(self, source, destination, message):
+        """
+        Send a message on the link from source to destination.
+
+        :return:
+        """
+        self.sent[header_struct.unpack_from(message)[1]] += 1
+        self.sent_bytes += len(message)
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        timeout = self.retransmit_timeout
+        while self.loss > 0 and self.rng.random() < self.loss:
+            delay += timeout
+            timeout *= 2
+        link = (source, destination)
+        # TCP keeps the order of the messages
+        t = max(self.now + delay, self._link_arrivals.get(link, 0))
+        self._link_arrivals[link] = t
+        self.schedule(t, self._deliver, destination, message)
+
+    def metrics(self):
+        """
+
+        :return: The counters of the simulation.
+        :rtype: dict
+        """
+        return {'time': self.now, 'events': self.events, 'peers': len(self.peers), 'crashed': len(self.crashed),
+                'sent': dict(self.sent), 'sent_bytes': self.sent_bytes, 'delivered': self.delivered}
+
+    def _deliver(self, destination, message):
+        stream = self.streams.get(destination)
+        if stream is not None:
+            self.delivered += 1
+            stream.receive(message)
+
+    def _record_message(self, address, message):
+        self.message_times[bytes(message)].append(self.now)
+
+    def _record_unicast(self, address, origin, message):
+        self.unicast_times[(address, bytes(message))].append(self.now)
+
+    def _command(self, address, command):
+        if address not in self.crashed:
+            self.peers[address].user_interface.buffer.append(command)
+
+    def _crash(self, address):
+        self.crashed.add(address)
+        self.streams.pop(address, None)
+
+    def _run_cycle(self, address):
+        if address in self.crashed:
+            return
+        peer = self.peers[address]
+        peer.run_cycle()
+        self._check_daemon(peer)
+        self.schedule(self.now + peer.cycle_interval, self._run_cycle, address)
+
+    def _check_daemon(self, peer):
+        """
+        Start the reunion daemon of the peer when it has been started, and wake it when a link down has set the
+        link_down_event of the peer, like the thread of Peer.run_reunion_daemon.
+
+        :return:
+        """
+        daemon = self._daemons.get(peer.address)
+        if daemon is None:
+            if peer.reunion_daemon_started:
+                self._daemons[peer.address] = [0, False]
+                delay = 0 if peer.is_root else peer.reunion_timer.first_delay()
+                self.schedule(self.now + delay, self._reunion_cycle, peer.address, 0)
+        elif daemon[1] and peer.link_down_event.is_set():
+            peer.link_down_event.clear()
+            daemon[0] += 1
+            self.schedule(self.now, self._reunion_cycle, peer.address, daemon[0])
+
+    def _reunion_cycle(self, address, generation):
+        daemon = self._daemons[address]
+        if address in self.crashed or daemon[0] != generation:
+            return
+        peer = self.peers[address]
+        delay = peer.reunion_cycle()
+        # the root sleeps, a client waits for a link down
+        daemon[1] = not peer.is_root
+        if daemon[1] and peer.link_down_event.is_set():
+            peer.link_down_event.clear()
+            delay = 0
+        daemon[0] += 1
+        self.schedule(self.now + delay, self._reunion_cycle, address, daemon[0])
+
+
+class TestNetworkSimulator(unittest.TestCase):
+
+    @staticmethod
+    def make_network(seed):
+        network = NetworkSimulator(loss=0.01, seed=seed)
+        root_address = ('10.0.0.1', 5000)
+        network.add_peer(*root_address, is_root=True)
+        clients = [PeerAddress.from_text('10.0.1.%d' % i, 5000) for i in range(1, 8)]
+        for i, address in enumerate(clients):
+            network.add_peer(address.ip, address.port, root_address=root_address)
+            network.command(address, 'Register', at=i)
+            network.command(address, 'Advertise', at=10 + 2 * i)
+        network.command(clients[-1], 'SendMessage hello', at=40)
+        network.crash(clients[0], at=60)
+        network.run(150)
+        return network, clients
+
+    def test_broadcast_and_crash(self):
+        network, clients = self.make_network(1)
+        self.assertEqual(len(network.message_times[b'hello']), len(clients))
+        root = network.peers[PeerAddress.from_text('10.0.0.1', 5000)]
+        self.assertNotIn(clients[0], root.network_graph.nodes)
+        # the children of the crashed peer are in the tree again
+        self.assertTrue(all(address in root.network_graph.nodes for address in clients[1:]))
+
+    def test_backup_parent(self):
+        network = NetworkSimulator(seed=6)
+        root_address = PeerAddress.from_text('10.0.0.1', 5000)
+        root = network.add_peer(root_address.ip, root_address.port, is_root=True)
+        clients = [PeerAddress.from_text('10.0.1.%d' % i, 5000) for i in range(1, 8)]
+        for i, address in enumerate(clients):
+            network.add_peer(address.ip, address.port, root_address=root_address)
+            network.command(address, 'Register', at=i)
+            network.command(address, 'Advertise', at=10 + 2 * i)
+        network.run(40)
+        graph = root.network_graph.nodes
+        children = [node.address for node in graph[clients[0]].children]
+        backups = {address: network.peers[address].backup_address for address in children}
+        self.assertEqual(len(children), 2)
+        self.assertTrue(all(backup not in (None, clients[0]) for backup in backups.values()))
+
+        network.crash(clients[0])
+        # before the reunion timeout of the root
+        network.run(50)
+        for address in children:
+            # the child has found the link down and joined its backup parent, the root has moved it there
+            self.assertEqual(network.peers[address].parent_address, backups[address])
+            self.assertEqual(graph[address].parent.address, backups[address])
+        network.command(clients[-1], 'SendMessage after the crash')
+        network.run(60)
+        self.assertEqual(len(network.message_times[b'after the crash']), len(clients) - 1)
+
+    def test_broadcast_and_unicast(self):
+        # the real Peer logic in run_cycle and reunion_cycle, on the tree of 7 clients
+        network = NetworkSimulator(seed=4)
+        root_address = PeerAddress.from_text('10.0.0.1', 5000)
+        network.add_peer(root_address.ip, root_address.port, is_root=True)
+        clients = [PeerAddress.from_text('10.0.1.%d' % i, 5000) for i in range(1, 8)]
+        for i, address in enumerate(clients):
+            network.add_peer(address.ip, address.port, root_address=root_address)
+            network.command(address, 'Register', at=i)
+            network.command(address, 'Advertise', at=10 + 2 * i)
+        network.command(clients[-1], 'SendMessage hello', at=40)
+        # up and down the tree, to the other sub-trees of the root
+        for i, address in enumerate(clients):
+            destination = clients[(i + 3) % len(clients)]
+            network.command(address, 'SendTo %s %s unicast %d' % (destination.ip, destination.port, i), at=50 + i)
+        network.run(80)
+        self.assertEqual(len(network.message_times[b'hello']), len(clients))
+        for i in range(len(clients)):
+            self.assertEqual(len(network.unicast_times[(clients[(i + 3) % len(clients)], b'unicast %d' % i)]), 1)
+
+    def test_unicast_in_active_network(self):
+        # the links are active, so the peers vouch for their children in Reunion Summaries instead of the Hellos
+        network = NetworkSimulator(seed=5)
+        root_address = PeerAddress.from_text('10.0.0.1', 5000)
+        root = network.add_peer(root_address.ip, root_address.port, is_root=True)
+        clients = [PeerAddress.from_text('10.0.1.%d' % i, 5000) for i in range(1, 15)]
+        for i, address in enumerate(clients):
+            network.add_peer(address.ip, address.port, root_address=root_address)
+            network.command(address, 'Register', at=i)
+            network.command(address, 'Advertise', at=20 + 2 * i)
+        for t in range(60, 180):
+            network.command(clients[t % len(clients)], 'SendMessage traffic %d' % t, at=t)
+        for i in range(6):
+            source, destination = clients[2 * i + 2], clients[2 * i + 1]
+            network.command(source, 'SendTo %s %s unicast %d' % (destination.ip, destination.port, i), at=150 + i)
+        network.run(180)
+        self.assertEqual(len(network.message_times[b'traffic 170']), len(clients))
+        self.assertGreaterEqual(len(root.routing_table), len(clients) - 2)
+        for i in range(6):
+            self.assertEqual(len(network.unicast_times[(clients[2 * i + 1], b'unicast %d' % i)]), 1)
+
+    def test_standby_takes_over(self):
+        network = NetworkSimulator(seed=7)
+        primary_address = PeerAddress.from_text('10.0.0.1', 5000)
+        standby_address = PeerAddress.from_text('10.0.0.2', 5000)
+        network.add_peer(primary_address.ip, primary_address.port, is_root=True, standby_address=standby_address)
+        standby = network.add_peer(standby_address.ip, standby_address.port, is_root=True,
+                                   primary_address=primary_address)
+        clients = [PeerAddress.from_text('10.0.1.%d' % i, 5000) for i in range(1, 8)]
+        for i, address in enumerate(clients):
+            network.add_peer(address.ip, address.port, root_address=[primary_address, standby_address])
+            network.command(address, 'Register', at=i)
+            network.command(address, 'Advertise', at=10 + 2 * i)
+        network.run(40)
+        # the standby has the state of the primary, and it does not take over while the primary replicates
+        self.assertTrue(standby.is_standby)
+        self.assertTrue(all(address in standby.network_graph.nodes for address in clients))
+
+        network.crash(primary_address)
+        network.run(45)
+        # the children of the primary come to the standby before its replication timeout, their packets wait
+        self.assertTrue(standby.is_standby)
+        # a new peer registers with the standby when it can not reach the primary
+        late_address = PeerAddress.from_text('10.0.1.8', 5000)
+        late = network.add_peer(late_address.ip, late_address.port, root_address=[primary_address, standby_address])
+        network.command(late_address, 'Register', at=50)
+        network.command(late_address, 'Advertise', at=52)
+        network.run(100)
+        self.assertFalse(standby.is_standby)
+        self.assertEqual(late.root_address, standby_address)
+        self.assertIn(standby_address, late.stream.register_nodes)
+        for address in clients + [late_address]:
+            self.assertIn(address, standby.network_graph.nodes)
+            self.assertIn(address, standby.stream.register_nodes)
+            self.assertNotIn(network.peers[address].parent_address, (None, primary_address))
+        network.command(clients[-1], 'SendMessage after the take over', at=100)
+        network.run(120)
+        # every client but the sender, and the new root
+        self.assertEqual(len(network.message_times[b'after the take over']), len(clients) + 1)
+
+    def test_reproducible(self):
+        first, _ = self.make_network(2)
+        second, _ = self.make_network(2)
+        self.assertEqual((first.metrics(), dict(first.message_times)), (second.metrics(), dict(second.message_times)))
+
+    def test_striped_trees(self):
+        network = NetworkSimulator(seed=3)
+        root_address = PeerAddress.from_text('10.0.0.1', 5000)
+        network.add_peer(root_address.ip, root_address.port, is_root=True, stripes=2)
+        clients = [PeerAddress.from_text('10.0.1.%d' % i, 5000) for i in range(1, 8)]
+        for i, address in enumerate(clients):
+            network.add_peer(address.ip, address.port, root_address=root_address)
+            network.command(address, 'Register', at=i)
+            network.command(address, 'Advertise', at=10 + 2 * i)
+        content = os.urandom(100000)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(content)
+        network.command(clients[-1], 'SendFile ' + f.name, at=40)
+        network.run(80)
+        os.unlink(f.name)
+        # every peer but the sender, the root too
+        self.assertEqual(len(network.message_times[content]), len(clients))
+        # the links of the striped trees are not register connections, the only one of a client is to the root
+        for address in clients:
+            stream = network.peers[address].stream
+            self.assertEqual(list(stream.register_nodes), [root_address])
+            self.assertGreater(len(stream.stripe_nodes), 0)
@@ -1,5 +1,8 @@
+import collections
+import time
 import warnings
 
+from tools.PeerAddress import PeerAddress
 from tools.simpletcp.clientsocket import ClientSocket
 import logging
 
@@ -7,7 +10,12 @@ logging.basicConfig(format='%(asctime)s %(message)s')
 
 
 class Node:
-    def __init__(self, server_address, set_register=False):
+    # a root has a register Node for every peer of the network
+    __slots__ = ('server_ip', 'server_port', 'server_address', 'out_buff', 'control_buff', 'is_register',
+                 'is_stripe', 'last_send_time', 'last_data_ack_time', 'features', 'socket_options', 'clock', 'client')
+
+    def __init__(self, server_address, set_register=False, lazy=False, socket_options=None, clock=time.time,
+                 set_stripe=False):
         """
         The Node object constructor.
 
@@ -20,56 +28,148 @@ class Node:
 
         :param server_address:
         :param set_register:
+        :param lazy: If it is True the ClientSocket will be made when the first message is going to be sent; Stream
+                     makes register nodes lazy and closes their idle connections.
+        :param socket_options: Keyword arguments of the ClientSocket, e.g. its keepalive and timeout.
+        :param clock: Function which returns the current time in seconds.
+        :param set_stripe: Whether the node is a link of the striped trees.
         """
-        self.server_ip = Node.parse_ip(server_address[0])
-        self.server_port = Node.parse_port(server_address[1])
-
-        self.server_address = (self.server_ip, self.server_port)
+        self.server_address = PeerAddress.get(server_address)
+        self.server_ip = self.server_address.ip
+        self.server_port = self.server_address.port
 
         logging.warning("Node added with Server Address: " + str(self.server_address))
 
-        self.out_buff = []
+        self.out_buff = collections.deque()
+        # control messages (e.g. Reunion Hellos) are sent before every message of out_buff
+        self.control_buff = collections.deque()
         self.is_register = set_register
+        self.is_stripe = set_stripe
+        self.clock = clock
+        self.last_send_time = clock()
+        # the peer has answered our last data message at this time, so the link is alive
+        self.last_data_ack_time = 0
+        # features which both sides of this link support, they are agreed in the Register and Join handshakes
+        self.features = 0
+        self.socket_options = socket_options or {}
+
+        self.client = None
+        if not lazy:
+            self.connect()
+
+    def connect(self):
+        """
+        Make the ClientSocket to the Node TCPServer address.
 
+        :return:
+        """
         # TODO im not sure of this.
         try:
-            self.client = ClientSocket(mode=self.server_ip, port=int(self.server_port))
+            # without the zero padding, '010' is an octal number for the socket library
+            ip = '.'.join(str(int(part)) for part in self.server_ip.split('.'))
+            self.client = ClientSocket(mode=ip, port=int(self.server_port), **self.socket_options)
         except:
             logging.warning('Exception in creating the client socket for node: ' + str(self.server_address))
             # Detaching the node???
             self.out_buff.clear()
+            self.control_buff.clear()
             raise Exception
 
+    def is_connected(self):
+        """
+
+        :return: Whether the node has an open ClientSocket or not.
+        :rtype: bool
+        """
+        return self.client is not None
+
+    def is_alive(self):
+        """
+        Checks the ClientSocket without sending a message; a lazy node which is not connected yet is considered alive.
+
+        :return: Whether the peer has not closed our connection.
+        :rtype: bool
+        """
+        return self.client is None or not self.client.peer_closed()
+
+    def has_messages(self):
+        """
+
+        :return: Whether there is a message to send or not.
+        :rtype: bool
+        """
+        return len(self.control_buff) > 0 or len(self.out_buff) > 0
+
     def send_message(self):
         """
         Final function to send buffer to the client's socket.
 
         :return:
         """
-        # TODO I'm not sure of this. Do we need to check the response of client sending (to be b'ACK')
-        for msg in self.out_buff:
-            res = self.client.send(bytes(msg))
-            logging.info('sent message: ' + str(bytes(msg)) + ' to ' + str(self.server_address))
-            if res != b'ACK':
-                logging.warning('not received b\'ACK\' for node: ' + str(self.server_address))
+        while self.send_next_message():
+            pass
+
+    def send_control_messages(self):
+        """
+        Send the buffered control messages.
 
-        self.out_buff.clear()
+        :return:
+        """
+        while len(self.control_buff) > 0:
+            self.__send(self.control_buff.popleft())
 
-    def add_message_to_out_buff(self, message):
+    def send_next_message(self):
+        """
+        Send the control messages and then one message of out_buff, so a control message which is added in the
+        meantime (e.g. by the reunion daemon) only waits for one message.
+
+        :return: Whether there are more messages to send.
+        :rtype: bool
+        """
+        self.send_control_messages()
+        if len(self.out_buff) > 0 and self.__send(self.out_buff.popleft()):
+            self.last_data_ack_time = self.last_send_time
+        return self.has_messages()
+
+    def __send(self, msg):
+        """
+
+        :return: Whether the peer has answered with an ACK.
+        :rtype: bool
+        """
+        if self.client is None:
+            self.connect()
+        self.last_send_time = self.clock()
+        # TODO I'm not sure of this. Do we need to check the response of client sending (to be b'ACK')
+        res = self.client.send(bytes(msg))
+        # the arguments are only formatted when the message is logged
+        logging.info('sent message: %s to %s', msg, self.server_address)
+        if res != b'ACK':
+            logging.warning('not received b\'ACK\' for node: ' + str(self.server_address))
+            return False
+        return True
+
+    def add_message_to_out_buff(self, message, control=False):
         """
         Here we will add a new message to the server out_buff, then in 'send_message' will send them.
 
         :param message: The message we want to add to out_buff
+        :param control: Whether the message is a control message which is sent before the other ones.
         :return:
         """
-        self.out_buff.append(message)
+        if control:
+            self.control_buff.append(message)
+        else:
+            self.out_buff.append(message)
 
     def close(self):
         """
         Closing client's object.
         :return:
         """
-        self.client.close()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
     def get_server_address(self):
         """
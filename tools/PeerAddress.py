@@ -0,0 +1,210 @@
+import struct
+import unittest
+
+
+class PeerAddress:
+    # 4 IP bytes and the port of version 2 bodies
+    PACKED = struct.Struct('>4sH')
+    # 4 IP parts and the port of the packet header
+    HEADER = struct.Struct('>HHHHI')
+    # the tables are cleared when they are this big; equal addresses are still equal after that
+    MAX_INTERNED = 1 << 18
+
+    # {(ip, port): PeerAddress}; The canonical text of every interned address and the other texts which are given
+    _by_text = {}
+    # {6 bytes: PeerAddress}
+    _by_packed = {}
+    # {12 bytes: PeerAddress}
+    _by_header = {}
+
+    __slots__ = ('ip', 'port', '_packed', '_header', '_hash')
+
+    def __init__(self, ip, port):
+        """
+        Canonical IP/Port address of a peer; Use the from_* functions, they return one interned object for every
+        address, so it is normalized once and compared by identity in the dictionaries.
+
+        A PeerAddress is equal to the tuple ('192.168.001.001', '05335') and has the same hash, so dictionaries work
+        with both of them; It is not equal to ('192.168.1.1', '5335'), normalize such a tuple with get first.
+
+        :param ip: The format is like '192.168.001.001'.
+        :param port: The format is like '05335'.
+
+        :type ip: str
+        :type port: str
+        """
+        set_attribute = object.__setattr__
+        set_attribute(self, 'ip', ip)
+        set_attribute(self, 'port', port)
+        # the wire bytes are made when they are needed first, most addresses of a loaded graph are never sent
+        set_attribute(self, '_packed', None)
+        set_attribute(self, '_header', None)
+        set_attribute(self, '_hash', hash((ip, port)))
+
+    @property
+    def packed(self):
+        """
+
+        :return: The 6 bytes of the address in version 2 bodies.
+        :rtype: bytes
+        """
+        if self._packed is None:
+            object.__setattr__(self, '_packed', PeerAddress.PACKED.pack(bytes(map(int, self.ip.split('.'))),
+                                                                        int(self.port)))
+        return self._packed
+
+    @property
+    def header(self):
+        """
+
+        :return: The 12 IP/Port bytes of the packet header.
+        :rtype: bytes
+        """
+        if self._header is None:
+            object.__setattr__(self, '_header', PeerAddress.HEADER.pack(*map(int, self.ip.split('.')),
+                                                                        int(self.port)))
+        return self._header
+
+    @staticmethod
+    def __intern(table, key, ip_parts, port):
+        canonical = ('%03d.%03d.%03d.%03d' % ip_parts, '%05d' % port)
+        address = PeerAddress._by_text.get(canonical)
+        if address is None:
+            if len(PeerAddress._by_text) >= PeerAddress.MAX_INTERNED:
+                for interned in (PeerAddress._by_text, PeerAddress._by_packed, PeerAddress._by_header):
+                    interned.clear()
+            address = PeerAddress(*canonical)
+            # the key shares the strings of the address
+            PeerAddress._by_text[canonical] = address
+        if table is not PeerAddress._by_text or key != canonical:
+            table[key] = address
+        return address
+
+    @staticmethod
+    def from_text(ip, port):
+        """
+        :param ip: IP like '192.168.1.1' or '192.168.001.001'.
+        :param port: Port like '5335', '05335' or 5335.
+
+        :return: The interned address.
+        :rtype: PeerAddress
+
+        :raise ValueError: If the address is not correct.
+        """
+        address = PeerAddress._by_text.get((ip, port))
+        if address is None:
+            ip_parts = tuple(map(int, ip.split('.')))
+            if len(ip_parts) != 4 or max(ip_parts) > 255 or min(ip_parts) < 0 or not 0 <= int(port) <= 65535:
+                raise ValueError('invalid address: ' + str((ip, port)))
+            address = PeerAddress.__intern(PeerAddress._by_text, (ip, port), ip_parts, int(port))
+        return address
+
+    @staticmethod
+    def from_packed(entry):
+        """
+        :param entry: The 6 bytes of an address in version 2 bodies.
+        :type entry: bytes
+
+        :return: The interned address.
+        :rtype: PeerAddress
+        """
+        address = PeerAddress._by_packed.get(entry)
+        if address is None:
+            ip, port = PeerAddress.PACKED.unpack(entry)
+            address = PeerAddress.__intern(PeerAddress._by_packed, bytes(entry), tuple(ip), port)
+        return address
+
+    @staticmethod
+    def from_header(header):
+        """
+        :param header: The 12 IP/Port bytes of a packet header.
+        :type header: bytes
+
+        :return: The interned address.
+        :rtype: PeerAddress
+
+        :raise ValueError: If the address is not correct.
+        """
+        address = PeerAddress._by_header.get(header)
+        if address is None:
+            ip_0, ip_1, ip_2, ip_3, port = PeerAddress.HEADER.unpack(header)
+            if max(ip_0, ip_1, ip_2, ip_3) > 255 or port > 65535:
+                raise ValueError('invalid address in the header')
+            address = PeerAddress.__intern(PeerAddress._by_header, bytes(header), (ip_0, ip_1, ip_2, ip_3), port)
+        return address
+
+    @staticmethod
+    def get(address):
+        """
+        :param address: A PeerAddress or an (ip, port) tuple.
+
+        :return: The interned address.
+        :rtype: PeerAddress
+        """
+        if type(address) is PeerAddress:
+            return address
+        return PeerAddress.from_text(address[0], address[1])
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PeerAddress is immutable')
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if type(other) is PeerAddress:
+            return self.ip == other.ip and self.port == other.port
+        if isinstance(other, tuple):
+            # only the canonical tuple, it has the same hash; Other tuples are normalized with get before comparing
+            return (self.ip, self.port) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __lt__(self, other):
+        return (self.ip, self.port) < tuple(other)
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        if index == 0:
+            return self.ip
+        if index == 1:
+            return self.port
+        return (self.ip, self.port)[index]
+
+    def __iter__(self):
+        yield self.ip
+        yield self.port
+
+    def __reduce__(self):
+        return PeerAddress.from_text, (self.ip, self.port)
+
+    def __repr__(self):
+        return repr((self.ip, self.port))
+
+
+class TestPeerAddress(unittest.TestCase):
+    def test_interned(self):
+        address = PeerAddress.from_text('192.168.1.1', 5335)
+        self.assertIs(PeerAddress.from_text('192.168.001.001', '05335'), address)
+        self.assertIs(PeerAddress.from_packed(address.packed), address)
+        self.assertIs(PeerAddress.from_header(address.header), address)
+        self.assertIs(PeerAddress.get(('192.168.001.001', '5335')), address)
+
+    def test_tuple(self):
+        address = PeerAddress.from_text('10.0.0.1', '05000')
+        self.assertEqual(address, ('010.000.000.001', '05000'))
+        self.assertNotEqual(address, ('10.0.0.1', 5000))
+        self.assertEqual(address, PeerAddress.get(('10.0.0.1', 5000)))
+        self.assertNotEqual(address, ('010.000.000.001', '05001'))
+        self.assertEqual({('010.000.000.001', '05000'): 1}[address], 1)
+        self.assertEqual(tuple(address), ('010.000.000.001', '05000'))
+        self.assertEqual(str(address), "('010.000.000.001', '05000')")
+        with self.assertRaises(AttributeError):
+            address.port = '05001'
@@ -0,0 +1,76 @@
+import random
+import unittest
+
+
+class ReunionTimer:
+    def __init__(self, interval=4, jitter=0.25, phase=None, rng=None):
+        """
+        The ReunionTimer object constructor.
+
+        This object tells a client Peer how long it should wait between two Reunion Hello packets.
+        Without jitter all clients which have started at the same time (e.g. after a mass restart) will send their
+        Reunion Hello packets to the root in synchronized bursts.
+
+        :param interval: Mean time between two Reunion Hello packets in seconds.
+        :param jitter: Every delay is chosen uniformly in interval * (1 +- jitter).
+        :param phase: Offset of the first Reunion Hello as a fraction of the interval; The root suggests it in
+                      the Register Response packet. If it is None a random phase will be chosen.
+        :param rng: Random generator, for reproducible simulations.
+
+        :type interval: float
+        :type jitter: float
+        :type phase: float
+        :type rng: random.Random
+        """
+        self.interval = interval
+        self.jitter = jitter
+        self.rng = rng if rng is not None else random.Random()
+        self.phase = phase
+
+    def set_phase(self, phase):
+        """
+        Set the phase which the root has suggested.
+
+        :param phase: A fraction of the interval in [0, 1).
+        :type phase: float
+
+        :return:
+        """
+        self.phase = phase
+
+    def first_delay(self):
+        """
+
+        :return: Waiting time before the first Reunion Hello.
+        :rtype: float
+        """
+        if self.phase is None:
+            return self.rng.uniform(0, self.interval)
+        return self.phase * self.interval
+
+    def next_delay(self):
+        """
+
+        :return: Waiting time before the next Reunion Hello.
+        :rtype: float
+        """
+        return self.interval * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+
+class TestReunionTimer(unittest.TestCase):
+
+    def test_delays(self):
+        timer = ReunionTimer(interval=4, jitter=0.25, rng=random.Random(1))
+        first_delays = [timer.first_delay() for _ in range(1000)]
+        self.assertTrue(all(0 <= delay <= 4 for delay in first_delays))
+        next_delays = [timer.next_delay() for _ in range(1000)]
+        self.assertTrue(all(3 <= delay <= 5 for delay in next_delays))
+        # the jitter spreads the delays over the whole range
+        self.assertLess(min(next_delays), 3.1)
+        self.assertGreater(max(next_delays), 4.9)
+
+    def test_phase(self):
+        timer = ReunionTimer(interval=4, rng=random.Random(1))
+        timer.set_phase(0.375)
+        self.assertEqual(timer.first_delay(), 1.5)
+        self.assertEqual(ReunionTimer(interval=4, phase=0.5).first_delay(), 2)
@@ -0,0 +1,99 @@
+import time
+import unittest
+
+
+class RoutingTable:
+    def __init__(self, timeout=20, clock=time.time):
+        """
+        The RoutingTable object constructor.
+
+        A peer keeps the next hop (one of its children) for every peer of its sub-tree, so a Unicast packet goes
+        down the tree towards its destination or up to the parent when the destination is not in our sub-tree.
+        The routes are learned from the Join packets of our children and from the Reunion Hello, Reunion Summary
+        and Unicast packets which come up from them.
+
+        The table is two generations of {destination: child} dicts instead of a time for every route: learning puts
+        the route in the new generation, and every timeout / 2 seconds the old generation is dropped and the new one
+        becomes old. So a route which is not learned again lives between timeout / 2 and timeout seconds.
+
+        :param timeout: A route is dropped at most 'timeout' seconds after it was learned.
+        :param clock: Function which returns the current time in seconds.
+
+        :type timeout: float
+        """
+        self.timeout = timeout
+        self.clock = clock
+        self.routes = {}
+        self.old_routes = {}
+        self.last_rotation_time = clock()
+
+    def __len__(self):
+        return len(self.routes) + sum(1 for destination in self.old_routes if destination not in self.routes)
+
+    def learn(self, destination, child):
+        """
+        :param destination: A peer in our sub-tree.
+        :param child: Our child which the destination is under it.
+
+        :type destination: PeerAddress
+        :type child: PeerAddress
+
+        :return:
+        """
+        self.routes[destination] = child
+
+    def lookup(self, destination):
+        """
+        :param destination: Address of a peer.
+        :type destination: PeerAddress
+
+        :return: Our child which the destination is under it, or None.
+        :rtype: PeerAddress
+        """
+        child = self.routes.get(destination)
+        if child is None:
+            child = self.old_routes.get(destination)
+        return child
+
+    def forget(self, destination):
+        """
+        Drop a wrong route; e.g. when the child has gone or the packet has come back from the child.
+
+        :param destination: Address of a peer.
+        :type destination: PeerAddress
+
+        :return:
+        """
+        self.routes.pop(destination, None)
+        self.old_routes.pop(destination, None)
+
+    def expire(self):
+        """
+        Drop the old generation of the routes if it is the time.
+
+        :return:
+        """
+        t = self.clock()
+        if t - self.last_rotation_time >= self.timeout / 2:
+            self.old_routes = self.routes
+            self.routes = {}
+            self.last_rotation_time = t
+
+
+class TestRoutingTable(unittest.TestCase):
+
+    def test_routes(self):
+        t = [0]
+        table = RoutingTable(timeout=10, clock=lambda: t[0])
+        table.learn('a', 'child 1')
+        table.learn('b', 'child 2')
+        t[0] = 5
+        table.expire()
+        table.learn('b', 'child 1')
+        self.assertEqual((table.lookup('a'), table.lookup('b'), len(table)), ('child 1', 'child 1', 2))
+        table.forget('b')
+        self.assertIsNone(table.lookup('b'))
+        t[0] = 10
+        table.expire()
+        self.assertIsNone(table.lookup('a'))
+        self.assertEqual(len(table), 0)
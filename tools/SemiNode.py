@@ -1,4 +1,9 @@
+from tools.PeerAddress import PeerAddress
+
+
 class SemiNode:
+    __slots__ = ('ip', 'port')
+
     def __init__(self, ip, port):
         self.ip = ip
         self.port = port
@@ -10,7 +15,7 @@ class SemiNode:
         return self.port
 
     def get_address(self):
-        return SemiNode.parse_ip(self.ip), SemiNode.parse_port(self.port)
+        return PeerAddress.from_text(self.ip, self.port)
 
     @staticmethod
     def parse_ip(ip):
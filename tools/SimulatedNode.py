@@ -0,0 +1,83 @@
+from tools.Node import Node
+
+
+class SimulatedClient:
+    __slots__ = ('network', 'source_address', 'server_address')
+
+    def __init__(self, network, source_address, server_address):
+        """
+        The ClientSocket of a SimulatedNode; It hands the messages to the NetworkSimulator.
+
+        :param network: The simulated network.
+        :param source_address: Our server address.
+        :param server_address: Server address of the peer.
+
+        :type network: NetworkSimulator
+        :type source_address: PeerAddress
+        :type server_address: PeerAddress
+
+        :raise ConnectionRefusedError: If the peer is not up.
+        """
+        if not network.is_up(server_address):
+            raise ConnectionRefusedError('peer is not up: ' + str(server_address))
+        self.network = network
+        self.source_address = source_address
+        self.server_address = server_address
+
+    def send(self, message):
+        """
+        The message arrives after the latency of the link, the ACK is immediate.
+
+        :return: b'ACK'
+        :rtype: bytes
+
+        :raise ConnectionResetError: If the peer has crashed.
+        """
+        if not self.network.is_up(self.server_address):
+            raise ConnectionResetError('peer has crashed: ' + str(self.server_address))
+        self.network.transmit(self.source_address, self.server_address, message)
+        return b'ACK'
+
+    def peer_closed(self):
+        """
+
+        :return: Whether the peer has crashed; Its host closes our connection.
+        :rtype: bool
+        """
+        return not self.network.is_up(self.server_address)
+
+    def close(self):
+        pass
+
+
+class SimulatedNode(Node):
+    __slots__ = ('network', 'source_address')
+
+    def __init__(self, network, source_address, server_address, set_register=False, lazy=False, clock=None,
+                 set_stripe=False):
+        """
+        A Node whose connection is a link of a NetworkSimulator.
+
+        :param network: The simulated network.
+        :param source_address: Our server address.
+        :param server_address: Server address of the peer.
+
+        :type network: NetworkSimulator
+        :type source_address: PeerAddress
+        """
+        self.network = network
+        self.source_address = source_address
+        super().__init__(server_address, set_register, lazy=lazy, clock=clock or network.clock, set_stripe=set_stripe)
+
+    def connect(self):
+        """
+        Make the SimulatedClient of the link.
+
+        :return:
+        """
+        try:
+            self.client = SimulatedClient(self.network, self.source_address, self.server_address)
+        except ConnectionRefusedError:
+            self.out_buff.clear()
+            self.control_buff.clear()
+            raise
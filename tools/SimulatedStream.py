@@ -0,0 +1,37 @@
+from Stream import Stream
+from tools.SimulatedNode import SimulatedNode
+
+
+class SimulatedStream(Stream):
+
+    def __init__(self, *args, network=None, **kwargs):
+        """
+        A Stream on a NetworkSimulator instead of TCP; It is made like Stream with the network as a keyword argument,
+        e.g. Peer(..., stream_class=functools.partial(SimulatedStream, network=network)).
+
+        There is no TCPServer thread, the network puts the arriving messages in our in_buf.
+
+        :param network: The simulated network.
+        :type network: NetworkSimulator
+        """
+        self.network = network
+        super().__init__(*args, **kwargs)
+
+    def _start_server(self, callback):
+        self.network.listen(self.server_address, self)
+
+    def _new_node(self, server_address, set_register_connection, set_stripe_connection=False):
+        return SimulatedNode(self.network, self.server_address, server_address, set_register_connection,
+                             lazy=set_register_connection or set_stripe_connection, clock=self.clock,
+                             set_stripe=set_stripe_connection)
+
+    def receive(self, data):
+        """
+        A message has arrived from the network.
+
+        :param data: The message.
+        :type data: bytes
+
+        :return:
+        """
+        self._server_in_buf.append(data)
@@ -0,0 +1,271 @@
+import heapq
+import itertools
+import unittest
+
+from tools.PeerAddress import PeerAddress
+
+import logging
+
+logging.basicConfig(format='%(asctime)s %(message)s')
+
+
+class StripedTrees:
+    # children of an interior peer which are interior in the same tree; the root has one in every tree
+    fanout = 2
+
+    def __init__(self, root_address, stripes):
+        """
+        The StripedTrees object constructor.
+
+        Root keeps 'stripes' trees over all of the peers (like SplitStream) and the fragments of a large message are
+        sent round-robin on them. Every peer is interior in exactly one tree (its group, the smallest group when it
+        is added) and a leaf in the other ones, so every peer uploads about one copy of the message instead of the
+        two copies of an interior peer in one binary tree (and nothing for a leaf).
+
+        In its own tree a peer is placed like NetworkGraph (binary, nearest the root first) and in the other trees
+        it is a child of the interior peer which has the fewest children.
+
+        :param root_address: Address of the root; It is the root of every tree.
+        :param stripes: Number of the trees.
+
+        :type root_address: tuple
+        :type stripes: int
+        """
+        self.root = PeerAddress.get(root_address)
+        self.stripes = stripes
+        # {address: the tree which the peer is interior in}
+        self.groups = {}
+        self.group_sizes = [0] * stripes
+        # for every tree {address: parent address} and {address: [child addresses]}
+        self.parents = [{} for _ in range(stripes)]
+        self.children = [{self.root: []} for _ in range(stripes)]
+        # for every tree the heaps of (depth, order, address) of the nodes which may have a free interior slot and
+        # (number of children, order, address) of the interior peers; Their entries are checked when they are popped
+        self.interior_slots = [[(0, 0, self.root)] for _ in range(stripes)]
+        self.leaf_slots = [[] for _ in range(stripes)]
+        self.order = itertools.count(1)
+
+    def __contains__(self, address):
+        return PeerAddress.get(address) in self.groups
+
+    def get_parents(self, address):
+        """
+        :param address: A peer address.
+        :type address: tuple
+
+        :return: The parent of the peer in every tree.
+        :rtype: list
+        """
+        address = PeerAddress.get(address)
+        return [parents[address] for parents in self.parents]
+
+    def get_children(self, address, stripe):
+        return self.children[stripe][PeerAddress.get(address)]
+
+    def add(self, address):
+        """
+        Place a new peer in every tree; Nothing changes for a peer which is already in the trees.
+
+        Warnings:
+            1. Until a tree has an interior peer the other peers are leaves of the root in it; The first interior
+               peer of the tree takes them from the root.
+            2. A new interior peer takes leaves from its parent while the parent has more than 'stripes' children,
+               so every interior peer keeps about 'stripes' children.
+
+        :param address: The peer address.
+        :type address: tuple
+
+        :return: Addresses of the peers whose parents have changed (with the new peer).
+        :rtype: set
+        """
+        address = PeerAddress.get(address)
+        if address in self.groups:
+            return set()
+        group = self.group_sizes.index(min(self.group_sizes))
+        self.groups[address] = group
+        self.group_sizes[group] += 1
+        for stripe in range(self.stripes):
+            self.children[stripe][address] = []
+            if stripe == group:
+                parent = self.__pop_interior_slot(stripe)
+            else:
+                parent = self.__pop_leaf_slot(stripe)
+            self.__attach(stripe, address, parent)
+        changed = {address}
+        parent = self.parents[group][address]
+        leaves = [child for child in self.children[group][parent] if self.groups[child] != group]
+        if parent != self.root:
+            leaves = leaves[:max(0, min(len(self.children[group][parent]) - self.stripes, self.stripes))]
+        for leaf in leaves:
+            self.children[group][parent].remove(leaf)
+            self.__attach(group, leaf, address)
+            changed.add(leaf)
+        return changed
+
+    def remove(self, address):
+        """
+        Remove a peer from every tree; Its children in its own tree are placed again (an interior child with its
+        sub-tree).
+
+        :param address: The peer address.
+        :type address: tuple
+
+        :return: Addresses of the peers whose parents have changed.
+        :rtype: set
+        """
+        address = PeerAddress.get(address)
+        group = self.groups.pop(address, None)
+        if group is None:
+            logging.warning('Wants to remove a non-existing peer from the striped trees: ' + str(address))
+            return set()
+        self.group_sizes[group] -= 1
+        changed = set()
+        for stripe in range(self.stripes):
+            parent = self.parents[stripe].pop(address)
+            self.children[stripe][parent].remove(address)
+            self.__push_slots(stripe, parent)
+            orphans = self.children[stripe].pop(address)
+            # interior children first, so the leaves can be placed under them
+            orphans.sort(key=lambda orphan: self.groups[orphan] != stripe)
+            for orphan in orphans:
+                del self.parents[stripe][orphan]
+                if self.groups[orphan] == stripe:
+                    parent = self.__pop_interior_slot(stripe, sub_tree=orphan)
+                else:
+                    parent = self.__pop_leaf_slot(stripe)
+                self.__attach(stripe, orphan, parent)
+                changed.add(orphan)
+        return changed
+
+    def __attach(self, stripe, address, parent):
+        self.parents[stripe][address] = parent
+        self.children[stripe][parent].append(address)
+        self.__push_slots(stripe, parent)
+        if self.groups[address] == stripe:
+            self.__push_slots(stripe, address)
+
+    def __push_slots(self, stripe, address):
+        if address != self.root and self.groups[address] != stripe:
+            return
+        if self.__interior_children(stripe, address) < self.__fanout(address):
+            heapq.heappush(self.interior_slots[stripe], (self.__depth(stripe, address), next(self.order), address))
+        if address != self.root:
+            heapq.heappush(self.leaf_slots[stripe],
+                           (len(self.children[stripe][address]), next(self.order), address))
+
+    def __pop_interior_slot(self, stripe, sub_tree=None):
+        slots = self.interior_slots[stripe]
+        skipped = []
+        parent = self.root
+        while len(slots) > 0:
+            depth, order, candidate = heapq.heappop(slots)
+            if candidate not in self.children[stripe] or \
+                    self.__interior_children(stripe, candidate) >= self.__fanout(candidate):
+                continue
+            current_depth = self.__depth(stripe, candidate)
+            if current_depth is None or (sub_tree is not None and self.__is_in_sub_tree(stripe, candidate, sub_tree)):
+                # it is in the sub-tree or in another sub-tree which is not placed yet
+                skipped.append((depth, order, candidate))
+                continue
+            if current_depth != depth:
+                heapq.heappush(slots, (current_depth, order, candidate))
+                continue
+            parent = candidate
+            break
+        for item in skipped:
+            heapq.heappush(slots, item)
+        return parent
+
+    def __pop_leaf_slot(self, stripe):
+        slots = self.leaf_slots[stripe]
+        while len(slots) > 0:
+            count, order, candidate = heapq.heappop(slots)
+            children = self.children[stripe].get(candidate)
+            if children is None or self.groups.get(candidate) != stripe:
+                continue
+            if len(children) != count:
+                heapq.heappush(slots, (len(children), order, candidate))
+                continue
+            return candidate
+        # no interior peer in this tree yet
+        return self.root
+
+    def __interior_children(self, stripe, address):
+        return sum(1 for child in self.children[stripe][address] if self.groups[child] == stripe)
+
+    def __fanout(self, address):
+        return 1 if address == self.root else self.fanout
+
+    def __depth(self, stripe, address):
+        """
+
+        :return: Depth of the node or None if it is not connected to the root.
+        """
+        depth = 0
+        while address != self.root:
+            address = self.parents[stripe].get(address)
+            if address is None:
+                return None
+            depth += 1
+        return depth
+
+    def __is_in_sub_tree(self, stripe, address, sub_tree_root):
+        while address is not None and address != self.root:
+            if address == sub_tree_root:
+                return True
+            address = self.parents[stripe].get(address)
+        return False
+
+
+class TestStripedTrees(unittest.TestCase):
+    root = ('127.000.000.001', '05000')
+
+    @staticmethod
+    def address(i):
+        return '010.000.%03d.%03d' % (i // 256, i % 256), '05000'
+
+    def check(self, trees):
+        for stripe in range(trees.stripes):
+            for address in trees.groups:
+                # every peer is connected to the root and only interior peers have children
+                self.assertEqual(self.path(trees, stripe, address)[-1], trees.root)
+                if trees.groups[address] != stripe:
+                    self.assertEqual(trees.get_children(address, stripe), [])
+
+    @staticmethod
+    def path(trees, stripe, address):
+        path = [address]
+        while path[-1] != trees.root:
+            path.append(trees.parents[stripe][path[-1]])
+            assert len(path) <= len(trees.groups) + 1
+        return path
+
+    def test_add(self):
+        trees = StripedTrees(self.root, 4)
+        self.assertEqual(trees.add(self.address(0)), {self.address(0)})
+        # the first interior peer of the second tree takes the first peer from the root
+        self.assertEqual(trees.add(self.address(1)), {self.address(0), self.address(1)})
+        self.assertEqual(trees.add(self.address(1)), set())
+        for i in range(2, 100):
+            trees.add(self.address(i))
+        self.assertEqual(trees.group_sizes, [25] * 4)
+        self.check(trees)
+        self.assertEqual([len(trees.get_children(trees.root, stripe)) for stripe in range(4)], [1] * 4)
+        # every interior peer has about 'stripes' children, so it uploads about one copy of a message
+        counts = [len(trees.get_children(address, trees.groups[address])) for address in trees.groups]
+        self.assertLessEqual(max(counts), 6)
+
+    def test_remove(self):
+        trees = StripedTrees(self.root, 3)
+        for i in range(60):
+            trees.add(self.address(i))
+        top = trees.get_children(self.root, 0)[0]
+        changed = trees.remove(top)
+        self.assertNotIn(top, trees)
+        self.assertTrue(len(changed) > 0)
+        self.assertTrue(all(trees.get_parents(address)[0] != top for address in trees.groups))
+        self.check(trees)
+        for i in range(60):
+            if self.address(i) in trees:
+                trees.remove(self.address(i))
+        self.assertEqual([len(children) for children in trees.children], [1] * 3)
@@ -0,0 +1,133 @@
+import collections
+import socket
+import unittest
+
+
+class BufferPool:
+
+    def __init__(self, chunk_size=256 * 1024, max_chunks=64):
+        """
+
+        Preallocated chunks of memory which the server receives into
+        with recv_into; The reads go one after another in the current
+        chunk and are handed upward as read-only views of it. A full
+        chunk can be reused when none of its views is alive any more:
+        Python can not resize a bytearray while a view of it exists,
+        which is how we find out.
+        At most max_chunks full chunks are kept for reuse. When all of
+        them are still held (e.g. by a slow consumer), no more chunks
+        are made: every read gets a buffer of its own size until a
+        chunk is free, so a small view can not hold a new chunk.
+
+        """
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        # chunks which are full, the oldest one is the first
+        self._retired = collections.deque()
+        # The current chunk, its views and the end of its data.
+        self._chunk = None
+        self._view = None
+        self._readonly = None
+        self._end = 0
+        # Number of chunks which have been made, for the statistics.
+        self.allocated = 0
+
+    @staticmethod
+    def in_use(chunk):
+        try:
+            chunk.append(0)
+        except BufferError:
+            return True
+        del chunk[-1]
+        return False
+
+    def recv(self, sock, size):
+        """
+
+        Receives at most size bytes from sock into the current chunk.
+        Returns a read-only memoryview of the received data; it is
+        empty if the connection is closed.
+
+        """
+        if self._chunk is None or self.chunk_size - self._end < size:
+            if not self._next_chunk():
+                buffer = bytearray(size)
+                received = sock.recv_into(buffer)
+                return memoryview(buffer).toreadonly()[:received]
+        received = sock.recv_into(self._view[self._end:(self._end + size)])
+        data = self._readonly[self._end:(self._end + received)]
+        self._end += received
+        return data
+
+    def _next_chunk(self):
+        """
+
+        Makes a free chunk the current one, or a new chunk if we keep
+        less than max_chunks. Returns False if all of them are held.
+
+        """
+        if self._chunk is not None:
+            # The views of the reads keep the chunk in use until they
+            # are gone, ours do not.
+            self._view.release()
+            self._readonly.release()
+            if len(self._retired) < self.max_chunks:
+                self._retired.append(self._chunk)
+        self._chunk = None
+        for _ in range(len(self._retired)):
+            chunk = self._retired.popleft()
+            if not self.in_use(chunk):
+                self._chunk = chunk
+                break
+            self._retired.append(chunk)
+        if self._chunk is None:
+            if len(self._retired) >= self.max_chunks:
+                return False
+            self.allocated += 1
+            self._chunk = bytearray(self.chunk_size)
+        self._view = memoryview(self._chunk)
+        self._readonly = self._view.toreadonly()
+        self._end = 0
+        return True
+
+
+class TestBufferPool(unittest.TestCase):
+
+    def test_reuse(self):
+        writer, reader = socket.socketpair()
+        pool = BufferPool(chunk_size=8, max_chunks=2)
+        writer.send(b'abcd')
+        first = pool.recv(reader, 4)
+        writer.send(b'efgh')
+        second = pool.recv(reader, 4)
+        self.assertEqual((bytes(first), bytes(second), pool.allocated), (b'abcd', b'efgh', 1))
+        self.assertRaises(TypeError, first.__setitem__, 0, 0)
+        # the first chunk is full and its views are alive, so a new chunk is made
+        writer.send(b'ijkl')
+        self.assertEqual((bytes(pool.recv(reader, 4)), pool.allocated), (b'ijkl', 2))
+        self.assertEqual(bytes(first), b'abcd')
+        del first, second
+        writer.send(b'mnop')
+        pool.recv(reader, 4)
+        # the views of the first chunk are gone, it is reused
+        writer.send(b'qrst')
+        self.assertEqual((bytes(pool.recv(reader, 4)), pool.allocated), (b'qrst', 2))
+        writer.close()
+        self.assertEqual(bytes(pool.recv(reader, 4)), b'')
+        reader.close()
+
+    def test_held_chunks(self):
+        writer, reader = socket.socketpair()
+        pool = BufferPool(chunk_size=8, max_chunks=1)
+        views = []
+        for data in (b'abcd', b'efgh', b'ijkl', b'mnop'):
+            writer.send(data)
+            views.append(pool.recv(reader, 4))
+        # the only chunk is held, the other reads have their own buffers
+        self.assertEqual(([bytes(view) for view in views], pool.allocated),
+                         ([b'abcd', b'efgh', b'ijkl', b'mnop'], 1))
+        del views
+        writer.send(b'qrst')
+        self.assertEqual((bytes(pool.recv(reader, 4)), pool.allocated), (b'qrst', 1))
+        writer.close()
+        reader.close()
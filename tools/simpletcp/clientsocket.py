@@ -1,10 +1,13 @@
 import sys
 import socket
 
+from tools.simpletcp.socketoptions import set_liveness_options
+
 
 class ClientSocket:
     # set single_use to False in the real code.
-    def __init__(self, mode, port, received_bytes=2048, single_use=False):
+    def __init__(self, mode, port, received_bytes=2048, single_use=False, keepalive=None, user_timeout=None,
+                 timeout=None, unix_path=None):
         """
 
         Handle the socket's mode.
@@ -13,6 +16,15 @@ class ClientSocket:
         localhost -> (127.0.0.1)
         public ->    (0.0.0.0)
         otherwise, mode is interpreted as an IP address.
+        keepalive and user_timeout are the TCP liveness options of the
+        connection (see set_liveness_options).
+        timeout is the number of seconds that connecting, or sending data
+        and receiving its response, may take before socket.timeout is
+        raised; a peer which is hung but still connected is noticed with
+        it. None means no timeout.
+        unix_path is the Unix domain socket of a server on this host; if
+        we can connect to it, it is used instead of TCP (the same
+        server listens on both, see ServerSocket).
         """
 
         if mode == "localhost":
@@ -26,17 +38,32 @@ class ClientSocket:
         if type(self.connect_port) != int:
             print("port must be an integer", file=sys.stderr)
             raise ValueError
-        # Actually create an INET, STREAMing socket.socket.
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Save the number of bytes to be read in response
         self.received_bytes = received_bytes
         # Save whether this socket is single-use or not.
         self.single_use = single_use
-        # If this isn't a single-use socket, connect right away.
-        if not self.single_use:
-            self._socket.connect((self.connect_ip, self.connect_port))
-            # Keep track of whether this socket has been closed.
-            self.closed = False
+        # A server on this host skips the TCP stack; if its Unix
+        # socket is missing or stale we use TCP.
+        self.is_unix = False
+        if unix_path is not None and hasattr(socket, "AF_UNIX") and not self.single_use:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            try:
+                self._socket.connect(unix_path)
+                self.is_unix = True
+                self.closed = False
+            except OSError:
+                self._socket.close()
+        if not self.is_unix:
+            # Actually create an INET, STREAMing socket.socket.
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            set_liveness_options(self._socket, keepalive, user_timeout)
+            self._socket.settimeout(timeout)
+            # If this isn't a single-use socket, connect right away.
+            if not self.single_use:
+                self._socket.connect((self.connect_ip, self.connect_port))
+                # Keep track of whether this socket has been closed.
+                self.closed = False
         # Keep track of whether this socket has been used, so we can
         # warn single-use sockets not to send data twice.
         self.used = False
@@ -99,6 +126,28 @@ class ClientSocket:
         # Return the response
         return response
 
+    def peer_closed(self):
+        """
+
+        Checks the connection without sending anything: the server has
+        closed it when the socket is readable and has no data.
+        Returns True if the connection is closed or broken.
+
+        """
+        if self.closed:
+            return True
+        # with a timeout the socket would wait for data before peeking
+        timeout = self._socket.gettimeout()
+        self._socket.setblocking(False)
+        try:
+            return self._socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+        finally:
+            self._socket.settimeout(timeout)
+
     def close(self):
         # If the connection isn't already closed, close it.
         if not self.closed:
@@ -1,13 +1,19 @@
 import errno
+import os
 import queue
-import select
+import selectors
 import socket
+import stat
 import sys
 
+from tools.simpletcp.bufferpool import BufferPool
+from tools.simpletcp.socketoptions import set_liveness_options
+
 
 class ServerSocket:
 
-    def __init__(self, mode, port, read_callback, max_connections, received_bytes):
+    def __init__(self, mode, port, read_callback, max_connections, received_bytes, keepalive=None,
+                 user_timeout=None, unix_path=None, frame_length=None):
         """
         Handle the socket's mode.
         The socket's mode determines the IP address it binds to.
@@ -15,6 +21,26 @@ class ServerSocket:
         localhost -> (127.0.0.1)
         public ->    (0.0.0.0)
         otherwise, mode is interpreted as an IP address.
+        keepalive and user_timeout are the TCP liveness options of the
+        accepted connections (see set_liveness_options), so the
+        connections of dead clients are closed.
+        If unix_path is given, the server also listens on a Unix domain
+        socket at this path for the clients on the same host; a stale
+        socket file of a previous run is replaced. If the path can not
+        be used (e.g. the file is not ours) the server only listens on
+        TCP. The socket file is removed by close.
+        Every read is received into a chunk of a BufferPool and the
+        read_callback receives a read-only memoryview of it; a chunk is
+        reused when the views are gone, so keep a copy of the data
+        which is needed for long.
+        If frame_length is given, the read_callback receives whole
+        frames instead of the reads: frame_length(data) returns the
+        size of the frame which starts with data, or None if that is
+        not known yet. A frame which has come in more than one read is
+        copied together (a frame in one read stays a view). A client
+        sends the next frame after the response of the last one, so
+        the bytes of a connection beyond the frame size (e.g. a frame
+        whose header counts characters) belong to the same frame.
         """
 
         if mode == "localhost":
@@ -33,6 +59,9 @@ class ServerSocket:
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Make it non-blocking.
         self._socket.setblocking(0)
+        # A restarted peer (e.g. the root after a warm restart) can listen
+        # on its port while the old connections are in TIME_WAIT.
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         # Bind the socket, so it can listen.
         self._socket.bind((self.ip, self.port))
         # Save the callback
@@ -42,88 +71,166 @@ class ServerSocket:
         if type(self._max_connections) != int:
             print("max_connections must be an int", file=sys.stderr)
             raise ValueError
+        # Start listening now, the clients can connect before run is called.
+        self._socket.listen(self._max_connections)
         # Save the number of bytes to be received each time we read from
         # a socket
         self.received_bytes = received_bytes
+        self.buffer_pool = BufferPool(chunk_size=max(256 * 1024, received_bytes))
+        self.keepalive = keepalive
+        self.user_timeout = user_timeout
+        self.frame_length = frame_length
+        self._unix_socket = None
+        self._unix_path = None
+        if unix_path is not None and hasattr(socket, "AF_UNIX"):
+            self._bind_unix_socket(unix_path)
+        # close wakes the main loop through this pair
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._closed = False
+
+    def _bind_unix_socket(self, unix_path):
+        unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            # only a socket file is replaced, never another file
+            if os.path.exists(unix_path) and stat.S_ISSOCK(os.lstat(unix_path).st_mode):
+                os.unlink(unix_path)
+            unix_socket.bind(unix_path)
+            unix_socket.listen(self._max_connections)
+        except OSError as e:
+            unix_socket.close()
+            print("can not listen on the Unix socket %s, using TCP only: %s" % (unix_path, e), file=sys.stderr)
+            return
+        unix_socket.setblocking(0)
+        self._unix_socket = unix_socket
+        self._unix_path = unix_path
+
+    def close(self):
+        """
+        Stop the server: run returns and the connections are closed.
+        The Unix socket file is removed at once, so no new client
+        finds it.
+        """
+        if self._unix_path is not None:
+            try:
+                os.unlink(self._unix_path)
+            except OSError:
+                pass
+            self._unix_path = None
+        if not self._closed:
+            self._closed = True
+            self._wakeup_writer.send(b"\0")
 
     def run(self):
-        # Start listening
-        self._socket.listen(self._max_connections)
-        # Create a list of readers (sockets that will be read from) and a list
-        # of writers (sockets that will be written to).
-        readers = [self._socket]
-        writers = []
+        # Use the best selector of the platform (e.g. epoll), select.select can not watch more than 1024 sockets.
+        selector = selectors.DefaultSelector()
+        selector.register(self._socket, selectors.EVENT_READ)
+        selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        listeners = [self._socket]
+        if self._unix_socket is not None:
+            selector.register(self._unix_socket, selectors.EVENT_READ)
+            listeners.append(self._unix_socket)
         # Create a dictionary of queue.Queues for data to be sent.
         # This dictionary maps sockets to queue.Queue objects
         queues = dict()
         # Create a similar dictionary that stores IP addresses.
         # This dictionary maps sockets to IP addresses
         IPs = dict()
+        # The received part of a frame which has not arrived in one read.
+        partials = dict()
         # Now, the main loop.
-        while readers:
+        while not self._closed:
             # Block until a socket is ready for processing.
-            read, write, err = select.select(readers, writers, readers)
-            # Deal with sockets that need to be read from.
-            for sock in read:
-                if sock is self._socket:
-                    # We have a viable connection!
-                    client_socket, client_ip = self._socket.accept()
-                    # Make it a non-blocking connection.
-                    client_socket.setblocking(0)
-                    # Add it to our readers.
-                    readers.append(client_socket)
-                    # Make a queue for it.
-                    queues[client_socket] = queue.Queue()
-                    # Store its IP address.
-                    IPs[client_socket] = client_ip
-                else:
+            for key, events in selector.select():
+                sock = key.fileobj
+                if sock is self._wakeup_reader:
+                    break
+                # Deal with sockets that need to be read from.
+                if events & selectors.EVENT_READ:
+                    if sock in listeners:
+                        # We have a viable connection!
+                        client_socket, client_ip = sock.accept()
+                        # Make it a non-blocking connection.
+                        client_socket.setblocking(0)
+                        if sock is self._socket:
+                            set_liveness_options(client_socket, self.keepalive, self.user_timeout)
+                        # Add it to our readers.
+                        selector.register(client_socket, selectors.EVENT_READ)
+                        # Make a queue for it.
+                        queues[client_socket] = queue.Queue()
+                        # Store its IP address.
+                        IPs[client_socket] = client_ip
+                        continue
                     # Someone sent us something! Let's receive it.
                     try:
-                        data = sock.recv(self.received_bytes)
+                        data = self.buffer_pool.recv(sock, self.received_bytes)
                     except socket.error as e:
-                        if e.errno is errno.ECONNRESET:
-                            # Consider 'Connection reset by peer'
+                        if e.errno in (errno.ECONNRESET, errno.ETIMEDOUT):
+                            # Consider 'Connection reset by peer' and a connection
+                            # which the liveness options have broken
                             # the same as reading zero bytes
                             data = None
                         else:
                             raise e
                     if data:
+                        if self.frame_length is not None:
+                            data = self._frame(sock, data, partials)
+                            if data is None:
+                                # Wait for the rest of the frame.
+                                continue
                         # Call the callback
                         self.callback(IPs[sock], queues[sock], data)
-                        # Put the client socket in writers so we can write to it
-                        # later.
-                        if sock not in writers:
-                            writers.append(sock)
+                        # Watch the client socket for writing so we can write to it later.
+                        selector.modify(sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
                     else:
                         # We received zero bytes, so we should close the stream
-                        # Stop writing to it.
-                        if sock in writers:
-                            writers.remove(sock)
-                        # Stop reading from it.
-                        readers.remove(sock)
+                        selector.unregister(sock)
                         # Close the connection.
                         sock.close()
                         # Destroy is queue
                         del queues[sock]
-            # Deal with sockets that need to be written to.
-            for sock in write:
-                try:
-                    # Get the next chunk of data in the queue, but don't wait.
-                    data = queues[sock].get_nowait()
-                except queue.Empty:
-                    # The queue is empty -> nothing needs to be written.
-                    writers.remove(sock)
-                else:
-                    # The queue wasn't empty; we did, in fact, get something.
-                    # So send it.
-                    sock.send(data)
-            # Deal with errors in sockets.
-            for sock in err:
-                # Remove the socket from every list.
-                readers.remove(sock)
-                if sock in writers:
-                    writers.remove(sock)
-                # Close the connection.
-                sock.close()
-                # Destroy its queue.
-                del queues[sock]
+                        del IPs[sock]
+                        partials.pop(sock, None)
+                        continue
+                # Deal with sockets that need to be written to.
+                if events & selectors.EVENT_WRITE:
+                    try:
+                        # Get the next chunk of data in the queue, but don't wait.
+                        data = queues[sock].get_nowait()
+                    except queue.Empty:
+                        # The queue is empty -> nothing needs to be written.
+                        selector.modify(sock, selectors.EVENT_READ)
+                    else:
+                        # The queue wasn't empty; we did, in fact, get something.
+                        # So send it.
+                        try:
+                            sock.send(data)
+                        except socket.error:
+                            # The client has gone, close the connection like an error in the socket.
+                            selector.unregister(sock)
+                            sock.close()
+                            del queues[sock]
+                            del IPs[sock]
+                            partials.pop(sock, None)
+        # We have been closed, close every socket.
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+        self._wakeup_writer.close()
+
+    def _frame(self, sock, data, partials):
+        """
+
+        Adds a read to the frame of the connection.
+        Returns the whole frame, or None if it has not arrived yet.
+
+        """
+        partial = partials.pop(sock, None)
+        if partial is not None:
+            partial += data
+            data = partial
+        size = self.frame_length(data)
+        if size is None or len(data) < size:
+            # A copy, so the chunk of the read is not held.
+            partials[sock] = partial if partial is not None else bytearray(data)
+            return None
+        return data if partial is None else bytes(partial)
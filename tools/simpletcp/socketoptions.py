@@ -0,0 +1,28 @@
+import socket
+
+
+def set_liveness_options(sock, keepalive=None, user_timeout=None):
+    """
+
+    Make the kernel notice a dead connection, e.g. a peer whose host
+    has crashed, which never sends us a FIN or a RST.
+    keepalive is (idle, interval, count) in seconds: after 'idle'
+    seconds without traffic the kernel sends a probe every 'interval'
+    seconds and breaks the connection after 'count' unanswered probes.
+    user_timeout is the maximum number of seconds that sent data may
+    stay unacknowledged (TCP_USER_TIMEOUT) before the connection is
+    broken.
+    None keeps the system defaults; the options which the platform
+    does not have are skipped.
+
+    """
+    if keepalive is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        idle, interval, count = keepalive
+        # macOS names TCP_KEEPIDLE TCP_KEEPALIVE
+        for name, value in (("TCP_KEEPIDLE", idle), ("TCP_KEEPALIVE", idle),
+                            ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count)):
+            if hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), max(1, int(value)))
+    if user_timeout is not None and hasattr(socket, "TCP_USER_TIMEOUT"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(user_timeout * 1000))
@@ -17,17 +17,28 @@ class TCPServer:
      is a tunnel of data to send to the socket that it received from.
      The third argument must be data, which is a string of bytes
      that the server received.
+     keepalive and user_timeout are the TCP liveness options of the
+     accepted connections (see set_liveness_options).
+     unix_path is a Unix domain socket which the server also listens on
+     for the clients on the same host; close removes it.
+     frame_length makes the server hand up whole frames instead of the
+     reads (see ServerSocket).
     """
 
     def __init__(self, mode, port, read_callback,
-                 maximum_connections=5, receive_bytes=2048):
+                 maximum_connections=5, receive_bytes=2048, keepalive=None, user_timeout=None, unix_path=None,
+                 frame_length=None):
         self.server_socket = ServerSocket(
-            mode, port, read_callback, maximum_connections, receive_bytes
+            mode, port, read_callback, maximum_connections, receive_bytes, keepalive, user_timeout, unix_path,
+            frame_length
         )
 
     def run(self):
         self.server_socket.run()
 
+    def close(self):
+        self.server_socket.close()
+
     @property
     def ip(self):
         return self.server_socket.ip